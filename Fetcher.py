@@ -9,15 +9,25 @@ import pandas_datareader as pdr
 import yfinance as yf
 
 import option
+import db
+import schema
 
 # https://www.geeksforgeeks.org/python-stock-data-visualisation/
 
 class Fetcher(object):
 
-    def __init__(self, opt, db_connection):
+    def __init__(self, opt, db_connection, db_manager = None):
         # opt is an option instance
         self.opt = opt
         self.db_connection = db_connection
+        # with a db.DatabaseManager all writes go through its single serialized writer connection
+        self.db_manager = db_manager
+
+    def _get_writer(self):
+        # both context managers commit at the end of the block and roll back on an exception
+        if self.db_manager is not None:
+            return(self.db_manager.writer())
+        return(self.db_connection)
 
     def get_daily_from_yahoo(self, ticker, start_date, end_date):
         stock = yf.Ticker(ticker)                                                  #object representing stock/financial instrument to be called
@@ -68,15 +78,6 @@ class Fetcher(object):
 
         ticker = os.path.basename(csv_file_name).replace('.csv','').replace("_daily", "")
         print(ticker)
-        cursor = self.db_connection.cursor()
-
-        # Delete old data for the ticker
-        sql_delete = f"DELETE FROM {db_table} WHERE Ticker = '{ticker}'"
-        #print(sql_delete)
-        cursor.execute(sql_delete)
-        
-        #print(new_df)
-        data = new_df.values.tolist()
 
         # Insert new data with IGNORE clause to handle duplicates
         sql_insert = f"INSERT OR REPLACE INTO {db_table} (Ticker, AsOfDate, Open, High, Low, Close, Volume, TurnOver, Dividend) "
@@ -84,10 +85,21 @@ class Fetcher(object):
         #print(sql_insert)
 
         try:
-            cursor.executemany(sql_insert, data)
-            self.db_connection.commit()
-            # Close the cursor and database connection
-            cursor.close()
+            # the delete and the inserts are one transaction, so readers never see the ticker half loaded
+            with self._get_writer() as db_connection:
+                # a new database gets the current typed layout
+                schema.create_daily_price_table(db_connection)
+                version = schema.get_schema_version(db_connection)
+                if version >= 2:
+                    new_df['AsOfDate'] = schema.to_sql_dates(version, new_df['AsOfDate'])
+                #print(new_df)
+                data = new_df.values.tolist()
+
+                cursor = db_connection.cursor()
+                # Delete old data for the ticker
+                cursor.execute(f"DELETE FROM {db_table} WHERE Ticker = ?", (ticker,))
+                cursor.executemany(sql_insert, data)
+                cursor.close()
             # Print that data successfully inserted
             print("Data inserted successfully!")
         except Exception as e:
@@ -108,8 +120,11 @@ class Fetcher(object):
             #print(file_name)
             self.csv_to_table(file_name, fields_map, db_table)
 
-        #close the db connection
-        sqlite3.connect(db_file).close()
+        if self.db_manager is not None:
+            with self.db_manager.writer() as db_connection:
+                schema.create_price_index(db_connection)
+        else:
+            schema.create_price_index(self.db_connection)
 
     def test(self):
         ticker = 'MSFT'
@@ -143,10 +158,8 @@ def run():
     print(list_of_tickers)
     print(opt.start_date, opt.end_date)
 
-    db_file = opt.sqlite_db
-    db_connection = sqlite3.connect(db_file)
-    
-    fetcher = Fetcher(opt, db_connection)
+    db_manager = db.get_manager(opt.sqlite_db)
+    fetcher = Fetcher(opt, db_manager.get_writer(), db_manager)
     print(f"Download data to {opt.data_dir} directory")
 
     fetcher.download_data_to_csv(list_of_tickers)
@@ -12,8 +12,9 @@ from scipy.stats import norm
 
 from math import log, exp, sqrt
 import option
+import ta_kernels
 
-from stock import Stock
+from stock import Stock, load_daily_hist_panel
 
 
 class SimpleMovingAverages(object):
@@ -49,22 +50,52 @@ class SimpleMovingAverages(object):
         '''
         for period in self.periods:
             self._sma[period] = self._calc(period, price_source)
-    
-    def get_series(self, period):
+
+    def run_all(self, price_sources = ('Open', 'High', 'Low', 'Close'), compensated = False):
+        '''
+        Calculate the SMAs of every period for every price source in one pass: one cumulative sum per
+        price column, every window derived from it by differencing (see ta_kernels.rolling_mean_multi).
+        compensated=True uses compensated summation for long histories.
+        Returns a DataFrame with (price_source, period) MultiIndex columns; the Close columns (or the
+        first price source) also fill the series returned by get_series
+        '''
+        for price_source in price_sources:
+            if price_source not in self.ohlcv_df.columns:
+                raise ValueError(f"'{price_source}' is not a valid column in the OHLCV DataFrame.")
+
+        prices = self.ohlcv_df[list(price_sources)].to_numpy(dtype=np.float64)
+        sma = ta_kernels.rolling_mean_multi(prices, self.periods, compensated)    # periods x rows x sources
+
+        columns = pd.MultiIndex.from_product([list(price_sources), list(self.periods)], names=['price_source', 'period'])
+        result = pd.DataFrame(sma.transpose(1, 2, 0).reshape(prices.shape[0], -1), index=self.ohlcv_df.index,
+                              columns=columns)
+
+        default_source = 'Close' if 'Close' in price_sources else price_sources[0]
+        for period in self.periods:
+            self._sma[period] = result[(default_source, period)].rename(default_source)
+        self._sma_all = result
+        return(result)
+
+    def get_series(self, period, price_source = None):
+        if price_source is not None:
+            return(self._sma_all[(price_source, period)])
         return(self._sma[period])
 
     
 class ExponentialMovingAverages(object):
     '''
     On given a OHLCV data frame, calculate corresponding simple moving averages
+    The EMAs are ('ema', ('price', 'Close'), period) nodes of an IndicatorGraph; pass the graph of
+    other indicators on the same frame to share them
     '''
-    def __init__(self, ohlcv_df, periods):
+    def __init__(self, ohlcv_df, periods, graph = None):
         #
         self.ohlcv_df = ohlcv_df
         self.periods = periods
+        self.graph = graph
         self._ema = {}
 
-    def _calc(self, period):
+    def _calc(self, period, graph):
         '''
         for a given period, calc the SMA as a pandas series
         '''
@@ -73,7 +104,8 @@ class ExponentialMovingAverages(object):
         if 'Close' not in self.ohlcv_df.columns:                                                # check if the specified 'Close' is not a valid column in the OHLCV DataFrame.
             raise ValueError("OHLCV DataFrame must have a 'Close' column to calculate EMA.")    # if it's not a valid column, raise an error & provide an error message
         try:                                                                                    # calculate the EMA using the 'Close' column for the specified period.
-            result = self.ohlcv_df['Close'].ewm(span=period, adjust=False).mean()               # the 'adjust' parameter specifies how to normalize the EMA (True for unbiased, False for biased).
+            key = ('ema', ('price', 'Close'), period)                                           # the 'ema' node is ewm(span=period, adjust=False) of its source
+            result = graph.run([key])[key]
         except Exception as e:
             print(f"Error calculating EMA: {e}")                                                # if there's an error during the calculation, print an error message along w/ the specific error details
 
@@ -83,47 +115,66 @@ class ExponentialMovingAverages(object):
         '''
         Calculate all the simple moving averages as a dict
         '''
+        graph = self.graph if self.graph is not None else IndicatorGraph(self.ohlcv_df)
         for period in self.periods:
-            self._ema[period] = self._calc(period)
+            self._ema[period] = self._calc(period, graph)
 
     def get_series(self, period):
         return(self._ema[period])
 
 
 class RSI(object):
+    '''
+    RSI of Close from the EMAs of gains and losses, the ('rsi', ('price', 'Close'), period) node of an
+    IndicatorGraph; pass the graph of other indicators on the same frame to share the price differences
+    '''
 
-    def __init__(self, ohlcv_df, period = 14):
+    def __init__(self, ohlcv_df, period = 14, graph = None):
         self.ohlcv_df = ohlcv_df
         self.period = period
+        self.graph = graph
         self.rsi = None
 
     def get_series(self):
         return(self.rsi)
 
     def run(self):
-        
-        price_differences = self.ohlcv_df['Close'].diff(1)          # calculate price differences
-
-        gain = price_differences.where(price_differences > 0, 0)    # separates gains and losses 
-        loss = -price_differences.where(price_differences < 0, 0)
-     
-        avg_gain = gain.ewm(span=self.period, adjust=False).mean()  # calculates avg gain and loss w/ EMA
-        avg_loss = loss.ewm(span=self.period, adjust=False).mean()
-        
-        rs = avg_gain / avg_loss            # calculate relative strength (given formula)
-        
-        self.rsi = 100 - (100 / (1 + rs))   # given
+        # price differences, gains and losses, their EMAs and the relative strength are graph nodes
+        key = ('rsi', ('price', 'Close'), self.period)
+        graph = self.graph if self.graph is not None else IndicatorGraph(self.ohlcv_df)
+        self.rsi = graph.run([key])[key]
 
 class VWAP(object):
-
-    def __init__(self, ohlcv_df):
+    '''
+    Volume weighted average price. By default one cumulative VWAP of Close from the first row.
+    Alternatively
+      anchor        accumulate from the first bar on or after an anchor date, NaN before it
+      reset         restart the accumulation every session: 'D' (day), 'W' (week) or 'M' (month)
+      window        VWAP over the last window bars
+    and typical_price=True weights (High + Low + Close) / 3 instead of Close
+    '''
+    def __init__(self, ohlcv_df, anchor = None, reset = None, window = None, typical_price = False):
         self.ohlcv_df = ohlcv_df
+        self.anchor = anchor
+        self.reset = reset
+        self.window = window
+        self.typical_price = typical_price
         self.vwap = None
 
     def get_series(self):
         return(self.vwap)
 
     def run(self):
+        if self.anchor is None and self.reset is None and self.window is None and not self.typical_price:
+            self._run_cumulative()
+            return
+
+        price = _vwap_price(self.ohlcv_df, self.typical_price)
+        volume = self.ohlcv_df['Volume'].to_numpy(dtype=np.float64)
+        values = _calc_vwap_modes(price, volume, self.ohlcv_df.index, self.anchor, self.reset, self.window)
+        self.vwap = pd.Series(values, index=self.ohlcv_df.index)
+
+    def _run_cumulative(self):
         # Step 1: Calculate the product of Price and Volume for each data point.
         price_volume_product = self.ohlcv_df['Close'] * self.ohlcv_df['Volume']
 
@@ -136,6 +187,1109 @@ class VWAP(object):
         # Step 4: Calculate the VWAP as the ratio of cumulative Price-Volume to cumulative volume.
         self.vwap = cumulative_price_volume / cumulative_volume
 
+def _vwap_price(fields, typical_price):
+    # Close, or the typical price (High + Low + Close) / 3, of a DataFrame or a dict of arrays
+    if typical_price:
+        return((np.asarray(fields['High'], dtype=np.float64) + np.asarray(fields['Low'], dtype=np.float64) +
+                np.asarray(fields['Close'], dtype=np.float64)) / 3)
+    return(np.asarray(fields['Close'], dtype=np.float64))
+
+def _vwap_segments(dates, anchor = None, reset = None):
+    '''
+    return (starts, active): the rows where a VWAP accumulation starts and the rows it covers.
+    anchor is one date or a sequence of one date per column, reset a 'D', 'W' or 'M' session
+    '''
+    days = pd.DatetimeIndex(pd.to_datetime(pd.Index(dates)))
+    if anchor is not None and reset is not None:
+        raise ValueError("VWAP takes an anchor or a session reset, not both")
+
+    if reset is not None:
+        if reset not in ('D', 'W', 'M'):
+            raise ValueError(f"Unknown VWAP session reset '{reset}', expected 'D', 'W' or 'M'")
+        periods = days.to_period(reset).asi8
+        starts = np.ones(len(days), dtype=bool)
+        starts[1:] = periods[1:] != periods[:-1]
+        return(starts, np.ones(len(days), dtype=bool))
+
+    if anchor is None:
+        active = np.ones(len(days), dtype=bool)
+    elif np.ndim(anchor) == 0:
+        active = days >= pd.Timestamp(anchor)
+    else:
+        anchors = pd.DatetimeIndex(pd.to_datetime(pd.Index(anchor))).asi8
+        active = days.asi8[:, None] >= anchors[None, :]
+    starts = active.copy()
+    starts[1:] &= ~active[:-1]
+    return(starts, active)
+
+def _calc_vwap_modes(price, volume, dates, anchor = None, reset = None, window = None):
+    '''
+    VWAP of 1-D or dates x tickers price and volume arrays for the anchor, reset and window modes
+    '''
+    price_volume = price * volume
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if window is not None:
+            if anchor is not None or reset is not None:
+                raise ValueError("A rolling VWAP window cannot be combined with an anchor or a session reset")
+            # the ratio of the window means is the ratio of the window sums
+            return(ta_kernels.rolling_mean_multi(price_volume, [window])[0] /
+                   ta_kernels.rolling_mean_multi(volume, [window])[0])
+
+        starts, active = _vwap_segments(dates, anchor, reset)
+        values = ta_kernels.segmented_cumsum(price_volume, starts) / ta_kernels.segmented_cumsum(volume, starts)
+    if active.ndim < values.ndim:
+        active = active.reshape(active.shape + (1,) * (values.ndim - active.ndim))
+    return(np.where(active, values, np.nan))
+
+def _calc_bollinger_bands(price, period, num_std):
+    # middle band and the bands num_std population standard deviations above and below it
+    mean, var = ta_kernels.rolling_mean_var(price, period, ddof=0)
+    std = np.sqrt(var)
+    return({'middle': mean, 'upper': mean + num_std * std, 'lower': mean - num_std * std})
+
+def _calc_zscore(price, period):
+    mean, var = ta_kernels.rolling_mean_var(price, period, ddof=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return((np.asarray(price, dtype=np.float64) - mean) / np.sqrt(var))
+
+def _calc_atr(high, low, close, period):
+    # Wilder's smoothing of the true range, an EMA with alpha = 1 / period
+    return(ta_kernels.ewm_mean(ta_kernels.true_range(high, low, close), 2 * period - 1))
+
+def _calc_macd(close, fast, slow, signal):
+    macd = ta_kernels.ewm_mean(close, fast) - ta_kernels.ewm_mean(close, slow)
+    signal_line = ta_kernels.ewm_mean(macd, signal)
+    return({'macd': macd, 'signal': signal_line, 'histogram': macd - signal_line})
+
+def _calc_realized_volatility(close, period, periods_per_year):
+    close = np.asarray(close, dtype=np.float64)
+    log_returns = np.full_like(close, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_returns[1:] = np.log(close[1:] / close[:-1])
+    mean, var = ta_kernels.rolling_mean_var(log_returns, period, ddof=1)
+    return(np.sqrt(var * periods_per_year))
+
+
+class BollingerBands(object):
+    '''
+    Middle band: the period SMA of price_source; upper and lower bands: num_std population standard
+    deviations of the same window above and below it
+    '''
+    def __init__(self, ohlcv_df, period = 20, num_std = 2, price_source = 'Close'):
+        self.ohlcv_df = ohlcv_df
+        self.period = period
+        self.num_std = num_std
+        self.price_source = price_source
+        self._bands = {}
+
+    def run(self):
+        bands = _calc_bollinger_bands(self.ohlcv_df[self.price_source].to_numpy(dtype=np.float64), self.period, self.num_std)
+        self._bands = {k: pd.Series(v, index=self.ohlcv_df.index) for k, v in bands.items()}
+
+    def get_series(self, band = 'middle'):
+        '''
+        band is 'middle', 'upper' or 'lower'
+        '''
+        return(self._bands[band])
+
+class RollingZScore(object):
+    '''
+    Distance of price_source from its period SMA in population standard deviations of the window,
+    so +/- num_std are the Bollinger bands
+    '''
+    def __init__(self, ohlcv_df, period = 20, price_source = 'Close'):
+        self.ohlcv_df = ohlcv_df
+        self.period = period
+        self.price_source = price_source
+        self.zscore = None
+
+    def run(self):
+        values = _calc_zscore(self.ohlcv_df[self.price_source].to_numpy(dtype=np.float64), self.period)
+        self.zscore = pd.Series(values, index=self.ohlcv_df.index)
+
+    def get_series(self):
+        return(self.zscore)
+
+class ATR(object):
+    '''
+    Average true range with Wilder's smoothing, started at the first bar's high - low
+    '''
+    def __init__(self, ohlcv_df, period = 14):
+        self.ohlcv_df = ohlcv_df
+        self.period = period
+        self.atr = None
+
+    def run(self):
+        high, low, close = [self.ohlcv_df[f].to_numpy(dtype=np.float64) for f in ('High', 'Low', 'Close')]
+        self.atr = pd.Series(_calc_atr(high, low, close, self.period), index=self.ohlcv_df.index)
+
+    def get_series(self):
+        return(self.atr)
+
+class MACD(object):
+    '''
+    MACD line EMA(fast) - EMA(slow) of Close, its signal EMA and the histogram between them
+    '''
+    def __init__(self, ohlcv_df, fast = 12, slow = 26, signal = 9):
+        self.ohlcv_df = ohlcv_df
+        self.fast = fast
+        self.slow = slow
+        self.signal = signal
+        self._lines = {}
+
+    def run(self):
+        lines = _calc_macd(self.ohlcv_df['Close'].to_numpy(dtype=np.float64), self.fast, self.slow, self.signal)
+        self._lines = {k: pd.Series(v, index=self.ohlcv_df.index) for k, v in lines.items()}
+
+    def get_series(self, line = 'macd'):
+        '''
+        line is 'macd', 'signal' or 'histogram'
+        '''
+        return(self._lines[line])
+
+class RealizedVolatility(object):
+    '''
+    Annualized sample standard deviation of the daily log returns of Close over period bars
+    '''
+    def __init__(self, ohlcv_df, period = 20, periods_per_year = 252):
+        self.ohlcv_df = ohlcv_df
+        self.period = period
+        self.periods_per_year = periods_per_year
+        self.volatility = None
+
+    def run(self):
+        values = _calc_realized_volatility(self.ohlcv_df['Close'].to_numpy(dtype=np.float64), self.period,
+                                           self.periods_per_year)
+        self.volatility = pd.Series(values, index=self.ohlcv_df.index)
+
+    def get_series(self):
+        return(self.volatility)
+
+class PricePanel(object):
+    '''
+    OHLCV prices of many tickers as aligned dates x tickers 2-D arrays, one per field.
+    A ticker without a bar on a date (missing bar, not yet listed, delisted) has NaN in every field,
+    and mask marks the dates where it has a Close
+    '''
+    FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+    def __init__(self, dates, tickers, fields):
+        self.dates = dates
+        self.tickers = list(tickers)
+        self.fields = fields
+        self.mask = ~np.isnan(fields['Close'])
+
+    @classmethod
+    def from_db(cls, db_connection, tickers, start_date, end_date):
+        '''
+        load the panel from EquityDailyPrice with stock.load_daily_hist_panel
+        '''
+        dates, tickers, fields = load_daily_hist_panel(db_connection, tickers, start_date, end_date, cls.FIELDS)
+        return(cls(dates, tickers, fields))
+
+    @classmethod
+    def from_store(cls, store, tickers, start_date, end_date):
+        '''
+        load the panel from an OHLCVStore, reading only the rows of each ticker between the dates
+        '''
+        arrays = [store.get_arrays(t, start_date, end_date) for t in tickers]
+        days = np.concatenate([a['Day'] for a in arrays]) if arrays else np.zeros(0, dtype=np.int32)
+        unique_days, date_codes = np.unique(days, return_inverse=True)
+        ticker_codes = np.repeat(np.arange(len(arrays)), [len(a['Day']) for a in arrays])
+
+        fields = {}
+        for f in cls.FIELDS:
+            values = np.full((len(unique_days), len(arrays)), np.nan)
+            if arrays:
+                values[date_codes, ticker_codes] = np.concatenate([a[f] for a in arrays])
+            fields[f] = values
+        dates = (np.datetime64('1970-01-01', 'D') + unique_days.astype('timedelta64[D]')).astype(object)
+        return(cls(pd.Index(dates, name='Date'), tickers, fields))
+
+    @classmethod
+    def from_long_frame(cls, df, tickers = None):
+        '''
+        pivot a long frame with Ticker, AsOfDate and OHLCV columns into a panel
+        '''
+        date_codes, dates = pd.factorize(df['AsOfDate'], sort=True)
+        if tickers is None:
+            ticker_codes, tickers = pd.factorize(df['Ticker'], sort=True)
+        else:
+            ticker_codes = pd.Index(list(tickers)).get_indexer(df['Ticker'])
+
+        fields = {}
+        for f in cls.FIELDS:
+            values = np.full((len(dates), len(tickers)), np.nan)
+            values[date_codes, ticker_codes] = df[f].to_numpy(dtype=np.float64)
+            fields[f] = values
+        return(cls(pd.Index(dates, name='Date'), tickers, fields))
+
+    @classmethod
+    def from_frames(cls, ohlcv_dfs):
+        '''
+        build a panel from a dict of ticker -> OHLCV DataFrame indexed by date
+        '''
+        frames = []
+        for ticker, df in ohlcv_dfs.items():
+            frame = df[list(cls.FIELDS)].copy()
+            frame['Ticker'] = ticker
+            frame['AsOfDate'] = df.index
+            frames.append(frame)
+        return(cls.from_long_frame(pd.concat(frames, ignore_index=True), list(ohlcv_dfs.keys())))
+
+    def to_frame(self, values):
+        '''
+        wrap a dates x tickers array as a DataFrame
+        '''
+        return(pd.DataFrame(values, index=self.dates, columns=self.tickers))
+
+
+class PanelIndicators(object):
+    '''
+    SMA, EMA, RSI and VWAP for every ticker of a PricePanel, each in one vectorized pass along the
+    time axis. Every ticker's valid bars are packed together first (ta_kernels.pack_valid), so each
+    column gets the same values as the single ticker classes on that ticker's own bars, and the
+    results are NaN where the ticker has no bar
+    '''
+    def __init__(self, panel):
+        self.panel = panel
+        self._packed = {}
+        self._packed_close, self._order = ta_kernels.pack_valid(panel.fields['Close'], panel.mask)
+
+    def _pack(self, field):
+        if field not in self._packed:
+            self._packed[field] = np.take_along_axis(self.panel.fields[field], self._order, axis=0)
+        return(self._packed[field])
+
+    def _unpack(self, packed):
+        return(ta_kernels.unpack_valid(packed, self._order, self.panel.mask))
+
+    def sma(self, periods, price_source = 'Close'):
+        '''
+        return a dict of period -> dates x tickers SMA array
+        '''
+        sma = ta_kernels.rolling_mean_multi(self._pack(price_source), periods)
+        return({p: self._unpack(sma[i]) for i, p in enumerate(periods)})
+
+    def ema(self, periods):
+        '''
+        return a dict of period -> dates x tickers EMA array of Close
+        '''
+        return({p: self._unpack(ta_kernels.ewm_mean(self._packed_close, p)) for p in periods})
+
+    def rsi(self, period = 14):
+        close = self._packed_close
+        price_differences = np.zeros_like(close)
+        price_differences[1:] = close[1:] - close[:-1]
+
+        gain = np.where(price_differences > 0, price_differences, 0.0)
+        loss = -np.where(price_differences < 0, price_differences, 0.0)
+
+        avg_gain = ta_kernels.ewm_mean(gain, period)
+        avg_loss = ta_kernels.ewm_mean(loss, period)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = avg_gain / avg_loss
+        return(self._unpack(100 - (100 / (1 + rs))))
+
+    def vwap(self, anchor = None, reset = None, window = None, typical_price = False):
+        '''
+        return the dates x tickers VWAP, cumulative from each ticker's first bar by default; see VWAP
+        for the anchor (one date or one per ticker), reset, window and typical_price modes
+        '''
+        if anchor is None and reset is None and window is None and not typical_price:
+            close = self._packed_close
+            volume = self._pack('Volume')
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return(self._unpack(np.cumsum(close * volume, axis=0) / np.cumsum(volume, axis=0)))
+
+        fields = self.panel.fields
+        if window is not None:
+            # rolling windows count each ticker's own bars, so they run on the packed rows
+            packed = {f: self._pack(f) for f in (('High', 'Low', 'Close') if typical_price else ('Close',))}
+            values = _calc_vwap_modes(_vwap_price(packed, typical_price), self._pack('Volume'), None, window=window)
+            return(self._unpack(values))
+
+        # anchors and sessions are calendar dates, shared by all tickers, so they run on the dates;
+        # a missing bar adds nothing to the sums
+        values = _calc_vwap_modes(_vwap_price(fields, typical_price), fields['Volume'], self.panel.dates, anchor, reset)
+        values[~self.panel.mask] = np.nan
+        return(values)
+
+    def bollinger_bands(self, period = 20, num_std = 2, price_source = 'Close'):
+        '''
+        return a dict of 'middle', 'upper', 'lower' -> dates x tickers array
+        '''
+        bands = _calc_bollinger_bands(self._pack(price_source), period, num_std)
+        return({k: self._unpack(v) for k, v in bands.items()})
+
+    def zscore(self, period = 20, price_source = 'Close'):
+        return(self._unpack(_calc_zscore(self._pack(price_source), period)))
+
+    def atr(self, period = 14):
+        return(self._unpack(_calc_atr(self._pack('High'), self._pack('Low'), self._packed_close, period)))
+
+    def macd(self, fast = 12, slow = 26, signal = 9):
+        '''
+        return a dict of 'macd', 'signal', 'histogram' -> dates x tickers array
+        '''
+        return({k: self._unpack(v) for k, v in _calc_macd(self._packed_close, fast, slow, signal).items()})
+
+    def realized_volatility(self, period = 20, periods_per_year = 252):
+        return(self._unpack(_calc_realized_volatility(self._packed_close, period, periods_per_year)))
+
+
+# Indicator registry: name -> (dependencies, compute).
+# An indicator is requested by a key tuple (name, source, *params) whose source is itself a key, for
+# example ('sma', ('price', 'Close'), 20) or ('rsi', ('price', 'Close'), 14); ('price', column) is the
+# leaf reading a column of the frame. dependencies(key) returns the keys it needs and
+# compute(ohlcv_df, key, inputs) returns its pandas Series from the list of dependency Series, so
+# shared intermediates (price differences, EMAs, rolling std) are keys of their own and are evaluated
+# once per IndicatorGraph.
+INDICATOR_REGISTRY = {}
+
+def register_indicator(name, dependencies):
+    '''
+    decorator registering compute under name; dependencies maps a key to the list of keys it needs
+    '''
+    def decorator(compute):
+        INDICATOR_REGISTRY[name] = (dependencies, compute)
+        return(compute)
+    return(decorator)
+
+@register_indicator('price', lambda key: [])
+def _indicator_price(ohlcv_df, key, inputs):
+    return(ohlcv_df[key[1]])
+
+@register_indicator('diff', lambda key: [key[1]])
+def _indicator_diff(ohlcv_df, key, inputs):
+    return(inputs[0].diff(1))
+
+@register_indicator('returns', lambda key: [('diff', key[1]), key[1]])
+def _indicator_returns(ohlcv_df, key, inputs):
+    return(inputs[0] / inputs[1].shift(1))
+
+@register_indicator('gain', lambda key: [('diff', key[1])])
+def _indicator_gain(ohlcv_df, key, inputs):
+    return(inputs[0].where(inputs[0] > 0, 0))
+
+@register_indicator('loss', lambda key: [('diff', key[1])])
+def _indicator_loss(ohlcv_df, key, inputs):
+    return(-inputs[0].where(inputs[0] < 0, 0))
+
+@register_indicator('ema', lambda key: [key[1]])
+def _indicator_ema(ohlcv_df, key, inputs):
+    return(inputs[0].ewm(span=key[2], adjust=False).mean())
+
+@register_indicator('sma', lambda key: [key[1]])
+def _indicator_sma(ohlcv_df, key, inputs):
+    return(inputs[0].rolling(window=key[2]).mean())
+
+@register_indicator('rolling_std', lambda key: [key[1]])
+def _indicator_rolling_std(ohlcv_df, key, inputs):
+    # ('rolling_std', source, period) is the sample std, ('rolling_std', source, period, 0) the population std
+    return(inputs[0].rolling(window=key[2]).std(ddof=key[3] if len(key) > 3 else 1))
+
+@register_indicator('rsi', lambda key: [('ema', ('gain', key[1]), key[2]), ('ema', ('loss', key[1]), key[2])])
+def _indicator_rsi(ohlcv_df, key, inputs):
+    rs = inputs[0] / inputs[1]
+    return(100 - (100 / (1 + rs)))
+
+@register_indicator('vwap', lambda key: [key[1], ('price', 'Volume')])
+def _indicator_vwap(ohlcv_df, key, inputs):
+    return((inputs[0] * inputs[1]).cumsum() / inputs[1].cumsum())
+
+# The volatility indicators as graph nodes, on the same 'sma', 'rolling_std' and 'ema' nodes as
+# everything else: ('bollinger', source, period, num_std, band) with band 'middle', 'upper' or 'lower',
+# ('zscore', source, period), ('atr', ('true_range',), period), ('macd', source, fast, slow) whose
+# signal line is ('ema', ('macd', source, fast, slow), signal), ('macd_histogram', source, fast, slow,
+# signal) and ('realized_volatility', source, period, periods_per_year)
+@register_indicator('bollinger', lambda key: [('sma', key[1], key[2]), ('rolling_std', key[1], key[2], 0)])
+def _indicator_bollinger(ohlcv_df, key, inputs):
+    sign = {'middle': 0, 'upper': 1, 'lower': -1}[key[4]]
+    return(inputs[0] + sign * key[3] * inputs[1])
+
+@register_indicator('zscore', lambda key: [key[1], ('sma', key[1], key[2]), ('rolling_std', key[1], key[2], 0)])
+def _indicator_zscore(ohlcv_df, key, inputs):
+    return((inputs[0] - inputs[1]) / inputs[2])
+
+@register_indicator('true_range', lambda key: [('price', 'High'), ('price', 'Low'), ('price', 'Close')])
+def _indicator_true_range(ohlcv_df, key, inputs):
+    return(pd.Series(ta_kernels.true_range(*[x.to_numpy(dtype=np.float64) for x in inputs]), index=inputs[0].index))
+
+@register_indicator('atr', lambda key: [('ema', key[1], 2 * key[2] - 1)])
+def _indicator_atr(ohlcv_df, key, inputs):
+    # Wilder's smoothing with alpha = 1 / period is the EMA of span 2 * period - 1
+    return(inputs[0])
+
+@register_indicator('macd', lambda key: [('ema', key[1], key[2]), ('ema', key[1], key[3])])
+def _indicator_macd(ohlcv_df, key, inputs):
+    return(inputs[0] - inputs[1])
+
+@register_indicator('macd_histogram', lambda key: [('macd', key[1], key[2], key[3]),
+                                                   ('ema', ('macd', key[1], key[2], key[3]), key[4])])
+def _indicator_macd_histogram(ohlcv_df, key, inputs):
+    return(inputs[0] - inputs[1])
+
+@register_indicator('log_returns', lambda key: [key[1]])
+def _indicator_log_returns(ohlcv_df, key, inputs):
+    return(np.log(inputs[0] / inputs[0].shift(1)))
+
+@register_indicator('realized_volatility', lambda key: [('rolling_std', ('log_returns', key[1]), key[2])])
+def _indicator_realized_volatility(ohlcv_df, key, inputs):
+    return(inputs[0] * np.sqrt(key[3]))
+
+
+class IndicatorGraph(object):
+    '''
+    Resolves a set of requested indicator keys for one ticker's OHLCV data frame into a deduplicated
+    computation graph and evaluates every node once, sharing intermediates between indicators.
+    Results are kept, so later requests on the same graph reuse everything already computed
+    '''
+    def __init__(self, ohlcv_df):
+        self.ohlcv_df = ohlcv_df
+        self._values = {}
+
+    @staticmethod
+    def resolve(keys):
+        '''
+        return the distinct keys needed for keys, dependencies first
+        '''
+        order = []
+        visiting = set()
+        done = set()
+
+        def visit(key):
+            if key in done:
+                return
+            if not isinstance(key, tuple) or len(key) == 0:
+                raise ValueError(f"Indicator keys are tuples (name, source key, *params), got {key!r}")
+            if key in visiting:
+                raise ValueError(f"Cyclic indicator dependency at {key}")
+            if key[0] not in INDICATOR_REGISTRY:
+                raise ValueError(f"Unknown indicator '{key[0]}'")
+            visiting.add(key)
+            for dependency in INDICATOR_REGISTRY[key[0]][0](key):
+                visit(dependency)
+            visiting.discard(key)
+            done.add(key)
+            order.append(key)
+
+        for key in keys:
+            visit(key)
+        return(order)
+
+    def run(self, keys):
+        '''
+        evaluate keys and everything they depend on, return a dict of key -> Series for keys
+        '''
+        for key in self.resolve(keys):
+            if key not in self._values:
+                dependencies, compute = INDICATOR_REGISTRY[key[0]]
+                self._values[key] = compute(self.ohlcv_df, key, [self._values[d] for d in dependencies(key)])
+        return({key: self._values[key] for key in keys})
+
+    def get_series(self, key):
+        return(self._values[key])
+
+def _neumaier_add(total, compensation, x):
+    '''
+    compensated (Neumaier) summation step, returns the new (total, compensation)
+    '''
+    t = total + x
+    if abs(total) >= abs(x):
+        compensation += (total - t) + x
+    else:
+        compensation += (x - t) + total
+    return(t, compensation)
+
+
+class IncrementalSimpleMovingAverages(object):
+    '''
+    Streaming version of SimpleMovingAverages: update(bar) costs O(1) per period.
+    A ring buffer keeps the last max(periods) prices and every period keeps a compensated
+    running sum, so the value leaving the window is subtracted instead of re-summing the window.
+    A missing (NaN) price stays out of the sums and, as with pandas rolling().mean(), makes the
+    SMA of every window holding it NaN
+    '''
+    def __init__(self, periods, price_source = 'Close'):
+        self.periods = periods
+        self.price_source = price_source
+        self._window = max(periods)
+        self._buffer = np.zeros(self._window)
+        self._pos = 0
+        self._count = 0
+        self._sum = {p: (0.0, 0.0) for p in periods}
+        self._missing = {p: 0 for p in periods}
+        self._sma = {p: np.nan for p in periods}
+
+    @classmethod
+    def from_batch(cls, smas, price_source = 'Close'):
+        '''
+        warm start from a SimpleMovingAverages object, continuing after the last row of its ohlcv_df
+        '''
+        result = cls(smas.periods, price_source)
+        for price in smas.ohlcv_df[price_source].iloc[-result._window:]:
+            result.update({price_source: price})
+        result._count = smas.ohlcv_df.shape[0]
+        return(result)
+
+    def update(self, bar):
+        '''
+        add one bar (a dict or pandas Series with the price_source field), return the dict of SMAs
+        '''
+        price = float(bar[self.price_source])
+        is_missing = np.isnan(price)
+        for p in self.periods:
+            total, compensation = self._sum[p]
+            missing = self._missing[p] + is_missing
+            if not is_missing:
+                total, compensation = _neumaier_add(total, compensation, price)
+            if self._count >= p:
+                leaving = self._buffer[(self._pos - p) % self._window]
+                if np.isnan(leaving):
+                    missing -= 1
+                else:
+                    total, compensation = _neumaier_add(total, compensation, -leaving)
+            self._sum[p] = (total, compensation)
+            self._missing[p] = missing
+            self._sma[p] = (total + compensation) / p if self._count + 1 >= p and missing == 0 else np.nan
+
+        self._buffer[self._pos] = price
+        self._pos = (self._pos + 1) % self._window
+        self._count += 1
+        return(self._sma)
+
+    def get_value(self, period):
+        return(self._sma[period])
+
+    def get_state(self):
+        '''
+        return the carry-over state as a JSON serializable dict
+        '''
+        return({'periods': list(self.periods), 'price_source': self.price_source, 'buffer': self._buffer.tolist(),
+                'pos': self._pos, 'count': self._count, 'sum': {str(p): list(v) for p, v in self._sum.items()}})
+
+    @classmethod
+    def from_state(cls, state):
+        result = cls(state['periods'], state['price_source'])
+        result._buffer = np.array(state['buffer'])
+        result._pos = state['pos']
+        result._count = state['count']
+        result._sum = {p: tuple(state['sum'][str(p)]) for p in result.periods}
+        # the missing prices of every window are the NaNs among the last p prices of the buffer
+        for p in result.periods:
+            last = (result._pos - 1 - np.arange(min(result._count, p))) % result._window
+            result._missing[p] = int(np.isnan(result._buffer[last]).sum())
+        return(result)
+
+
+class IncrementalExponentialMovingAverages(object):
+    '''
+    Streaming version of ExponentialMovingAverages: keeps the last EMA of every period and applies
+    the same recursion as pandas ewm(span=period, adjust=False), so the values match the batch series.
+    A missing (NaN) price keeps the EMA and decays the weight of it for the next price, as ewm does
+    '''
+    def __init__(self, periods):
+        self.periods = periods
+        self._alpha = {p: 2 / (p + 1) for p in periods}
+        self._ema = {p: np.nan for p in periods}
+        self._weight = {p: 1.0 for p in periods}
+
+    @classmethod
+    def from_batch(cls, emas):
+        '''
+        warm start from an ExponentialMovingAverages object on which run() has been called
+        '''
+        result = cls(emas.periods)
+        close = emas.ohlcv_df['Close']
+        # the missing prices after the last one decay the weight of the EMA
+        trailing_missing = len(close) - 1 - close.index.get_loc(close.last_valid_index()) \
+            if close.last_valid_index() is not None else 0
+        for p in emas.periods:
+            result._ema[p] = float(emas.get_series(p).iloc[-1])
+            for i in range(trailing_missing):
+                result._weight[p] *= 1 - result._alpha[p]
+        return(result)
+
+    @staticmethod
+    def _step(previous, weight, value, alpha):
+        '''
+        one step of pandas ewm(adjust=False, ignore_na=False), returns the new (EMA, weight of the EMA)
+        '''
+        if np.isnan(previous):
+            return(value, 1.0)
+        weight *= 1 - alpha
+        if np.isnan(value):
+            return(previous, weight)
+        # ewm weights the new value by 1 - weight instead of alpha when its center of mass is 1 (span 3)
+        new_weight = 1 - weight if alpha == 0.5 else alpha
+        if previous != value:
+            previous = (weight * previous + new_weight * value) / (weight + new_weight)
+        return(previous, 1.0)
+
+    def update(self, bar):
+        '''
+        add one bar (a dict or pandas Series with a Close field), return the dict of EMAs
+        '''
+        price = float(bar['Close'])
+        for p in self.periods:
+            self._ema[p], self._weight[p] = self._step(self._ema[p], self._weight[p], price, self._alpha[p])
+        return(self._ema)
+
+    def get_value(self, period):
+        return(self._ema[period])
+
+    def get_state(self):
+        return({'periods': list(self.periods), 'ema': {str(p): v for p, v in self._ema.items()},
+                'weight': {str(p): v for p, v in self._weight.items()}})
+
+    @classmethod
+    def from_state(cls, state):
+        result = cls(state['periods'])
+        result._ema = {p: state['ema'][str(p)] for p in result.periods}
+        # checkpoints written before missing prices were handled have no weights, which were all 1 then
+        result._weight = {p: state.get('weight', {}).get(str(p), 1.0) for p in result.periods}
+        return(result)
+
+
+class IncrementalRSI(object):
+    '''
+    Streaming version of RSI: keeps the previous close and the EMA smoothed average gain and loss
+    '''
+    def __init__(self, period = 14):
+        self.period = period
+        self._alpha = 2 / (period + 1)
+        self._prev_close = np.nan
+        self._avg_gain = np.nan
+        self._avg_loss = np.nan
+        self.rsi = np.nan
+
+    @classmethod
+    def from_batch(cls, rsi_indicator):
+        '''
+        warm start from an RSI object, continuing after the last row of its ohlcv_df
+        '''
+        result = cls(rsi_indicator.period)
+        close = rsi_indicator.ohlcv_df['Close']
+        price_differences = close.diff(1)
+        gain = price_differences.where(price_differences > 0, 0)
+        loss = -price_differences.where(price_differences < 0, 0)
+        result._prev_close = float(close.iloc[-1])
+        result._avg_gain = float(gain.ewm(span=result.period, adjust=False).mean().iloc[-1])
+        result._avg_loss = float(loss.ewm(span=result.period, adjust=False).mean().iloc[-1])
+        result.rsi = result._calc_rsi()
+        return(result)
+
+    def _calc_rsi(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = np.float64(self._avg_gain) / np.float64(self._avg_loss)
+            return(float(100 - (100 / (1 + rs))))
+
+    def update(self, bar):
+        '''
+        add one bar (a dict or pandas Series with a Close field), return the RSI
+        '''
+        price = float(bar['Close'])
+        # the first bar has no price difference, which RSI.run counts as no gain and no loss; so is the
+        # NaN difference to or from a missing close, which never reaches the averages
+        difference = price - self._prev_close if not np.isnan(self._prev_close) else 0.0
+        gain = difference if difference > 0 else 0.0
+        loss = -difference if difference < 0 else -0.0
+
+        step = IncrementalExponentialMovingAverages._step
+        self._avg_gain = step(self._avg_gain, 1.0, gain, self._alpha)[0]
+        self._avg_loss = step(self._avg_loss, 1.0, loss, self._alpha)[0]
+        self._prev_close = price
+        self.rsi = self._calc_rsi()
+        return(self.rsi)
+
+    def get_value(self):
+        return(self.rsi)
+
+    def get_state(self):
+        return({'period': self.period, 'prev_close': self._prev_close, 'avg_gain': self._avg_gain,
+                'avg_loss': self._avg_loss})
+
+    @classmethod
+    def from_state(cls, state):
+        result = cls(state['period'])
+        result._prev_close = state['prev_close']
+        result._avg_gain = state['avg_gain']
+        result._avg_loss = state['avg_loss']
+        result.rsi = result._calc_rsi()
+        return(result)
+
+
+class IncrementalVWAP(object):
+    '''
+    Streaming version of VWAP: keeps the running sums of Close * Volume and Volume. As with the
+    cumulative sums of VWAP.run, a bar with a missing close is NaN and leaves Close * Volume out
+    '''
+    def __init__(self):
+        self._cumulative_price_volume = 0.0
+        self._cumulative_volume = 0.0
+        self.vwap = np.nan
+
+    @classmethod
+    def from_batch(cls, vwap_indicator):
+        '''
+        warm start from a VWAP object, continuing after the last row of its ohlcv_df
+        '''
+        result = cls()
+        df = vwap_indicator.ohlcv_df
+        result._cumulative_price_volume = float((df['Close'] * df['Volume']).sum())
+        result._cumulative_volume = float(df['Volume'].sum())
+        result.vwap = result._calc_vwap()
+        return(result)
+
+    def _calc_vwap(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return(float(np.float64(self._cumulative_price_volume) / np.float64(self._cumulative_volume)))
+
+    def update(self, bar):
+        '''
+        add one bar (a dict or pandas Series with Close and Volume fields), return the VWAP
+        '''
+        price_volume = float(bar['Close']) * float(bar['Volume'])
+        if not np.isnan(price_volume):
+            self._cumulative_price_volume += price_volume
+        if not np.isnan(float(bar['Volume'])):
+            self._cumulative_volume += float(bar['Volume'])
+        self.vwap = self._calc_vwap() if not np.isnan(price_volume) else np.nan
+        return(self.vwap)
+
+    def get_value(self):
+        return(self.vwap)
+
+    def get_state(self):
+        return({'cumulative_price_volume': self._cumulative_price_volume, 'cumulative_volume': self._cumulative_volume})
+
+    @classmethod
+    def from_state(cls, state):
+        result = cls()
+        result._cumulative_price_volume = state['cumulative_price_volume']
+        result._cumulative_volume = state['cumulative_volume']
+        result.vwap = result._calc_vwap()
+        return(result)
+
+
+def _make_test_ohlcv(num_bars = 1000, seed = 0):
+    # a synthetic random walk OHLCV frame for tests that should not need the database
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, num_bars)))
+    open_ = close * np.exp(rng.normal(0, 0.003, num_bars))
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.005, num_bars)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.005, num_bars)))
+    volume = rng.integers(1000000, 5000000, num_bars)
+    index = pd.Index(pd.bdate_range('2020-01-01', periods=num_bars).date, name='Date')
+    return(pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume}, index=index))
+
+def _test_incremental():
+    # feeding bars one at a time must reproduce the batch series, cold started and warm started
+    import json
+
+    df = _make_test_ohlcv()
+    periods = [9, 20, 50, 100, 200]
+
+    smas = SimpleMovingAverages(df, periods)
+    smas.run()
+    emas = ExponentialMovingAverages(df, periods)
+    emas.run()
+    rsi_indicator = RSI(df)
+    rsi_indicator.run()
+    vwap_indicator = VWAP(df)
+    vwap_indicator.run()
+
+    inc_sma = IncrementalSimpleMovingAverages(periods)
+    inc_ema = IncrementalExponentialMovingAverages(periods)
+    inc_rsi = IncrementalRSI()
+    inc_vwap = IncrementalVWAP()
+    values = {('sma', p): [] for p in periods}
+    values.update({('ema', p): [] for p in periods})
+    values['rsi'] = []
+    values['vwap'] = []
+    for i in range(df.shape[0]):
+        bar = df.iloc[i]
+        for p, v in inc_sma.update(bar).items():
+            values[('sma', p)].append(v)
+        for p, v in inc_ema.update(bar).items():
+            values[('ema', p)].append(v)
+        values['rsi'].append(inc_rsi.update(bar))
+        values['vwap'].append(inc_vwap.update(bar))
+
+    for p in periods:
+        sma_diff = np.nanmax(np.abs(np.array(values[('sma', p)]) - smas.get_series(p).values))
+        assert np.array_equal(np.isnan(values[('sma', p)]), smas.get_series(p).isna().values)
+        assert sma_diff < 1e-9, f"SMA {p} differs by {sma_diff}"
+        assert np.array_equal(values[('ema', p)], emas.get_series(p).values), f"EMA {p} differs"
+    assert np.array_equal(values['rsi'], rsi_indicator.get_series().values, equal_nan=True), "RSI differs"
+    assert np.array_equal(values['vwap'], vwap_indicator.get_series().values), "VWAP differs"
+    print(f"Incremental indicators match the batch series over {df.shape[0]} bars")
+
+    # warm start from the batch result on the first 800 bars, then stream the last 200
+    head = df.iloc[:800]
+    batch = [SimpleMovingAverages(head, periods), ExponentialMovingAverages(head, periods), RSI(head), VWAP(head)]
+    for b in batch:
+        b.run()
+    inc_sma = IncrementalSimpleMovingAverages.from_batch(batch[0])
+    inc_ema = IncrementalExponentialMovingAverages.from_batch(batch[1])
+    inc_rsi = IncrementalRSI.from_batch(batch[2])
+    inc_vwap = IncrementalVWAP.from_batch(batch[3])
+    for i in range(800, df.shape[0]):
+        bar = df.iloc[i]
+        inc_sma.update(bar)
+        inc_ema.update(bar)
+        inc_rsi.update(bar)
+        inc_vwap.update(bar)
+
+    assert abs(inc_sma.get_value(200) - smas.get_series(200).iloc[-1]) < 1e-9
+    assert inc_ema.get_value(50) == emas.get_series(50).iloc[-1]
+    assert abs(inc_rsi.get_value() - rsi_indicator.get_series().iloc[-1]) < 1e-9
+    assert inc_vwap.get_value() == vwap_indicator.get_series().iloc[-1]
+    print("Warm started incremental indicators match the batch series")
+
+    # missing closes, single and in a run, also right before the warm start and through a state round trip
+    df = _make_test_ohlcv(600, seed=1)
+    df.loc[df.index[[5, 300, 301, 302, 449, 450]], 'Close'] = np.nan
+    periods = [3, 9, 20, 50]
+    batch = [SimpleMovingAverages(df, periods), ExponentialMovingAverages(df, periods), RSI(df), VWAP(df)]
+    for b in batch:
+        b.run()
+    head = df.iloc[:451]
+    warm = [SimpleMovingAverages(head, periods), ExponentialMovingAverages(head, periods), RSI(head), VWAP(head)]
+    for b in warm:
+        b.run()
+
+    for start, indicators in [(0, [IncrementalSimpleMovingAverages(periods), IncrementalExponentialMovingAverages(periods),
+                                   IncrementalRSI(), IncrementalVWAP()]),
+                              (451, [IncrementalSimpleMovingAverages.from_batch(warm[0]),
+                                     IncrementalExponentialMovingAverages.from_batch(warm[1]),
+                                     IncrementalRSI.from_batch(warm[2]), IncrementalVWAP.from_batch(warm[3])])]:
+        values = {('sma', p): [] for p in periods}
+        values.update({('ema', p): [] for p in periods})
+        values['rsi'] = []
+        values['vwap'] = []
+        for i in range(start, df.shape[0]):
+            if i == 500:
+                indicators = [type(x).from_state(json.loads(json.dumps(x.get_state()))) for x in indicators]
+            bar = df.iloc[i]
+            for p, v in indicators[0].update(bar).items():
+                values[('sma', p)].append(v)
+            for p, v in indicators[1].update(bar).items():
+                values[('ema', p)].append(v)
+            values['rsi'].append(indicators[2].update(bar))
+            values['vwap'].append(indicators[3].update(bar))
+
+        for p in periods:
+            expected = batch[0].get_series(p).values[start:]
+            assert np.array_equal(np.isnan(values[('sma', p)]), np.isnan(expected)), f"SMA {p} NaNs differ"
+            assert np.nanmax(np.abs(np.array(values[('sma', p)]) - expected)) < 1e-9, f"SMA {p} differs"
+            assert np.allclose(values[('ema', p)], batch[1].get_series(p).values[start:], rtol=0, atol=1e-9,
+                               equal_nan=True), f"EMA {p} differs"
+        assert np.allclose(values['rsi'], batch[2].get_series().values[start:], rtol=0, atol=1e-9, equal_nan=True), \
+            "RSI differs"
+        assert np.allclose(values['vwap'], batch[3].get_series().values[start:], rtol=0, atol=1e-9, equal_nan=True), \
+            "VWAP differs"
+    print("Incremental indicators with missing closes match the batch series")
+
+def _test_panel():
+    # the panel results of every ticker must match the single ticker classes on that ticker's own bars
+    frames = {f"T{i}": _make_test_ohlcv(600, seed=i) for i in range(20)}
+    frames['T1'] = frames['T1'].iloc[150:]                         # listed later
+    frames['T2'] = frames['T2'].drop(frames['T2'].index[300:305])   # missing bars
+    panel = PricePanel.from_frames(frames)
+    indicators = PanelIndicators(panel)
+
+    sma = indicators.sma([9, 50])
+    ema = indicators.ema([20])
+    rsi = indicators.rsi()
+    vwap = indicators.vwap()
+
+    for ticker in ['T0', 'T1', 'T2']:
+        df = frames[ticker]
+        column = panel.tickers.index(ticker)
+        rows = panel.dates.get_indexer(df.index)
+
+        smas = SimpleMovingAverages(df, [9, 50])
+        smas.run()
+        emas = ExponentialMovingAverages(df, [20])
+        emas.run()
+        rsi_indicator = RSI(df)
+        rsi_indicator.run()
+        vwap_indicator = VWAP(df)
+        vwap_indicator.run()
+
+        assert np.allclose(sma[50][rows, column], smas.get_series(50).values, equal_nan=True, rtol=0, atol=1e-9)
+        assert np.allclose(ema[20][rows, column], emas.get_series(20).values, rtol=0, atol=1e-9)
+        assert np.allclose(rsi[rows, column], rsi_indicator.get_series().values, equal_nan=True, rtol=0, atol=1e-9)
+        assert np.allclose(vwap[rows, column], vwap_indicator.get_series().values, rtol=0, atol=1e-9)
+        assert np.isnan(rsi[~panel.mask[:, column], column]).all()
+    print(f"Panel indicators match the single ticker classes for {len(panel.tickers)} tickers x {len(panel.dates)} dates")
+
+def _test_graph():
+    df = _make_test_ohlcv()
+    close = ('price', 'Close')
+    requested = [('sma', close, 20), ('ema', close, 12), ('ema', close, 26), ('rsi', close, 14), ('vwap', close)]
+
+    nodes = IndicatorGraph.resolve(requested + [('rsi', close, 14)])
+    print(f"{len(requested)} indicators resolve to {len(nodes)} distinct nodes: {nodes}")
+
+    graph = IndicatorGraph(df)
+    values = graph.run(requested)
+
+    # the reference is the original pandas formula
+    diff = df['Close'].diff(1)
+    gain = diff.where(diff > 0, 0).ewm(span=14, adjust=False).mean()
+    loss = (-diff.where(diff < 0, 0)).ewm(span=14, adjust=False).mean()
+    assert values[('rsi', close, 14)].equals(100 - (100 / (1 + gain / loss)))
+    assert values[('ema', close, 12)].equals(df['Close'].ewm(span=12, adjust=False).mean())
+
+    # the classes sharing the graph reuse its nodes instead of computing them again
+    rsi_indicator = RSI(df, graph=graph)
+    rsi_indicator.run()
+    emas = ExponentialMovingAverages(df, [12, 26], graph=graph)
+    emas.run()
+    assert rsi_indicator.get_series() is values[('rsi', close, 14)]
+    assert emas.get_series(12) is values[('ema', close, 12)]
+    for bad_key in [('rsi', 'Close', 14), ('ema', 'Close', 12)]:
+        try:
+            IndicatorGraph.resolve([bad_key])
+            raise AssertionError(f"{bad_key} resolved")
+        except ValueError:
+            pass
+    print("Graph results match the indicator formulas and the classes share them")
+
+def _test_vwap():
+    # every mode must match a pandas computation that re-slices the frame per segment
+    df = _make_test_ohlcv(1500)
+    days = pd.to_datetime(pd.Index(df.index))
+    price_volume = df['Close'] * df['Volume']
+    typical = (df['High'] + df['Low'] + df['Close']) / 3
+
+    for reset in ['D', 'W', 'M']:
+        vwap = VWAP(df, reset=reset)
+        vwap.run()
+        sessions = days.to_period(reset)
+        expected = price_volume.groupby(sessions).cumsum() / df['Volume'].groupby(sessions).cumsum()
+        assert np.allclose(vwap.get_series().values, expected.values, rtol=1e-14, atol=0)
+
+    anchor = df.index[700]
+    vwap = VWAP(df, anchor=anchor, typical_price=True)
+    vwap.run()
+    tail = df.loc[anchor:]
+    expected = (typical.loc[anchor:] * tail['Volume']).cumsum() / tail['Volume'].cumsum()
+    assert vwap.get_series().loc[:df.index[699]].isna().all()
+    assert np.allclose(vwap.get_series().loc[anchor:].values, expected.values, rtol=1e-14, atol=0)
+
+    vwap = VWAP(df, window=20)
+    vwap.run()
+    expected = price_volume.rolling(20).sum() / df['Volume'].rolling(20).sum()
+    assert np.allclose(vwap.get_series().values, expected.values, equal_nan=True, rtol=1e-12, atol=0)
+    print("VWAP anchor, session reset and rolling window modes match pandas")
+
+    # the panel computes all tickers, with their own anchors, in one call
+    frames = {f"T{i}": _make_test_ohlcv(600, seed=i) for i in range(10)}
+    frames['T1'] = frames['T1'].iloc[150:]
+    frames['T2'] = frames['T2'].drop(frames['T2'].index[300:305])
+    panel = PricePanel.from_frames(frames)
+    indicators = PanelIndicators(panel)
+    anchors = [frames[t].index[100] for t in panel.tickers]
+    modes = [{'reset': 'M'}, {'window': 20, 'typical_price': True}, {'anchor': anchors}]
+    results = [indicators.vwap(**mode) for mode in modes]
+
+    for ticker in ['T0', 'T1', 'T2']:
+        column = panel.tickers.index(ticker)
+        rows = panel.dates.get_indexer(frames[ticker].index)
+        for mode, values in zip(modes, results):
+            if 'anchor' in mode:
+                mode = {'anchor': anchors[column]}
+            vwap = VWAP(frames[ticker], **mode)
+            vwap.run()
+            assert np.allclose(values[rows, column], vwap.get_series().values, equal_nan=True, rtol=1e-12, atol=0)
+        assert np.isnan(results[0][~panel.mask[:, column], column]).all()
+    print(f"Panel VWAP modes match the single ticker class for {len(panel.tickers)} tickers")
+
+def _test_volatility():
+    # the kernel based indicators must match pandas rolling / ewm on one frame and on a panel
+    df = _make_test_ohlcv(2000)
+    close = df['Close']
+
+    bands = BollingerBands(df, 20, 2)
+    bands.run()
+    std = close.rolling(20).std(ddof=0)
+    assert np.allclose(bands.get_series('upper'), close.rolling(20).mean() + 2 * std, equal_nan=True, rtol=1e-12, atol=0)
+    zscore = RollingZScore(df, 20)
+    zscore.run()
+    assert np.allclose(zscore.get_series(), (close - close.rolling(20).mean()) / std, equal_nan=True, rtol=1e-9, atol=1e-9)
+
+    atr = ATR(df)
+    atr.run()
+    previous_close = close.shift(1)
+    true_range = pd.concat([df['High'] - df['Low'], (df['High'] - previous_close).abs(),
+                            (df['Low'] - previous_close).abs()], axis=1).max(axis=1)
+    assert np.allclose(atr.get_series(), true_range.ewm(alpha=1 / 14, adjust=False).mean(), rtol=1e-12, atol=0)
+
+    macd = MACD(df)
+    macd.run()
+    line = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    assert np.allclose(macd.get_series('macd'), line, rtol=0, atol=1e-10)
+    assert np.allclose(macd.get_series('histogram'), line - line.ewm(span=9, adjust=False).mean(), rtol=0, atol=1e-10)
+
+    volatility = RealizedVolatility(df)
+    volatility.run()
+    expected = np.log(close / close.shift(1)).rolling(20).std() * np.sqrt(252)
+    assert np.allclose(volatility.get_series(), expected, equal_nan=True, rtol=1e-10, atol=0)
+
+    # the same indicators as graph nodes, sharing the SMA, the std and the EMAs
+    src = ('price', 'Close')
+    keys = {'upper': ('bollinger', src, 20, 2, 'upper'), 'zscore': ('zscore', src, 20), 'atr': ('atr', ('true_range',), 14),
+            'macd': ('macd', src, 12, 26), 'signal': ('ema', ('macd', src, 12, 26), 9),
+            'histogram': ('macd_histogram', src, 12, 26, 9), 'volatility': ('realized_volatility', src, 20, 252)}
+    values = IndicatorGraph(df).run(list(keys.values()))
+    expected = {'upper': bands.get_series('upper'), 'zscore': zscore.get_series(), 'atr': atr.get_series(),
+                'macd': macd.get_series('macd'), 'signal': macd.get_series('signal'),
+                'histogram': macd.get_series('histogram'), 'volatility': volatility.get_series()}
+    for name, key in keys.items():
+        assert np.allclose(values[key], expected[name], equal_nan=True, rtol=1e-9, atol=1e-9), name
+    shared = [('sma', src, 20), ('rolling_std', src, 20, 0), ('ema', src, 12), ('ema', src, 26)]
+    nodes = IndicatorGraph.resolve(list(keys.values()))
+    assert len(IndicatorGraph.resolve(list(keys.values()) + shared)) == len(nodes)
+    print(f"Graph nodes match the volatility indicator classes, {len(keys)} indicators in {len(nodes)} nodes")
+
+    high = df['High'].to_numpy()
+    assert np.array_equal(ta_kernels.rolling_max(high, 20), df['High'].rolling(20).max().to_numpy(), equal_nan=True)
+    assert np.array_equal(ta_kernels.rolling_min(high, 20), df['High'].rolling(20).min().to_numpy(), equal_nan=True)
+    print("Bollinger bands, z-score, ATR, MACD, realized volatility and rolling min/max match pandas")
+
+    # a flat price level far from zero: sum of squares formulas lose the variance, the kernel keeps it
+    level = 1e9 + np.cumsum(np.random.default_rng(1).normal(0, 1, 5000))
+    window = level[-20:].astype(np.longdouble)
+    exact = float(((window - window.mean()) ** 2).sum() / 19)
+    kernel = ta_kernels.rolling_mean_var(level, 20)[1][-1]
+    print(f"Rolling variance at a price level of 1e9: relative error {abs(kernel - exact) / exact:.1e} (kernel), "
+          f"{abs(pd.Series(level).rolling(20).var().iloc[-1] - exact) / exact:.1e} (pandas)")
+
+    frames = {f"T{i}": _make_test_ohlcv(600, seed=i) for i in range(10)}
+    frames['T1'] = frames['T1'].iloc[150:]
+    frames['T2'] = frames['T2'].drop(frames['T2'].index[300:305])
+    panel = PricePanel.from_frames(frames)
+    indicators = PanelIndicators(panel)
+    results = {'bands': indicators.bollinger_bands()['lower'], 'zscore': indicators.zscore(),
+               'atr': indicators.atr(), 'macd': indicators.macd()['signal'], 'volatility': indicators.realized_volatility()}
+    for ticker in ['T0', 'T1', 'T2']:
+        df = frames[ticker]
+        column = panel.tickers.index(ticker)
+        rows = panel.dates.get_indexer(df.index)
+        expected = {'bands': BollingerBands(df), 'zscore': RollingZScore(df), 'atr': ATR(df), 'macd': MACD(df),
+                    'volatility': RealizedVolatility(df)}
+        for name, indicator in expected.items():
+            indicator.run()
+            series = indicator.get_series('lower') if name == 'bands' else \
+                     indicator.get_series('signal') if name == 'macd' else indicator.get_series()
+            assert np.allclose(results[name][rows, column], series.values, equal_nan=True, rtol=1e-12, atol=1e-12)
+            assert np.isnan(results[name][~panel.mask[:, column], column]).all()
+    print(f"Panel volatility indicators match the single ticker classes for {len(panel.tickers)} tickers")
+
 def _test1():
     opt = option.Option()
     # set default settings
@@ -183,4 +1337,9 @@ def _test1():
     print(vwap_indicator.vwap)
     
 if __name__ == "__main__":
+    _test_incremental()
+    _test_panel()
+    _test_graph()
+    _test_vwap()
+    _test_volatility()
     _test1()
\ No newline at end of file
@@ -0,0 +1,259 @@
+import os
+import time
+import datetime
+import itertools
+import collections
+
+import numpy as np
+import pandas as pd
+
+import db
+import option
+import ta_kernels
+from TA import PricePanel, PanelIndicators, SimpleMovingAverages, RSI, _make_test_ohlcv
+
+BacktestResult = collections.namedtuple('BacktestResult', ['summary', 'returns'])
+
+class MovingAverageCrossover(object):
+    '''
+    Long while SMA(fast) is above SMA(slow), for every fast < slow pair of periods.
+    With long_short=True the position is -1 while SMA(fast) is below SMA(slow).
+    '''
+    param_names = ('fast', 'slow')
+
+    def __init__(self, periods, long_short = False):
+        self.periods = sorted(periods)
+        self.long_short = long_short
+        self.params = [(f, s) for f, s in itertools.combinations(self.periods, 2)]
+
+    def prepare(self, close):
+        '''
+        SMAs of every period of a packed dates x tickers close array, shared by all pairs
+        '''
+        return(ta_kernels.rolling_mean_multi(close, self.periods))
+
+    def positions(self, prepared, params):
+        '''
+        return the params x dates x tickers target positions of a subset of params
+        '''
+        fast = prepared[[self.periods.index(f) for f, s in params]]
+        slow = prepared[[self.periods.index(s) for f, s in params]]
+        positions = (fast > slow).astype(np.float64)
+        if self.long_short:
+            positions[fast < slow] = -1.0
+        return(positions)
+
+
+class RSIThreshold(object):
+    '''
+    Mean reversion on RSI: go long when RSI(period) falls below lower and stay long until it rises
+    above upper, for every (period, lower, upper) combination with lower < upper.
+    '''
+    param_names = ('period', 'lower', 'upper')
+
+    def __init__(self, periods = (14,), lower = (30,), upper = (70,)):
+        self.periods = list(periods)
+        self.params = [(p, l, u) for p in self.periods for l in lower for u in upper if l < u]
+
+    def prepare(self, close):
+        panel = PricePanel(None, range(close.shape[1]), {'Close': close})
+        indicators = PanelIndicators(panel)
+        return({p: indicators.rsi(p) for p in self.periods})
+
+    def positions(self, prepared, params):
+        rsi = np.stack([prepared[p] for p, l, u in params])
+        lower = np.array([l for p, l, u in params], dtype=np.float64)[:, None, None]
+        upper = np.array([u for p, l, u in params], dtype=np.float64)[:, None, None]
+
+        # 1 on entry signals, 0 on exit signals, NaN in between, then carried forward
+        signal = np.where(rsi < lower, 1.0, np.where(rsi > upper, 0.0, np.nan))
+        rows = np.arange(signal.shape[1])[None, :, None]
+        last_signal = np.maximum.accumulate(np.where(np.isnan(signal), 0, rows), axis=1)
+        positions = np.take_along_axis(signal, last_signal, axis=1)
+        return(np.where(np.isnan(positions), 0.0, positions))
+
+
+class Backtester(object):
+    '''
+    Vectorized backtest of a signal rule over every ticker of a PricePanel and every parameter
+    combination of the rule.
+
+    Positions are decided on the close of a bar and earn the next bar's close to close return;
+    every change of position costs transaction_cost times the traded notional. Each ticker trades on
+    its own bars only (gaps and dates before a listing are skipped), and the strategy returns of the
+    tickers are averaged into an equal weight portfolio per parameter combination.
+    Tickers are processed chunk_size at a time and parameter combinations in blocks of at most
+    block_size elements, so memory stays bounded for large grids.
+    '''
+
+    def __init__(self, panel, transaction_cost = 0.0005, periods_per_year = 252, chunk_size = 50, block_size = 4000000):
+        self.panel = panel
+        self.transaction_cost = transaction_cost
+        self.periods_per_year = periods_per_year
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+
+    def run(self, rule):
+        '''
+        return a BacktestResult of the summary DataFrame (one row per parameter combination) and the
+        daily portfolio returns (dates x parameter combinations)
+        '''
+        close = self.panel.fields['Close']
+        num_dates, num_tickers = close.shape
+        num_params = len(rule.params)
+
+        strategy_sum = np.zeros((num_params, num_dates))
+        turnover_sum = np.zeros((num_params, num_dates))
+        num_active = np.zeros(num_dates)
+
+        for start in range(0, num_tickers, self.chunk_size):
+            stop = min(start + self.chunk_size, num_tickers)
+            mask = self.panel.mask[:, start:stop]
+            packed, order = ta_kernels.pack_valid(close[:, start:stop], mask)
+            packed_mask = np.take_along_axis(mask, order, axis=0)
+
+            # close to close returns between consecutive bars of each ticker, 0 on its first bar
+            asset_returns = np.zeros_like(packed)
+            asset_returns[1:] = packed[1:] / packed[:-1] - 1
+            asset_returns[~packed_mask] = 0.0
+            num_active += mask.sum(axis=1)
+
+            prepared = rule.prepare(packed)
+            columns = np.arange(stop - start)[None, :]
+            step = max(1, self.block_size // packed.size)
+            for i in range(0, num_params, step):
+                params = rule.params[i:i + step]
+                positions = rule.positions(prepared, params)
+
+                held = np.zeros_like(positions)
+                held[:, 1:] = positions[:, :-1]
+                traded = np.abs(positions - held)
+                strategy = held * asset_returns - self.transaction_cost * traded
+                # the padding rows below each ticker's last bar neither earn nor trade
+                strategy[:, ~packed_mask] = 0.0
+                traded[:, ~packed_mask] = 0.0
+
+                # back from packed rows to dates, then summed over the tickers
+                unpacked = np.zeros_like(strategy)
+                unpacked[:, order, columns] = strategy
+                strategy_sum[i:i + step] += unpacked.sum(axis=2)
+                unpacked[:, order, columns] = traded
+                turnover_sum[i:i + step] += unpacked.sum(axis=2)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.where(num_active > 0, strategy_sum / num_active, 0.0)
+            turnover = np.where(num_active > 0, turnover_sum / num_active, 0.0)
+
+        index = pd.MultiIndex.from_tuples(rule.params, names=rule.param_names)
+        summary = self._summarize(returns, turnover, index)
+        return(BacktestResult(summary, pd.DataFrame(returns.T, index=self.panel.dates, columns=index)))
+
+    def _summarize(self, returns, turnover, index):
+        num_dates = returns.shape[1]
+        years = max(num_dates / self.periods_per_year, 1e-12)
+        equity = np.cumprod(1 + returns, axis=1)
+        drawdown = equity / np.maximum.accumulate(equity, axis=1) - 1
+
+        mean = returns.mean(axis=1)
+        std = returns.std(axis=1, ddof=1) if num_dates > 1 else np.zeros(returns.shape[0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe = np.where(std > 0, mean / std * np.sqrt(self.periods_per_year), np.nan)
+
+        return(pd.DataFrame({'total_return': equity[:, -1] - 1,
+                             'annual_return': equity[:, -1] ** (1 / years) - 1,
+                             'annual_volatility': std * np.sqrt(self.periods_per_year),
+                             'sharpe_ratio': sharpe,
+                             'max_drawdown': drawdown.min(axis=1),
+                             'annual_turnover': turnover.mean(axis=1) * self.periods_per_year}, index=index))
+
+
+def _test():
+    # the vectorized engine must agree with a bar by bar loop over the TA indicator classes
+    frames = {f"T{i}": _make_test_ohlcv(800, seed=i) for i in range(5)}
+    frames['T1'] = frames['T1'].iloc[200:]                         # listed later
+    frames['T2'] = frames['T2'].drop(frames['T2'].index[400:410])   # missing bars
+    panel = PricePanel.from_frames(frames)
+    cost = 0.001
+
+    def loop_returns(df, signal):
+        held, returns = 0.0, []
+        close = df['Close'].tolist()
+        for t in range(len(close)):
+            r = held * (close[t] / close[t - 1] - 1) if t > 0 else 0.0
+            position = signal(t, held)
+            returns.append(r - cost * abs(position - held))
+            held = position
+        return(pd.Series(returns, index=df.index))
+
+    def portfolio(signals):
+        returns = pd.concat([loop_returns(frames[t], signals[t]) for t in frames], axis=1)
+        return(returns.sum(axis=1) / returns.notna().sum(axis=1))
+
+    backtester = Backtester(panel, transaction_cost=cost, chunk_size=2)
+
+    crossover = backtester.run(MovingAverageCrossover([10, 30, 50]))
+    signals = {}
+    for ticker, df in frames.items():
+        smas = SimpleMovingAverages(df, [10, 50])
+        smas.run()
+        fast, slow = smas.get_series(10).tolist(), smas.get_series(50).tolist()
+        signals[ticker] = lambda t, held, fast=fast, slow=slow: 1.0 if fast[t] > slow[t] else 0.0
+    error = np.abs(crossover.returns[(10, 50)].to_numpy() - portfolio(signals).to_numpy()).max()
+    print(f"SMA crossover, max abs error vs loop: {error:.3g}")
+    assert error < 1e-12
+
+    threshold = backtester.run(RSIThreshold(periods=[7, 14], lower=[20, 30], upper=[60, 70]))
+    for ticker, df in frames.items():
+        rsi_indicator = RSI(df, 14)
+        rsi_indicator.run()
+        rsi = rsi_indicator.get_series().tolist()
+        signals[ticker] = lambda t, held, rsi=rsi: 1.0 if rsi[t] < 30 else (0.0 if rsi[t] > 70 else held)
+    error = np.abs(threshold.returns[(14, 30, 70)].to_numpy() - portfolio(signals).to_numpy()).max()
+    print(f"RSI threshold, max abs error vs loop: {error:.3g}")
+    assert error < 1e-12
+    print(threshold.summary)
+
+def _benchmark(num_tickers = 100, num_dates = 2500, max_period = 100):
+    '''
+    sweep every pair of SMA periods 2..max_period over a synthetic panel
+    '''
+    frames = {f"T{i}": _make_test_ohlcv(num_dates, seed=i) for i in range(num_tickers)}
+    panel = PricePanel.from_frames(frames)
+    rule = MovingAverageCrossover(range(2, max_period + 1))
+
+    start = time.perf_counter()
+    result = Backtester(panel).run(rule)
+    elapsed = time.perf_counter() - start
+    print(f"{len(rule.params)} combinations x {num_tickers} tickers x {num_dates} dates in {elapsed:.2f} s "
+          f"({len(rule.params) * num_tickers / elapsed:,.0f} ticker backtests/s)")
+    print(result.summary.sort_values('sharpe_ratio', ascending=False).head())
+
+def run():
+    parser = option.get_default_parser()
+    parser.add_argument('--data_dir', dest = 'data_dir', default='./data', help='data dir')
+    parser.add_argument('--periods', dest = 'periods', default='5,10,20,50,100,200', help='SMA periods with , separator')
+    parser.add_argument('--cost', dest = 'cost', type=float, default=0.0005, help='transaction cost per unit traded')
+
+    args = parser.parse_args()
+    opt = option.Option(args = args)
+    opt.sqlite_db = os.path.join(opt.data_dir, "sqlitedb/Equity.db")
+
+    if opt.tickers is not None:
+        list_of_tickers = opt.tickers.split(',')
+    else:
+        fname = os.path.join(opt.data_dir, "S&P500.txt")
+        list_of_tickers = list(pd.read_csv(fname, header=None).iloc[:, 0])
+
+    db_connection = db.get_manager(opt.sqlite_db).get_reader()
+    start_date = datetime.datetime.strptime(opt.start_date, "%Y-%m-%d").date()
+    end_date = datetime.datetime.strptime(opt.end_date, "%Y-%m-%d").date()
+    panel = PricePanel.from_db(db_connection, list_of_tickers, start_date, end_date)
+
+    backtester = Backtester(panel, transaction_cost=opt.cost)
+    for rule in [MovingAverageCrossover([int(x) for x in opt.periods.split(',')]),
+                 RSIThreshold(periods=[7, 14, 21], lower=[20, 25, 30], upper=[50, 60, 70])]:
+        result = backtester.run(rule)
+        print(result.summary.sort_values('sharpe_ratio', ascending=False).head(10))
+
+if __name__ == "__main__":
+    _test()
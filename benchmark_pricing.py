@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import tracemalloc
+
+import numpy as np
+
+import option
+from stock import Stock
+from financial_option import *
+from option_chain import OptionChain
+from blackscholes_model import BlackScholesModel
+from binomial_model import BinomialTreeModel
+from implied_volatility import ImpliedVolatilitySolver
+
+# textbook reference values (Hull, Options, Futures and Other Derivatives) as
+# (description, model, inputs (S_0, K, T, sigma, is_call, q, r), field, expected value, tolerance)
+REFERENCE_VALUES = [
+    ('European call', 'bs', (42, 40, 0.5, 0.2, True, 0.0, 0.1), 'price', 4.7594, 1e-4),
+    ('European put', 'bs', (42, 40, 0.5, 0.2, False, 0.0, 0.1), 'price', 0.8086, 1e-4),
+    ('Call delta', 'bs', (49, 50, 0.3846, 0.2, True, 0.0, 0.05), 'delta', 0.522, 1e-3),
+    ('Call gamma', 'bs', (49, 50, 0.3846, 0.2, True, 0.0, 0.05), 'gamma', 0.066, 1e-3),
+    ('Call theta', 'bs', (49, 50, 0.3846, 0.2, True, 0.0, 0.05), 'theta', -4.31, 1e-2),
+    ('Call vega', 'bs', (49, 50, 0.3846, 0.2, True, 0.0, 0.05), 'vega', 12.1, 1e-1),
+    ('Call rho', 'bs', (49, 50, 0.3846, 0.2, True, 0.0, 0.05), 'rho', 8.91, 1e-2),
+    ('American put', 'binomial', (50, 50, 5 / 12, 0.4, False, 0.0, 0.1), 'price', 4.28, 1e-2),
+]
+
+class PricingBenchmark(object):
+    '''
+    Measures options per second and peak memory of the pricing module across chain sizes and
+    checks its numerics against reference values.
+    Methods that price one Python object at a time are capped at scalar_cap options per run and
+    American pricing at american_cap, and their throughput is measured on that subset.
+    '''
+
+    def __init__(self, sizes, scalar_cap = 10000, american_cap = 10000, american_steps = 200, repeat = 3, seed = 0):
+        self.sizes = sizes
+        self.scalar_cap = scalar_cap
+        self.american_cap = american_cap
+        self.american_steps = american_steps
+        self.repeat = repeat
+        self.seed = seed
+        self.model = BlackScholesModel(datetime.datetime.now(), 0.05)
+        self.results = []
+        self.accuracy = []
+
+    def _make_inputs(self, n):
+        rng = np.random.default_rng(self.seed)
+        return({'S_0': np.full(n, 100.0), 'K': rng.uniform(70, 130, n), 'T': rng.uniform(0.05, 2.0, n),
+                'sigma': rng.uniform(0.1, 0.6, n), 'is_call': rng.random(n) < 0.5, 'q': np.full(n, 0.01)})
+
+    def _measure(self, name, n, func):
+        '''
+        time func (best of repeat) and measure its peak traced memory in a separate run
+        '''
+        best = float('inf')
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        result = {'benchmark': name, 'size': n, 'seconds': best, 'options_per_second': n / best,
+                  'peak_memory_bytes': peak}
+        self.results.append(result)
+        print(f"{name:<22} {n:>9} {n / best:>16,.0f} opts/s {peak / 2 ** 20:>10.2f} MiB")
+
+    def run_speed(self):
+        print(f"{'benchmark':<22} {'size':>9} {'throughput':>23} {'peak memory':>14}")
+        for size in self.sizes:
+            x = self._make_inputs(size)
+            args = (x['S_0'], x['K'], x['T'], x['sigma'], x['is_call'], x['q'])
+
+            n = min(size, self.scalar_cap)
+            stock = Stock(opt=None, db_connection=None, ticker='Bench', spot_price=100.0, sigma=0.3, dividend_yield=0.01)
+            options = [EuropeanCallOption(stock, T, K) if c else EuropeanPutOption(stock, T, K)
+                       for K, T, c in zip(x['K'][:n].tolist(), x['T'][:n].tolist(), x['is_call'][:n].tolist())]
+
+            self._measure('scalar_price', n, lambda: [self.model.calc_model_price(o) for o in options])
+            for greek in ['delta', 'gamma', 'theta', 'vega', 'rho']:
+                method = getattr(self.model, f"calc_{greek}")
+                self._measure(f"scalar_{greek}", n, lambda: [method(o) for o in options])
+
+            self._measure('batch_price', size, lambda: self.model.calc_model_price_batch(*args))
+            self._measure('batch_greeks', size, lambda: self.model.calc_greeks_batch(*args))
+
+            chain = OptionChain([stock], x['K'], x['T'], x['is_call'].astype(np.int8))
+            self._measure('chain_greeks', size, lambda: self.model.calc_greeks(chain))
+
+            prices = self.model.calc_model_price_batch(*args)
+            solver = ImpliedVolatilitySolver(self.model)
+            self._measure('implied_vol', size, lambda: solver.solve(prices, x['S_0'], x['K'], x['T'], x['is_call'], x['q']))
+
+            n = min(size, self.american_cap)
+            lattice = BinomialTreeModel(self.model.pricing_date, self.model.risk_free_rate, self.american_steps)
+            self._measure(f"american_{self.american_steps}_steps", n,
+                          lambda: lattice.calc_model_price_batch(*[a[:n] for a in args]))
+
+    def run_accuracy(self):
+        '''
+        check against REFERENCE_VALUES, plus scalar vs batch and implied vol round trip consistency;
+        return True when every check passes
+        '''
+        lattice = BinomialTreeModel(self.model.pricing_date, self.model.risk_free_rate, 500)
+        for description, model_name, inputs, field, expected, tolerance in REFERENCE_VALUES:
+            model = self.model if model_name == 'bs' else lattice
+            greeks = model.calc_greeks_batch(*inputs)
+            self._check(description, float(np.ravel(getattr(greeks, field))[0]), expected, tolerance)
+
+        x = self._make_inputs(1000)
+        args = (x['S_0'], x['K'], x['T'], x['sigma'], x['is_call'], x['q'])
+        batch = self.model.calc_model_price_batch(*args)
+        stock = Stock(opt=None, db_connection=None, ticker='Bench', spot_price=100.0, sigma=0.3, dividend_yield=0.01)
+        scalar = [self.model.calc_model_price(EuropeanCallOption(stock, T, K) if c else EuropeanPutOption(stock, T, K))
+                  for K, T, c in zip(x['K'].tolist(), x['T'].tolist(), x['is_call'].tolist())]
+        batch_at_flat_vol = self.model.calc_model_price_batch(x['S_0'], x['K'], x['T'], 0.3, x['is_call'], x['q'])
+        self._check('Scalar vs batch price', float(np.max(np.abs(batch_at_flat_vol - scalar))), 0.0, 1e-10)
+
+        # vol is only identifiable where the price is sensitive to it, so deep in the money rows with
+        # vega ~ 0 (price equal to intrinsic value in double precision) are left out
+        result = ImpliedVolatilitySolver(self.model).solve(batch, x['S_0'], x['K'], x['T'], x['is_call'], x['q'])
+        identifiable = self.model.calc_greeks_batch(*args).vega > 1e-4
+        self._check('Implied vol round trip', float(np.max(np.abs(result.sigma - x['sigma'])[identifiable])), 0.0, 1e-6)
+
+        return(all(a['passed'] for a in self.accuracy))
+
+    def _check(self, description, value, expected, tolerance):
+        passed = bool(abs(value - expected) <= tolerance)
+        self.accuracy.append({'check': description, 'value': value, 'expected': expected,
+                              'tolerance': tolerance, 'passed': passed})
+        print(f"{'PASS' if passed else 'FAIL'}: {description} = {value:.6g} (expected {expected} +/- {tolerance})")
+
+    def save(self, file_name):
+        output = {'timestamp': datetime.datetime.now().isoformat(), 'python': platform.python_version(),
+                  'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor(),
+                  'results': self.results, 'accuracy': self.accuracy}
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        with open(file_name, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"Results written to {file_name}")
+
+
+def run():
+    parser = option.get_default_parser()
+    parser.add_argument('--data_dir', dest = 'data_dir', default='./data', help='data dir')
+    parser.add_argument('--sizes', dest = 'sizes', default='10,100,1000,10000,100000,1000000',
+                        help='chain sizes with , separator')
+    parser.add_argument('--output', dest = 'output', default=None, help='results json file')
+    parser.add_argument('--skip_speed', action='store_true', dest='skip_speed', default=False,
+                        help='only run the accuracy checks')
+
+    args = parser.parse_args()
+    opt = option.Option(args = args)
+
+    if opt.output is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        opt.output = os.path.join(opt.data_dir, "benchmarks", f"pricing_{stamp}.json")
+
+    benchmark = PricingBenchmark([int(x) for x in opt.sizes.split(',')])
+    passed = benchmark.run_accuracy()
+    if not opt.skip_speed:
+        benchmark.run_speed()
+    benchmark.save(opt.output)
+
+    if not passed:
+        print("Accuracy checks failed")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,219 @@
+import time
+import datetime
+
+import numpy as np
+
+from stock import Stock
+from financial_option import *
+from blackscholes_model import BlackScholesModel, Greeks
+
+class BinomialTreeModel(object):
+    '''
+    Cox-Ross-Rubinstein binomial lattice for pricing European and American options.
+
+    Backward induction works on whole time slices of the tree at once, and a batch of
+    contracts sharing num_steps is priced together as one (nodes x contracts) array, so the
+    only Python loop is the one over time steps.
+    '''
+
+    def __init__(self, pricing_date, risk_free_rate, num_steps = 500):
+        self.pricing_date = pricing_date
+        self.risk_free_rate = risk_free_rate
+        self.num_steps = num_steps
+
+    def _get_market_data(self, option):
+        '''
+        return (S_0, K, T, r, q, sigma) for a single option
+        '''
+        S_0 = option.underlying.spot_price
+        K = option.strike
+        T = option.time_to_expiry
+        r = self.risk_free_rate
+        q = option.underlying.dividend_yield
+        sigma = option.underlying.sigma
+        return(S_0, K, T, r, q, sigma)
+
+    def _run_lattice(self, S_0, K, T, sigma, is_call, q, r, is_american):
+        '''
+        run the backward induction for a batch of contracts
+        return the option values at step 0, 1 and 2 of the tree (n x 1, n x 2, n x 3),
+        the per-contract up factor and the time step
+        '''
+        if r is None:
+            r = self.risk_free_rate
+        S_0, K, T, sigma, is_call, q, r, is_american = [x.ravel() for x in np.broadcast_arrays(
+            np.asarray(S_0, dtype=np.float64), np.asarray(K, dtype=np.float64),
+            np.asarray(T, dtype=np.float64), np.asarray(sigma, dtype=np.float64),
+            np.asarray(is_call, dtype=bool), np.asarray(q, dtype=np.float64),
+            np.asarray(r, dtype=np.float64), np.asarray(is_american, dtype=bool))]
+        N = self.num_steps
+        if N < 2:
+            raise Exception("BinomialTreeModel needs at least 2 steps")
+
+        # a mixed batch is split so the early exercise check only runs where it is needed
+        if is_american.any() and not is_american.all():
+            V0, V1, V2 = np.empty((S_0.shape[0], 1)), np.empty((S_0.shape[0], 2)), np.empty((S_0.shape[0], 3))
+            u, dt = np.empty(S_0.shape[0]), np.empty(S_0.shape[0])
+            for rows in (np.flatnonzero(is_american), np.flatnonzero(~is_american)):
+                V0[rows], V1[rows], V2[rows], _, u[rows], dt[rows] = self._run_lattice(
+                    S_0[rows], K[rows], T[rows], sigma[rows], is_call[rows], q[rows], r[rows], is_american[rows])
+            return(V0, V1, V2, S_0, u, dt)
+        american = bool(is_american.all()) and S_0.shape[0] > 0
+
+        dt = T / N
+        u = np.exp(sigma * np.sqrt(dt))
+        d = 1 / u
+        p = (np.exp((r - q) * dt) - d) / (u - d)
+        disc = np.exp(-r * dt)
+        disc_p_up = disc * p
+        disc_p_down = disc * (1 - p)
+        sign = np.where(is_call, 1.0, -1.0)
+
+        # the tree is stored as (nodes x contracts) so every time slice is a contiguous block of rows
+        # stock prices at expiry, node j has j up moves: S_0 * u^(2j - N)
+        j = np.arange(N + 1)[:, None]
+        spot = S_0 * np.exp(np.log(u) * (2 * j - N))
+        values = np.maximum(sign * (spot - K), 0)
+        up = np.empty_like(values)
+        exercise = np.empty_like(values)
+
+        # the live part of each buffer shrinks by one node per step, so everything is done in place
+        slices = {}
+        for i in range(N - 1, -1, -1):
+            np.multiply(values[1:i + 2], disc_p_up, out=up[:i + 1])
+            live = values[:i + 1]
+            live *= disc_p_down
+            live += up[:i + 1]
+            if american:
+                # node j at step i has price S_0 * u^(2j - i), one up move above node j at step i + 1
+                spot_i = spot[:i + 1]
+                spot_i *= u
+                np.subtract(spot_i, K, out=exercise[:i + 1])
+                exercise[:i + 1] *= sign
+                np.maximum(live, exercise[:i + 1], out=live)
+            if i <= 2:
+                slices[i] = live.T.copy()
+
+        return(slices[0], slices[1], slices[2], S_0, u, dt)
+
+    def calc_model_price_batch(self, S_0, K, T, sigma, is_call, q = 0.0, r = None, is_american = True):
+        '''
+        Calculate lattice prices for arrays of options sharing num_steps.
+        Inputs broadcast against each other; is_call and is_american are boolean arrays.
+        Returns a flat array with one price per contract.
+        '''
+        V0, V1, V2, S_0, u, dt = self._run_lattice(S_0, K, T, sigma, is_call, q, r, is_american)
+        return(V0[:, 0])
+
+    def calc_greeks_batch(self, S_0, K, T, sigma, is_call, q = 0.0, r = None, is_american = True,
+                          vol_bump = 1e-4, rate_bump = 1e-4):
+        '''
+        Calculate price and greeks from the lattice: delta, gamma and theta come from the
+        first two time slices of the same tree, vega and rho from central bumps of sigma and r.
+        Returns a Greeks record of flat arrays.
+        '''
+        if r is None:
+            r = self.risk_free_rate
+        V0, V1, V2, S_up, u, dt = self._run_lattice(S_0, K, T, sigma, is_call, q, r, is_american)
+        d = 1 / u
+
+        S_1 = S_up[:, None] * np.stack([d, u], axis=1)
+        S_2 = S_up[:, None] * np.stack([d * d, np.ones_like(u), u * u], axis=1)
+
+        price = V0[:, 0]
+        delta = (V1[:, 1] - V1[:, 0]) / (S_1[:, 1] - S_1[:, 0])
+        delta_up = (V2[:, 2] - V2[:, 1]) / (S_2[:, 2] - S_2[:, 1])
+        delta_down = (V2[:, 1] - V2[:, 0]) / (S_2[:, 1] - S_2[:, 0])
+        gamma = (delta_up - delta_down) / (0.5 * (S_2[:, 2] - S_2[:, 0]))
+        theta = (V2[:, 1] - price) / (2 * dt)
+
+        sigma = np.asarray(sigma, dtype=np.float64)
+        r = np.asarray(r, dtype=np.float64)
+        vega = (self.calc_model_price_batch(S_0, K, T, sigma + vol_bump, is_call, q, r, is_american) -
+                self.calc_model_price_batch(S_0, K, T, sigma - vol_bump, is_call, q, r, is_american)) / (2 * vol_bump)
+        rho = (self.calc_model_price_batch(S_0, K, T, sigma, is_call, q, r + rate_bump, is_american) -
+               self.calc_model_price_batch(S_0, K, T, sigma, is_call, q, r - rate_bump, is_american)) / (2 * rate_bump)
+
+        return(Greeks(price, delta, gamma, theta, vega, rho))
+
+    def calc_model_price(self, option):
+        '''
+        Calculate the price of a European or American option on the lattice
+        '''
+        S_0, K, T, r, q, sigma = self._get_market_data(option)
+        px = self.calc_model_price_batch(S_0, K, T, sigma, option.option_type == FinancialOption.Type.CALL, q, r,
+                                         option.option_style == FinancialOption.Style.AMERICAN)
+        return(float(px[0]))
+
+    def calc_greeks(self, option):
+        '''
+        Calculate the price and all greeks of the option on the lattice, returned as a Greeks record
+        '''
+        S_0, K, T, r, q, sigma = self._get_market_data(option)
+        result = self.calc_greeks_batch(S_0, K, T, sigma, option.option_type == FinancialOption.Type.CALL, q, r,
+                                        option.option_style == FinancialOption.Style.AMERICAN)
+        return(Greeks(*[float(x[0]) for x in result]))
+
+    def calc_delta(self, option):
+        return(self.calc_greeks(option).delta)
+
+    def calc_gamma(self, option):
+        return(self.calc_greeks(option).gamma)
+
+    def calc_theta(self, option):
+        return(self.calc_greeks(option).theta)
+
+    def calc_vega(self, option):
+        return(self.calc_greeks(option).vega)
+
+    def calc_rho(self, option):
+        return(self.calc_greeks(option).rho)
+
+
+def _test():
+    pricing_date = datetime.datetime.now()
+    risk_free_rate = 0.1
+    model = BinomialTreeModel(pricing_date, risk_free_rate, num_steps = 500)
+
+    # American put from Hull: S=50, K=50, r=10%, sigma=40%, 5 months, about 4.28
+    stock = Stock(opt=None, db_connection=None, ticker='Test', spot_price=50, sigma=0.4)
+    put_option = AmericanPutOption(stock, time_to_expiry=5/12, strike=50)
+    call_option = AmericanCallOption(stock, time_to_expiry=5/12, strike=50)
+
+    print("American Put Price:", model.calc_model_price(put_option))
+    print("American Put Greeks:", model.calc_greeks(put_option))
+    # without dividends early exercise of a call is never optimal, so it equals the European call
+    print("American Call Price:", model.calc_model_price(call_option))
+    print("European Call Price (B-S):", BlackScholesModel(pricing_date, risk_free_rate).calc_model_price(
+        EuropeanCallOption(stock, time_to_expiry=5/12, strike=50)))
+
+def _benchmark():
+    '''
+    convergence and speed of the lattice against the European closed form
+    '''
+    pricing_date = datetime.datetime.now()
+    risk_free_rate = 0.05
+    bs_model = BlackScholesModel(pricing_date, risk_free_rate)
+
+    num_contracts = 1000
+    rng = np.random.default_rng(0)
+    S_0 = 100.0
+    K = rng.uniform(70, 130, num_contracts)
+    T = rng.uniform(0.1, 2.0, num_contracts)
+    sigma = rng.uniform(0.1, 0.5, num_contracts)
+    q = 0.01
+    is_call = rng.random(num_contracts) < 0.5
+    reference = bs_model.calc_model_price_batch(S_0, K, T, sigma, is_call, q)
+
+    print(f"{'steps':>6} {'max abs err':>12} {'mean abs err':>13} {'contracts/s':>12}")
+    for num_steps in [50, 100, 200, 500, 1000]:
+        model = BinomialTreeModel(pricing_date, risk_free_rate, num_steps)
+        start = time.perf_counter()
+        px = model.calc_model_price_batch(S_0, K, T, sigma, is_call, q, is_american = False)
+        elapsed = time.perf_counter() - start
+        err = np.abs(px - reference)
+        print(f"{num_steps:>6} {err.max():>12.6f} {err.mean():>13.6f} {num_contracts / elapsed:>12.0f}")
+
+if __name__ == "__main__":
+    _test()
+    _benchmark()
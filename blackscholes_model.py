@@ -1,19 +1,33 @@
 import datetime
+import collections
 
+import numpy as np
 from scipy.stats import norm
+from scipy.special import ndtr
 from math import log, exp, sqrt
 
 from stock import Stock
 from financial_option import *
+from option_chain import OptionChain
+
+# price and greeks of an option; fields are floats for a single option or arrays for a batch
+Greeks = collections.namedtuple('Greeks', ['price', 'delta', 'gamma', 'theta', 'vega', 'rho'])
 
 class BlackScholesModel(object):
     '''
     Implementation of the Black-Schole Model for pricing European options
+    Every calc_* method accepts a single FinancialOption or a whole OptionChain; for a chain the
+    results are arrays with one value per contract, in the order the contracts were given to the chain
+    vol_surface is an optional VolatilitySurface or VolatilitySurfaceCache used in place of
+    option.underlying.sigma
+    cache is an optional PricingCache consulted by calc_model_price, calc_greeks and the greek methods
     '''
 
-    def __init__(self, pricing_date, risk_free_rate):
+    def __init__(self, pricing_date, risk_free_rate, vol_surface = None, cache = None):
         self.pricing_date = pricing_date
         self.risk_free_rate = risk_free_rate
+        self.vol_surface = vol_surface
+        self.cache = cache
 
     def calc_parity_price(self, option, option_price):
         '''
@@ -22,6 +36,12 @@ class BlackScholesModel(object):
         '''
         result = None
 
+        if isinstance(option, OptionChain):
+            S_0, K, T, r, q, sigma, is_call = self._get_market_data(option)
+            # call: C + K e^(-rT) - S_0, put: P - K e^(-rT) + S_0
+            sign = np.where(is_call, 1.0, -1.0)
+            return(np.asarray(option_price) + option.to_input_order(sign * (K * np.exp(-r * T) - S_0)))
+
         if option.option_type == FinancialOption.Type.CALL:
             result = option_price + option.strike * exp(-self.risk_free_rate * option.time_to_expiry) - option.underlying.spot_price
         elif option.option_type == FinancialOption.Type.PUT:
@@ -29,141 +49,160 @@ class BlackScholesModel(object):
       
         return(result)
 
-    def calc_model_price(self, option):
+    def _get_market_data(self, option):
         '''
-        Calculate the price of the option using Black-Scholes model
+        return (S_0, K, T, r, q, sigma, is_call) for a single option, or arrays of them for an OptionChain
+        '''
+        if isinstance(option, OptionChain):
+            S_0, q, sigma = option.get_market_data()
+            if self.vol_surface is not None:
+                sigma = np.empty_like(sigma)
+                for i in np.unique(option.underlying_index):
+                    rows = option.underlying_index == i
+                    sigma[rows] = self.vol_surface.get_sigma(option.strike[rows], option.time_to_expiry[rows],
+                                                             option.underlyings[i].ticker)
+            return(S_0, option.strike, option.time_to_expiry, self.risk_free_rate, q, sigma, option.is_call)
+
+        S_0 = option.underlying.spot_price
+        K = option.strike
+        T = option.time_to_expiry
+        r = self.risk_free_rate
+        q = option.underlying.dividend_yield
+        sigma = option.underlying.sigma
+        if self.vol_surface is not None:
+            sigma = float(self.vol_surface.get_sigma(K, T, option.underlying.ticker))
+        is_call = option.option_type == FinancialOption.Type.CALL
+        return(S_0, K, T, r, q, sigma, is_call)
+
+    def _check_european(self, option):
+        if isinstance(option, OptionChain):
+            if option.is_american.any():
+                raise Exception("B\\S price for American option not implemented yet")
+        elif option.option_style == FinancialOption.Style.AMERICAN:
+            raise Exception("B\\S price for American option not implemented yet")
+        elif option.option_style != FinancialOption.Style.EUROPEAN:
+            raise Exception("Unsupported option type")
+
+    def _calc_intermediates(self, S_0, K, T, sigma, is_call, q, r):
+        '''
+        return the terms shared by the price and every greek as arrays:
+        (S_0, K, T, r, q, sigma, sign, sqrt_T, d1, d2, fwd_S, disc_K)
+        sign is +1 for calls and -1 for puts, so one expression covers both types
         '''
-        px = None
-        if option.option_style == FinancialOption.Style.AMERICAN:
-            raise Exception("B\S price for American option not implemented yet")
-        else:
-            S_0 = option.underlying.spot_price
-            K = option.strike
-            T = option.time_to_expiry
+        if r is None:
             r = self.risk_free_rate
-            q = option.underlying.dividend_yield
-            sigma = option.underlying.sigma 
-            d1 = (log(S_0/K)+(r-q+pow(sigma, 2)/2)*T)/(sigma * sqrt(T))
-            d2 = d1 - (sigma * sqrt(T))
+        S_0 = np.asarray(S_0, dtype=np.float64)
+        K = np.asarray(K, dtype=np.float64)
+        T = np.asarray(T, dtype=np.float64)
+        r = np.asarray(r, dtype=np.float64)
+        q = np.asarray(q, dtype=np.float64)
+        sigma = np.asarray(sigma, dtype=np.float64)
+        sign = np.where(np.asarray(is_call, dtype=bool), 1.0, -1.0)
+
+        sqrt_T = np.sqrt(T)
+        vol_sqrt_T = sigma * sqrt_T
+        d1 = (np.log(S_0 / K) + (r - q + sigma * sigma / 2) * T) / vol_sqrt_T
+        d2 = d1 - vol_sqrt_T
+        fwd_S = S_0 * np.exp(-q * T)
+        disc_K = K * np.exp(-r * T)
+
+        return(S_0, K, T, r, q, sigma, sign, sqrt_T, d1, d2, fwd_S, disc_K)
+
+    def calc_model_price_batch(self, S_0, K, T, sigma, is_call, q = 0.0, r = None):
+        '''
+        Calculate Black-Scholes prices for arrays of European options in one broadcasted pass.
+        All inputs are array-like and broadcast against each other; is_call is a boolean array
+        (True for calls, False for puts). r defaults to the model's risk_free_rate.
+        '''
+        S_0, K, T, r, q, sigma, sign, sqrt_T, d1, d2, fwd_S, disc_K = \
+            self._calc_intermediates(S_0, K, T, sigma, is_call, q, r)
 
-            if option.option_type == FinancialOption.Type.CALL:
-                px = (S_0 * exp(-q * T) * norm.cdf(d1)) - (K * exp(-r * T) * norm.cdf(d2))
-            else:
-                px = (K * exp(-r * T) * norm.cdf(-d2)) - (S_0 * exp(-q * T) * norm.cdf(-d1))
+        px = sign * (fwd_S * ndtr(sign * d1) - disc_K * ndtr(sign * d2))
 
         return(px)
 
-    def calc_delta(self, option):
-        if option.option_style == FinancialOption.Style.AMERICAN:
-            raise Exception("B\S price for American option not implemented yet")
-        elif option.option_style == FinancialOption.Style.EUROPEAN:
-            S_0 = option.underlying.spot_price
-            K = option.strike
-            T = option.time_to_expiry
-            r = self.risk_free_rate
-            q = option.underlying.dividend_yield
-            sigma = option.underlying.sigma       
-            d1 = (log(S_0/K)+(r-q+pow(sigma, 2)/2)*T)/(sigma * sqrt(T))
+    def calc_greeks_batch(self, S_0, K, T, sigma, is_call, q = 0.0, r = None):
+        '''
+        Calculate price, delta, gamma, theta, vega and rho for arrays of European options
+        from one shared set of d1/d2, normal cdf and pdf values.
+        Inputs broadcast as in calc_model_price_batch; returns a Greeks record of arrays.
+        Theta is per year, vega and rho are per unit (1.0 = 100%) change.
+        '''
+        S_0, K, T, r, q, sigma, sign, sqrt_T, d1, d2, fwd_S, disc_K = \
+            self._calc_intermediates(S_0, K, T, sigma, is_call, q, r)
 
-            if option.option_type == FinancialOption.Type.CALL:
-                result = exp(-q * T) * norm.cdf(d1)
-            else:
-                result = exp(-q * T) * (norm.cdf(d1) - 1)
+        cdf_d1 = ndtr(sign * d1)
+        cdf_d2 = ndtr(sign * d2)
+        pdf_d1 = np.exp(-0.5 * d1 * d1) / sqrt(2 * np.pi)
+        fwd_S_pdf = fwd_S * pdf_d1
 
-        else:
-            raise Exception("Unsupported option type")
+        price = sign * (fwd_S * cdf_d1 - disc_K * cdf_d2)
+        delta = sign * np.exp(-q * T) * cdf_d1
+        gamma = fwd_S_pdf / (S_0 * S_0 * sigma * sqrt_T)
+        theta = -fwd_S_pdf * sigma / (2 * sqrt_T) + sign * (q * fwd_S * cdf_d1 - r * disc_K * cdf_d2)
+        vega = fwd_S_pdf * sqrt_T
+        rho = sign * disc_K * T * cdf_d2
 
-        return result
+        return(Greeks(price, delta, gamma, theta, vega, rho))
 
-    def calc_gamma(self, option):
+    def calc_model_price(self, option):
+        '''
+        Calculate the price of the option using Black-Scholes model
+        '''
+        if self.cache is not None:
+            return(self.calc_greeks(option).price)
 
-        if option.option_style == FinancialOption.Style.AMERICAN:
-            raise Exception("B\S price for American option not implemented yet")
-        elif option.option_style == FinancialOption.Style.EUROPEAN:
-            S_0 = option.underlying.spot_price
-            K = option.strike
-            T = option.time_to_expiry
-            r = self.risk_free_rate
-            q = option.underlying.dividend_yield
-            sigma = option.underlying.sigma
-            d1 = (np.log(S_0 / K) + (r - q + sigma ** 2 / 2) * T) / (sigma * sqrt(T))
+        self._check_european(option)
 
-            if option.option_type == FinancialOption.Type.CALL:
-                result = (exp(-q * T) * norm.pdf(d1)) / (S_0 * sigma * sqrt(T))
-            else:
-                result = (exp(-q * T) * norm.pdf(d1)) / (S_0 * sigma * sqrt(T))
+        S_0, K, T, r, q, sigma, is_call = self._get_market_data(option)
+        px = self.calc_model_price_batch(S_0, K, T, sigma, is_call, q, r)
 
-        else:
-            raise Exception("Unsupported option type")
+        if isinstance(option, OptionChain):
+            return(option.to_input_order(px))
+        return(float(px))
+
+    def calc_greeks(self, option):
+        '''
+        Calculate the price and all greeks of the option in a single pass, returned as a Greeks record
+        '''
+        self._check_european(option)
 
-        return result
+        S_0, K, T, r, q, sigma, is_call = self._get_market_data(option)
 
-    def calc_theta(self, option):
-        if option.option_style == FinancialOption.Style.AMERICAN:
-            raise Exception("B\S price for American option not implemented yet")
-        elif option.option_style == FinancialOption.Style.EUROPEAN:
-            S_0 = option.underlying.spot_price
-            K = option.strike
-            T = option.time_to_expiry
-            r = self.risk_free_rate
-            q = option.underlying.dividend_yield
-            sigma = option.underlying.sigma
-            d1 = (np.log(S_0 / K) + (r - q + sigma ** 2 / 2) * T) / (sigma * sqrt(T))
-            d2 = d1 - sigma * sqrt(T)
-
-            if option.option_type == FinancialOption.Type.CALL:
-                result = (-S_0 * norm.pdf(d1) * sigma * exp(-q * T)) / (2 * sqrt(T)) + \
-                         (q * S_0 * norm.cdf(d1) * exp(-q * T)) - (r * K * exp(-r * T) * norm.cdf(d2))
+        if isinstance(option, OptionChain):
+            if self.cache is not None:
+                result = self.cache.get_greeks_batch(S_0, K, T, sigma, is_call, q, r, self.calc_greeks_batch)
             else:
-                result = (norm.pdf(d1) * exp(-q * T)) / (S_0 * sigma * sqrt(T)) - \
-                         (q * S_0 * norm.cdf(-d1) * exp(-q * T)) + (r * K * exp(-r * T) * norm.cdf(-d2))
-        else:
-            raise Exception("Unsupported option type")
+                result = self.calc_greeks_batch(S_0, K, T, sigma, is_call, q, r)
+            return(Greeks(*[option.to_input_order(x) for x in result]))
 
-        return result
+        if self.cache is not None:
+            key = self.cache.make_key(is_call, False, S_0, K, T, r, q, sigma)
+            result = self.cache.get(key)
+            if result is not None:
+                return(result)
 
-    def calc_vega(self, option):
-        if option.option_style == FinancialOption.Style.AMERICAN:
-            raise Exception("B\S price for American option not implemented yet")
-        elif option.option_style == FinancialOption.Style.EUROPEAN:
-            S_0 = option.underlying.spot_price
-            K = option.strike
-            T = option.time_to_expiry
-            r = self.risk_free_rate
-            q = option.underlying.dividend_yield
-            sigma = option.underlying.sigma
-            d1 = (np.log(S_0 / K) + (r - q + sigma ** 2 / 2) * T) / (sigma * sqrt(T))
+        result = self.calc_greeks_batch(S_0, K, T, sigma, is_call, q, r)
+        result = Greeks(*[float(x) for x in result])
 
-            if option.option_type == FinancialOption.Type.CALL:
-                result = S_0 * sqrt(T) * norm.pdf(d1) * exp(-q * T) 
-            else:
-                result = S_0 * sqrt(T) * norm.pdf(d1) * exp(-q * T)
+        if self.cache is not None:
+            self.cache.put(key, result)
+        return(result)
 
-        else:
-            raise Exception("Unsupported option type")
+    def calc_delta(self, option):
+        return(self.calc_greeks(option).delta)
 
-        return result
+    def calc_gamma(self, option):
+        return(self.calc_greeks(option).gamma)
 
-    def calc_rho(self, option):
-        if option.option_style == FinancialOption.Style.AMERICAN:
-            raise Exception("B\S price for American option not implemented yet")
-        elif option.option_style == FinancialOption.Style.EUROPEAN:
-            S_0 = option.underlying.spot_price
-            K = option.strike
-            T = option.time_to_expiry
-            r = self.risk_free_rate
-            sigma = option.underlying.sigma
-            d1 = (np.log(S_0 / K) + (r - q + sigma ** 2 / 2) * T) / (sigma * sqrt(T))
-            d2 = d1 - sigma * sqrt(T)
+    def calc_theta(self, option):
+        return(self.calc_greeks(option).theta)
 
-            if option.option_type == FinancialOption.Type.CALL:
-                result = K * T * exp(-r * T) * norm.cdf(d2)
-            else:
-                result = -K * T * exp(-r * T) * norm.cdf(-d2)
+    def calc_vega(self, option):
+        return(self.calc_greeks(option).vega)
 
-        else:
-            raise Exception("Unsupported option type")
-        return result
+    def calc_rho(self, option):
+        return(self.calc_greeks(option).rho)
 
 
 def _test():
@@ -218,6 +257,21 @@ def _test_two():
 
     pass
 
+def _test_chain():
+    # chain results line up with the contracts in the order they were given, not the sorted rows
+    model = BlackScholesModel(datetime.datetime.now(), 0.05)
+    stock = Stock(opt=None, db_connection=None, ticker='Test', spot_price=100, sigma=0.2)
+    options = [option_class(stock, time_to_expiry=T, strike=K) for T in [1.0, 0.25, 0.5]
+               for K in [120, 80, 100] for option_class in [EuropeanPutOption, EuropeanCallOption]]
+    chain = OptionChain.from_options(options)
+
+    prices = model.calc_model_price(chain)
+    assert np.allclose(prices, [model.calc_model_price(o) for o in options])
+    assert np.allclose(model.calc_greeks(chain).delta, [model.calc_delta(o) for o in options])
+    assert np.allclose(model.calc_parity_price(chain, prices), [model.calc_parity_price(o, p) for o, p in zip(options, prices)])
+    print("Chain prices and greeks are in input order")
+
 if __name__ == "__main__":
     _test()
     _test_two()
+    _test_chain()
@@ -0,0 +1,201 @@
+import os
+import time
+import sqlite3
+import threading
+import contextlib
+
+class DatabaseManager(object):
+    '''
+    Shared access to one SQLite database file for readers and a single writer.
+
+    The database is switched to WAL journaling, so readers see the last committed state and are never
+    blocked by a load in progress (and do not block it). Every thread of every process gets its own
+    pooled read-only connection with a large page cache and memory-mapped I/O; all writes of a process
+    go through one connection serialized by a lock, and writers of different processes queue on
+    SQLite's own lock for up to busy_timeout milliseconds.
+    '''
+
+    def __init__(self, db_file, cache_size_kib = 262144, mmap_size = 2 ** 30, busy_timeout = 60000):
+        self.db_file = os.path.abspath(db_file)
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._readers = []
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._pid = os.getpid()
+        self._enable_wal()
+        self._create_price_index()
+
+    def _enable_wal(self):
+        # the journal mode is stored in the database file, so one writable connection sets it for all
+        if not os.path.exists(self.db_file):
+            return
+        try:
+            db_connection = sqlite3.connect(self.db_file, timeout=self.busy_timeout / 1000)
+            db_connection.execute("PRAGMA journal_mode=WAL")
+            db_connection.close()
+        except sqlite3.OperationalError as e:
+            print(f"Could not enable WAL on {self.db_file}: {e}")
+
+    def _create_price_index(self):
+        # a price table loaded before the covering index existed gets it the first time it is opened
+        import schema
+
+        if not os.path.exists(self.db_file):
+            return
+        try:
+            with self.writer() as db_connection:
+                schema.create_price_index(db_connection)
+        except sqlite3.OperationalError as e:
+            print(f"Could not check the EquityDailyPrice index of {self.db_file}: {e}")
+
+    def _configure(self, db_connection):
+        db_connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        db_connection.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        db_connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        db_connection.execute("PRAGMA temp_store=MEMORY")
+        return(db_connection)
+
+    def _check_fork(self):
+        # connections must not cross a fork: a child process starts with empty pools of its own
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._lock = threading.Lock()
+            self._readers = []
+            self._writer = None
+            self._write_lock = threading.RLock()
+
+    def get_reader(self):
+        '''
+        return the read-only connection of the calling thread, opening it on first use
+        '''
+        self._check_fork()
+        db_connection = getattr(self._local, 'reader', None)
+        if db_connection is None:
+            db_connection = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, timeout=self.busy_timeout / 1000)
+            self._configure(db_connection)
+            db_connection.execute("PRAGMA query_only=ON")
+            self._local.reader = db_connection
+            with self._lock:
+                self._readers.append(db_connection)
+        return(db_connection)
+
+    def get_writer(self):
+        '''
+        return the process' writer connection; use writer() to hold the write lock while using it
+        '''
+        self._check_fork()
+        with self._lock:
+            if self._writer is None:
+                self._writer = sqlite3.connect(self.db_file, timeout=self.busy_timeout / 1000, check_same_thread=False)
+                self._configure(self._writer)
+                self._writer.execute("PRAGMA journal_mode=WAL")
+                self._writer.execute("PRAGMA synchronous=NORMAL")
+        return(self._writer)
+
+    @contextlib.contextmanager
+    def writer(self):
+        '''
+        context manager yielding the writer connection under the write lock; the transaction is
+        committed when the block ends and rolled back if it raises
+        '''
+        db_connection = self.get_writer()
+        with self._write_lock:
+            try:
+                yield db_connection
+                db_connection.commit()
+            except Exception:
+                db_connection.rollback()
+                raise
+
+    def close(self):
+        with self._lock:
+            for db_connection in self._readers:
+                try:
+                    db_connection.close()
+                except sqlite3.ProgrammingError:
+                    # a connection of another thread; it is closed when that thread's objects go away
+                    pass
+            self._readers = []
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        self._local = threading.local()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_manager(db_file):
+    '''
+    return the DatabaseManager of db_file shared by the whole process
+    '''
+    key = (os.getpid(), os.path.abspath(db_file))
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = DatabaseManager(db_file)
+        return(_managers[key])
+
+
+def _test(num_readers = 4, duration = 2.0):
+    # readers keep their query rate while a writer loads batches into the same file
+    import tempfile
+
+    import schema
+
+    db_file = os.path.join(tempfile.mkdtemp(), "Equity.db")
+    db_connection = sqlite3.connect(db_file)
+    schema.create_daily_price_table(db_connection)
+    first_day = int(schema.to_day_number('2020-01-01'))
+    db_connection.executemany("INSERT INTO EquityDailyPrice VALUES (?, ?, 1, 1, 1, 1, 1, 0, 0)",
+                              [(f"T{i}", first_day + d) for i in range(100) for d in range(28)])
+    db_connection.commit()
+    db_connection.close()
+
+    manager = get_manager(db_file)
+
+    def read_loop(stop, counts, errors):
+        reader = manager.get_reader()
+        n = 0
+        while not stop.is_set():
+            try:
+                reader.execute("select count(*), avg(Close) from EquityDailyPrice where Ticker = 'T7'").fetchone()
+                n += 1
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+        counts.append(n)
+
+    def write_loop(stop):
+        batch = 0
+        while not stop.is_set():
+            with manager.writer() as writer:
+                writer.executemany("INSERT OR REPLACE INTO EquityDailyPrice VALUES (?, ?, 2, 2, 2, 2, 2, 0, 0)",
+                                   [(f"L{batch}", first_day + 366 + d) for d in range(336)])
+            batch += 1
+
+    for with_writer in [False, True]:
+        stop = threading.Event()
+        counts, errors = [], []
+        threads = [threading.Thread(target=read_loop, args=(stop, counts, errors)) for i in range(num_readers)]
+        if with_writer:
+            threads.append(threading.Thread(target=write_loop, args=(stop,)))
+        for t in threads:
+            t.start()
+        time.sleep(duration)
+        stop.set()
+        for t in threads:
+            t.join()
+        print(f"{'With' if with_writer else 'Without'} a concurrent writer: {sum(counts) / duration:,.0f} reads/s, "
+              f"{len(errors)} errors")
+
+    with manager.writer() as writer:
+        print("Journal mode:", writer.execute("PRAGMA journal_mode").fetchone()[0],
+              "rows:", writer.execute("select count(*) from EquityDailyPrice").fetchone()[0])
+    manager.close()
+
+if __name__ == "__main__":
+    _test()
@@ -9,7 +9,9 @@ class FinancialOption(object):
     '''
     time_to_expiry is the number of days till expiry_date expressed in unit of years
     underlying is the underlying stock object
+    __slots__ keeps per-contract objects free of a __dict__; use OptionChain for whole chains
     '''
+    __slots__ = ('option_type', 'option_style', 'underlying', 'time_to_expiry', 'strike')
 
     class Type(enum.Enum):
         CALL = "Call"
@@ -27,21 +29,29 @@ class FinancialOption(object):
         self.strike = strike
 
 class EuropeanCallOption(FinancialOption):
+    __slots__ = ()
+
     def __init__(self, underlying, time_to_expiry, strike):
         FinancialOption.__init__(self, FinancialOption.Type.CALL, FinancialOption.Style.EUROPEAN,
                         underlying, time_to_expiry, strike)
 
 class EuropeanPutOption(FinancialOption):
+    __slots__ = ()
+
     def __init__(self, underlying, time_to_expiry, strike):
         FinancialOption.__init__(self, FinancialOption.Type.PUT, FinancialOption.Style.EUROPEAN,
                         underlying, time_to_expiry, strike)
 
 class AmericanCallOption(FinancialOption):
+    __slots__ = ()
+
     def __init__(self, underlying, time_to_expiry, strike):
         FinancialOption.__init__(self, FinancialOption.Type.CALL, FinancialOption.Style.AMERICAN,
                         underlying, time_to_expiry, strike)
 
 class AmericanPutOption(FinancialOption):
+    __slots__ = ()
+
     def __init__(self, underlying, time_to_expiry, strike):
         FinancialOption.__init__(self, FinancialOption.Type.PUT, FinancialOption.Style.AMERICAN,
                         underlying, time_to_expiry, strike)
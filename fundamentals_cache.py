@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import collections
+
+import pandas as pd
+
+import option
+
+CacheEntry = collections.namedtuple('CacheEntry', ['as_of_date', 'fetched_at', 'history'])
+
+STATEMENTS = ('income', 'balance', 'cash')
+
+def statement_key(freq, statement):
+    '''
+    key of a statement history in the dict YahooFinancials.get_financial_stmts returns
+    '''
+    name = {'income': 'incomeStatementHistory', 'balance': 'balanceSheetHistory',
+            'cash': 'cashflowStatementHistory'}[statement]
+    if freq == 'annual':
+        return(name)
+    elif freq == 'quarterly':
+        return(name + 'Quarterly')
+    raise ValueError(f"Unknown frequency {freq}")
+
+def latest_as_of_date(history):
+    # a history is a list of {date: {item: value}}, oldest first; quote values have no date
+    return(list(history[-1].keys())[0] if isinstance(history, list) and history else None)
+
+
+class FundamentalsCache(object):
+    '''
+    SQLite cache of the financial statement histories MyYahooFinancials downloads, one row per
+    (ticker, freq, statement) holding the zlib compressed JSON history, the as-of date of its latest
+    statement and the time it was fetched. Quote values such as the beta Stock scrapes are kept in
+    the same table with freq 'quote'.
+
+    An entry is fresh for ttl_days after it was fetched; stale entries are fetched again, and kept
+    when the fetch fails. Entries written with another CACHE_VERSION are ignored. With offline=True
+    every request is served from the cache, stale or not, and a missing entry raises.
+    '''
+    CACHE_VERSION = 1
+    TABLE = 'FundamentalStatement'
+
+    def __init__(self, db_file, ttl_days = 30, offline = False):
+        self.db_file = db_file
+        self.ttl_days = ttl_days
+        self.offline = offline
+        if os.path.dirname(db_file):
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self.db_connection = sqlite3.connect(db_file)
+        self.db_connection.execute(f"CREATE TABLE IF NOT EXISTS {FundamentalsCache.TABLE} ("
+                                   "Ticker TEXT NOT NULL, Freq TEXT NOT NULL, Statement TEXT NOT NULL, "
+                                   "AsOfDate TEXT, FetchedAt REAL NOT NULL, Version INTEGER NOT NULL, Data BLOB NOT NULL, "
+                                   "PRIMARY KEY (Ticker, Freq, Statement))")
+        self.db_connection.commit()
+
+    def get(self, ticker, freq, statement):
+        '''
+        return the CacheEntry of a statement history, or None if it is not cached
+        '''
+        row = self.db_connection.execute(f"select AsOfDate, FetchedAt, Version, Data from {FundamentalsCache.TABLE} "
+                                         "where Ticker = ? and Freq = ? and Statement = ?",
+                                         (ticker, freq, statement)).fetchone()
+        if row is None or row[2] != FundamentalsCache.CACHE_VERSION:
+            return(None)
+        return(CacheEntry(row[0], row[1], json.loads(zlib.decompress(row[3]))))
+
+    def put(self, ticker, freq, statement, history, commit = True):
+        data = zlib.compress(json.dumps(history, default=str).encode('utf-8'))
+        self.db_connection.execute(f"INSERT OR REPLACE INTO {FundamentalsCache.TABLE} "
+                                   "(Ticker, Freq, Statement, AsOfDate, FetchedAt, Version, Data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (ticker, freq, statement, latest_as_of_date(history), time.time(),
+                                    FundamentalsCache.CACHE_VERSION, data))
+        if commit:
+            self.db_connection.commit()
+
+    def is_fresh(self, entry):
+        return(entry is not None and time.time() - entry.fetched_at < self.ttl_days * 86400)
+
+    def get_statement_history(self, ticker, freq, statement, fetch):
+        '''
+        return the statement history of the ticker from the cache, calling fetch() for it (and caching
+        the result) when the entry is missing or stale and the cache is online
+        '''
+        entry = self.get(ticker, freq, statement)
+        if self.is_fresh(entry) or (self.offline and entry is not None):
+            return(entry.history)
+        if self.offline:
+            raise Exception(f"No cached {freq} {statement} statement for {ticker} in offline mode")
+
+        try:
+            history = fetch()
+        except Exception as e:
+            if entry is None:
+                raise
+            print(f"Failed to fetch the {freq} {statement} statement for {ticker} ({e}), "
+                  f"using the cached one as of {entry.as_of_date}")
+            return(entry.history)
+        self.put(ticker, freq, statement, history)
+        return(history)
+
+    def get_quote_value(self, ticker, name, fetch):
+        '''
+        return a quote value of the ticker (e.g. 'beta') from the cache, with the same freshness and
+        offline rules as the statements; fetch() raises when the value is not available
+        '''
+        return(self.get_statement_history(ticker, 'quote', name, fetch))
+
+    def prefetch(self, tickers, freq = 'annual', statements = STATEMENTS, tickers_per_request = 20, max_workers = 8):
+        '''
+        fetch the statements of every ticker without a fresh entry, tickers_per_request tickers per
+        concurrent YahooFinancials call, and return the tickers that could not be fetched
+        '''
+        from yahoofinancials import YahooFinancials
+
+        missing = [t for t in tickers if any(not self.is_fresh(self.get(t, freq, s)) for s in statements)]
+        if self.offline or len(missing) == 0:
+            return([t for t in missing if any(self.get(t, freq, s) is None for s in statements)])
+
+        failed = []
+        for i in range(0, len(missing), tickers_per_request):
+            chunk = missing[i:i + tickers_per_request]
+            try:
+                data = YahooFinancials(chunk, concurrent=True, max_workers=max_workers) \
+                    .get_financial_stmts(freq, list(statements))
+            except Exception as e:
+                print(f"Failed to fetch statements for {', '.join(chunk)}: {e}")
+                failed.extend(chunk)
+                continue
+            for ticker in chunk:
+                # YahooFinancials keys its results by the upper case ticker
+                histories = [(data.get(statement_key(freq, s)) or {}).get(ticker.upper()) for s in statements]
+                if any(not h for h in histories):
+                    failed.append(ticker)
+                    continue
+                for s, history in zip(statements, histories):
+                    self.put(ticker, freq, s, history, commit=False)
+            self.db_connection.commit()
+            print(f"Prefetched {min(i + tickers_per_request, len(missing))} of {len(missing)} tickers")
+        return(failed)
+
+    def close(self):
+        self.db_connection.close()
+
+
+def _test():
+    import tempfile
+
+    cache = FundamentalsCache(os.path.join(tempfile.mkdtemp(), "Fundamentals.db"), ttl_days=30)
+    history = [{'2022-09-24': {'totalRevenue': 394328000000.0}}, {'2023-09-30': {'totalRevenue': 383285000000.0}}]
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return(history)
+
+    assert cache.get_statement_history('AAPL', 'annual', 'income', fetch) == history
+    assert cache.get_statement_history('AAPL', 'annual', 'income', fetch) == history
+    assert len(calls) == 1 and cache.get('AAPL', 'annual', 'income').as_of_date == '2023-09-30'
+
+    # a stale entry is fetched again, and kept if that fails
+    cache.db_connection.execute(f"UPDATE {FundamentalsCache.TABLE} SET FetchedAt = FetchedAt - 31 * 86400")
+    def fail():
+        raise Exception("network is down")
+    assert cache.get_statement_history('AAPL', 'annual', 'income', fail) == history
+    cache.get_statement_history('AAPL', 'annual', 'income', fetch)
+    assert len(calls) == 2
+
+    # offline mode never fetches
+    cache.offline = True
+    assert cache.get_statement_history('AAPL', 'annual', 'income', fail) == history
+    try:
+        cache.get_statement_history('MSFT', 'annual', 'income', fetch)
+        raise AssertionError("offline cache miss did not raise")
+    except Exception as e:
+        print(e)
+    assert len(calls) == 2
+    assert cache.prefetch(['AAPL', 'MSFT'], statements=('income',)) == ['MSFT']
+
+    # quote values are cached next to the statements and served offline
+    cache.offline = False
+    assert cache.get_quote_value('AAPL', 'beta', lambda: 1.29) == 1.29
+    cache.offline = True
+    assert cache.get_quote_value('AAPL', 'beta', fail) == 1.29
+    assert cache.get('AAPL', 'quote', 'beta').as_of_date is None
+
+    # entries of an older cache version are misses
+    cache.db_connection.execute(f"UPDATE {FundamentalsCache.TABLE} SET Version = 0")
+    assert cache.get('AAPL', 'annual', 'income') is None
+    cache.close()
+    print("Fundamentals cache tests passed")
+
+def run():
+    parser = option.get_default_parser()
+    parser.add_argument('--data_dir', dest = 'data_dir', default='./data', help='data dir')
+    parser.add_argument('--freq', dest = 'freq', default='annual', help='annual or quarterly')
+    parser.add_argument('--ttl_days', dest = 'ttl_days', type=float, default=30, help='days before a cached statement is fetched again')
+
+    args = parser.parse_args()
+    opt = option.Option(args = args)
+    opt.fundamentals_db = os.path.join(opt.data_dir, "sqlitedb/Fundamentals.db")
+
+    if opt.tickers is not None:
+        list_of_tickers = opt.tickers.split(',')
+    else:
+        fname = os.path.join(opt.data_dir, "S&P500.txt")
+        list_of_tickers = list(pd.read_csv(fname, header=None).iloc[:, 0])
+
+    cache = FundamentalsCache(opt.fundamentals_db, ttl_days=opt.ttl_days)
+    start = time.perf_counter()
+    failed = cache.prefetch(list_of_tickers, opt.freq)
+    print(f"Prefetched {len(list_of_tickers)} tickers in {time.perf_counter() - start:.1f} s, {len(failed)} failed: {failed}")
+    cache.close()
+
+if __name__ == "__main__":
+    run()
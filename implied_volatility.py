@@ -0,0 +1,156 @@
+import time
+import datetime
+import collections
+
+import numpy as np
+
+from blackscholes_model import BlackScholesModel
+
+# sigma is the implied vol per quote (NaN unless converged), converged flags which rows met the
+# tolerance and iterations is the number of iterations each row needed
+ImpliedVolResult = collections.namedtuple('ImpliedVolResult', ['sigma', 'converged', 'iterations'])
+
+class ImpliedVolatilitySolver(object):
+    '''
+    Backs out Black-Scholes implied volatility for whole arrays of option quotes.
+
+    Each row runs a safeguarded Newton iteration using the batched vega from the model:
+    a Newton step that leaves the current [sigma_lower, sigma_upper] bracket, or that has
+    a vanishing vega, falls back to bisection of the bracket. Rows drop out of the
+    iteration as soon as they converge, and rows that never converge are reported
+    through the converged flags instead of raising.
+    '''
+
+    def __init__(self, model, tolerance = 1e-8, max_iterations = 100, sigma_lower = 1e-6, sigma_upper = 5.0):
+        self.model = model
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.sigma_lower = sigma_lower
+        self.sigma_upper = sigma_upper
+
+    def _initial_guess(self, S_0, K, T, r, q):
+        # Manaster-Koehler starting point, the vol at which vega is largest
+        guess = np.sqrt(2 * np.abs(np.log(S_0 / K) + (r - q) * T) / T)
+        guess = np.where(np.isfinite(guess) & (guess > 0), guess, 0.2)
+        return(np.clip(guess, self.sigma_lower * 10, self.sigma_upper / 2))
+
+    def solve(self, option_price, S_0, K, T, is_call, q = 0.0, r = None):
+        '''
+        Solve for the implied vol of every quote; inputs broadcast against each other
+        as in BlackScholesModel.calc_model_price_batch.
+        Quotes outside the no-arbitrage bounds, or priced outside the prices at sigma_lower and
+        sigma_upper, get sigma NaN and converged False; so do rows that reach max_iterations or
+        stop on a collapsed bracket without meeting the tolerance.
+        '''
+        if r is None:
+            r = self.model.risk_free_rate
+        option_price, S_0, K, T, is_call, q, r = np.broadcast_arrays(
+            np.asarray(option_price, dtype=np.float64), np.asarray(S_0, dtype=np.float64),
+            np.asarray(K, dtype=np.float64), np.asarray(T, dtype=np.float64),
+            np.asarray(is_call, dtype=bool), np.asarray(q, dtype=np.float64), np.asarray(r, dtype=np.float64))
+        shape = option_price.shape
+        option_price, S_0, K, T, is_call, q, r = [x.ravel() for x in (option_price, S_0, K, T, is_call, q, r)]
+        n = option_price.shape[0]
+
+        sigma = np.full(n, np.nan)
+        converged = np.zeros(n, dtype=bool)
+        iterations = np.zeros(n, dtype=np.int64)
+
+        # a price outside the no-arbitrage bounds has no implied vol
+        fwd_S = S_0 * np.exp(-q * T)
+        disc_K = K * np.exp(-r * T)
+        lower_bound = np.where(is_call, np.maximum(fwd_S - disc_K, 0), np.maximum(disc_K - fwd_S, 0))
+        upper_bound = np.where(is_call, fwd_S, disc_K)
+        valid = (option_price > lower_bound) & (option_price < upper_bound) & (T > 0)
+
+        # nor does a price the [sigma_lower, sigma_upper] bracket cannot reach
+        candidates = np.flatnonzero(valid)
+        args = (S_0[candidates], K[candidates], T[candidates])
+        rest = (is_call[candidates], q[candidates], r[candidates])
+        price_lower = self.model.calc_model_price_batch(*args, self.sigma_lower, *rest)
+        price_upper = self.model.calc_model_price_batch(*args, self.sigma_upper, *rest)
+        quote = option_price[candidates]
+        in_range = (quote >= price_lower - self.tolerance) & (quote <= price_upper + self.tolerance)
+
+        active = candidates[in_range]
+        lo = np.full(active.shape[0], self.sigma_lower)
+        hi = np.full(active.shape[0], self.sigma_upper)
+        vol = self._initial_guess(S_0[active], K[active], T[active], r[active], q[active])
+
+        for i in range(self.max_iterations):
+            if active.shape[0] == 0:
+                break
+
+            greeks = self.model.calc_greeks_batch(S_0[active], K[active], T[active], vol,
+                                                  is_call[active], q[active], r[active])
+            diff = greeks.price - option_price[active]
+            iterations[active] += 1
+
+            # price is increasing in vol, so the sign of diff tightens the bracket
+            hi = np.where(diff > 0, vol, hi)
+            lo = np.where(diff < 0, vol, lo)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step = diff / greeks.vega
+            newton = vol - step
+
+            # a row has converged when the price error is within tolerance and either the Newton
+            # step is too or the bracket has collapsed (deep out of the money quotes with vega ~ 0);
+            # a collapsed bracket with a larger price error stops the row unconverged
+            collapsed = hi - lo < self.tolerance
+            solved = (np.abs(diff) < self.tolerance) & ((np.abs(step) < self.tolerance) | collapsed)
+            done = solved | collapsed
+            sigma[active] = np.where(np.abs(step) < self.tolerance, vol, np.clip(newton, lo, hi))
+            converged[active[solved]] = True
+
+            use_bisection = ~np.isfinite(newton) | (newton <= lo) | (newton >= hi)
+            vol = np.where(use_bisection, (lo + hi) / 2, newton)
+
+            keep = ~done
+            active, lo, hi, vol = active[keep], lo[keep], hi[keep], vol[keep]
+
+        # the last iterate of an unconverged row looks like a vol but is not one
+        sigma[~converged] = np.nan
+        return(ImpliedVolResult(sigma.reshape(shape), converged.reshape(shape), iterations.reshape(shape)))
+
+
+def _test():
+    pricing_date = datetime.datetime.now()
+    risk_free_rate = 0.05
+    model = BlackScholesModel(pricing_date, risk_free_rate)
+    solver = ImpliedVolatilitySolver(model)
+
+    # a synthetic chain: 50 expiries x 200 strikes on a single underlying with a vol smile
+    S_0 = 100.0
+    K, T = np.meshgrid(np.linspace(50, 150, 200), np.linspace(0.05, 2.0, 50))
+    is_call = K >= S_0
+    true_sigma = 0.2 + 0.3 * (np.log(K / S_0) ** 2)
+    prices = model.calc_model_price_batch(S_0, K, T, true_sigma, is_call)
+
+    start = time.perf_counter()
+    result = solver.solve(prices, S_0, K, T, is_call)
+    elapsed = time.perf_counter() - start
+
+    ok = result.converged
+    print(f"Solved {prices.size} quotes in {elapsed * 1000:.2f} ms")
+    print(f"Converged: {ok.sum()} / {ok.size}, max iterations: {result.iterations.max()}")
+    print(f"Max abs vol error on converged rows: {np.max(np.abs(result.sigma[ok] - true_sigma[ok]))}")
+
+    # a quote below intrinsic value is reported, not raised
+    bad = solver.solve([0.01], 100.0, 50.0, 1.0, True)
+    print(f"Quote below intrinsic: sigma={bad.sigma[0]} converged={bad.converged[0]}")
+
+    # quotes priced at a vol above sigma_upper or below sigma_lower are out of range, not solved
+    out_of_range = model.calc_model_price_batch(S_0, 110.0, 1.0, np.array([8.0, 0.05]), True)
+    out = ImpliedVolatilitySolver(model, sigma_lower=0.1).solve(out_of_range, S_0, 110.0, 1.0, True)
+    print(f"Quotes out of the vol range: sigma={out.sigma} converged={out.converged} iterations={out.iterations}")
+    assert not out.converged.any() and np.isnan(out.sigma).all()
+
+    # rows stopped by max_iterations before converging have no vol either
+    capped = ImpliedVolatilitySolver(model, max_iterations=2).solve(prices, S_0, K, T, is_call)
+    print(f"With max_iterations=2: {capped.converged.sum()} / {capped.converged.size} converged")
+    assert (~capped.converged).any() and np.array_equal(np.isnan(capped.sigma), ~capped.converged)
+    assert np.isnan(result.sigma[~ok]).all()
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import db
+import option
+import schema
+from TA import IncrementalSimpleMovingAverages, IncrementalExponentialMovingAverages, IncrementalRSI, IncrementalVWAP
+from TA import SimpleMovingAverages, ExponentialMovingAverages, RSI, _make_test_ohlcv
+
+class IndicatorStore(object):
+    '''
+    Persisted indicator values next to EquityDailyPrice, updated incrementally.
+
+    Three tables live in the same SQLite database:
+      IndicatorValue       one row per (ticker, indicator, date) value, e.g. indicator 'SMA_20'
+      IndicatorCheckpoint  the carry-over state of the streaming indicators (EMA values, SMA window
+                           tails, RSI averages, VWAP sums) after the last bar of every update
+      IndicatorInput       the Close/Volume bars that were consumed, used to detect rewritten history
+
+    update(ticker) reads and feeds only the bars after the last checkpoint through the TA Incremental*
+    classes. The checkpoint also keeps a fingerprint of the bars consumed so far (their count and the
+    sums of Close and Volume, aggregated by SQLite on the price index); when it no longer matches, the
+    price history was rewritten (changed, inserted or deleted bars), the stored inputs locate the first
+    changed date, and everything from there is dropped and recomputed from the latest checkpoint before it.
+    '''
+
+    def __init__(self, db_connection, sma_periods = (9, 20, 50, 100, 200), ema_periods = (12, 26), rsi_period = 14):
+        self.db_connection = db_connection
+        self.sma_periods = list(sma_periods)
+        self.ema_periods = list(ema_periods)
+        self.rsi_period = rsi_period
+        self.create_tables()
+
+    def create_tables(self):
+        cursor = self.db_connection.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS IndicatorValue (Ticker TEXT, Indicator TEXT, AsOfDate TEXT, "
+                       "Value REAL, PRIMARY KEY (Ticker, Indicator, AsOfDate))")
+        cursor.execute("CREATE TABLE IF NOT EXISTS IndicatorCheckpoint (Ticker TEXT, AsOfDate TEXT, State TEXT, "
+                       "PRIMARY KEY (Ticker, AsOfDate))")
+        cursor.execute("CREATE TABLE IF NOT EXISTS IndicatorInput (Ticker TEXT, AsOfDate TEXT, Close REAL, "
+                       "Volume REAL, PRIMARY KEY (Ticker, AsOfDate))")
+        self.db_connection.commit()
+        cursor.close()
+
+    def _new_indicators(self):
+        return({'SMA': IncrementalSimpleMovingAverages(self.sma_periods),
+                'EMA': IncrementalExponentialMovingAverages(self.ema_periods),
+                'RSI': IncrementalRSI(self.rsi_period),
+                'VWAP': IncrementalVWAP()})
+
+    def _load_indicators(self, state):
+        return({'SMA': IncrementalSimpleMovingAverages.from_state(state['SMA']),
+                'EMA': IncrementalExponentialMovingAverages.from_state(state['EMA']),
+                'RSI': IncrementalRSI.from_state(state['RSI']),
+                'VWAP': IncrementalVWAP.from_state(state['VWAP'])})
+
+    def _read_prices(self, ticker, after_date = None):
+        # the bars of ticker, all of them or only those after after_date
+        version = schema.get_schema_version(self.db_connection)
+        sql = "select AsOfDate, Close, Volume from EquityDailyPrice where Ticker = ?"
+        params = [ticker]
+        if after_date is not None:
+            sql += " and AsOfDate >= ?"
+            params.append(schema.date_bounds(version, None, after_date)[1])
+        df = pd.read_sql(sql + " order by AsOfDate asc", self.db_connection, params=params)
+        # the store keys its own tables on 'YYYY-MM-DD' text whatever the price schema version
+        df['AsOfDate'] = schema.from_sql_dates(version, df['AsOfDate']).astype(str)
+        return(df)
+
+    def _fingerprint(self, ticker, last_date):
+        # count and sums of the bars up to last_date, aggregated on the index without reading them out
+        version = schema.get_schema_version(self.db_connection)
+        row = self.db_connection.execute("select count(*), total(Close), total(Volume) from EquityDailyPrice "
+                                         "where Ticker = ? and AsOfDate < ?",
+                                         (ticker, schema.date_bounds(version, None, last_date)[1])).fetchone()
+        return(list(row))
+
+    def _find_rewrite(self, ticker, prices):
+        '''
+        return the first date from which the stored inputs no longer match the price history,
+        or None when the stored inputs are a prefix of it
+        '''
+        stored = pd.read_sql("select AsOfDate, Close, Volume from IndicatorInput where Ticker = ? order by AsOfDate",
+                             self.db_connection, params=[ticker])
+        if stored.shape[0] == 0:
+            return(None)
+
+        last_stored = stored['AsOfDate'].iloc[-1]
+        current = prices[prices['AsOfDate'] <= last_stored]
+        merged = stored.merge(current, on='AsOfDate', how='outer', suffixes=('_stored', '_current'), indicator=True)
+
+        def differ(a, b):
+            # NaN (a NULL in the database) on both sides is no change
+            a, b = a.astype(float), b.astype(float)
+            return(~((a == b) | (a.isna() & b.isna())))
+
+        changed = (merged['_merge'] != 'both') | \
+                  differ(merged['Close_stored'], merged['Close_current']) | \
+                  differ(merged['Volume_stored'], merged['Volume_current'])
+        if not changed.any():
+            return(None)
+        return(merged.loc[changed, 'AsOfDate'].min())
+
+    def update(self, ticker):
+        '''
+        bring the stored indicators of ticker up to date, return the number of bars computed
+        '''
+        cursor = self.db_connection.cursor()
+        latest = "select AsOfDate, State from IndicatorCheckpoint where Ticker = ? order by AsOfDate desc limit 1"
+
+        checkpoint = cursor.execute(latest, (ticker,)).fetchone()
+        if checkpoint is not None and json.loads(checkpoint[1]).get('Inputs') != self._fingerprint(ticker, checkpoint[0]):
+            rewrite_date = self._find_rewrite(ticker, self._read_prices(ticker))
+            if rewrite_date is not None:
+                print(f"Price history of {ticker} changed from {rewrite_date}, recomputing from there")
+                for table in ['IndicatorValue', 'IndicatorCheckpoint', 'IndicatorInput']:
+                    cursor.execute(f"DELETE FROM {table} WHERE Ticker = ? AND AsOfDate >= ?", (ticker, rewrite_date))
+                checkpoint = cursor.execute(latest, (ticker,)).fetchone()
+
+        if checkpoint is None:
+            indicators = self._new_indicators()
+            new_bars = self._read_prices(ticker)
+        else:
+            indicators = self._load_indicators(json.loads(checkpoint[1]))
+            new_bars = self._read_prices(ticker, after_date=checkpoint[0])
+
+        if new_bars.shape[0] == 0:
+            self.db_connection.commit()
+            cursor.close()
+            return(0)
+
+        values = []
+        for date, close, volume in zip(new_bars['AsOfDate'], new_bars['Close'].tolist(), new_bars['Volume'].tolist()):
+            bar = {'Close': close, 'Volume': volume}
+            for p, v in indicators['SMA'].update(bar).items():
+                values.append((ticker, f"SMA_{p}", date, v))
+            for p, v in indicators['EMA'].update(bar).items():
+                values.append((ticker, f"EMA_{p}", date, v))
+            values.append((ticker, f"RSI_{self.rsi_period}", date, indicators['RSI'].update(bar)))
+            values.append((ticker, "VWAP", date, indicators['VWAP'].update(bar)))
+
+        # NaN is stored as NULL
+        values = [(t, i, d, None if np.isnan(v) else v) for t, i, d, v in values]
+        cursor.executemany("INSERT OR REPLACE INTO IndicatorValue (Ticker, Indicator, AsOfDate, Value) "
+                           "VALUES (?, ?, ?, ?)", values)
+        cursor.executemany("INSERT OR REPLACE INTO IndicatorInput (Ticker, AsOfDate, Close, Volume) VALUES (?, ?, ?, ?)",
+                           zip([ticker] * new_bars.shape[0], new_bars['AsOfDate'], new_bars['Close'].tolist(),
+                               new_bars['Volume'].astype(float).tolist()))
+        state = {name: indicator.get_state() for name, indicator in indicators.items()}
+        state['Inputs'] = self._fingerprint(ticker, new_bars['AsOfDate'].iloc[-1])
+        cursor.execute("INSERT OR REPLACE INTO IndicatorCheckpoint (Ticker, AsOfDate, State) VALUES (?, ?, ?)",
+                       (ticker, new_bars['AsOfDate'].iloc[-1], json.dumps(state)))
+        self.db_connection.commit()
+        cursor.close()
+        return(new_bars.shape[0])
+
+    def update_all(self, list_of_tickers):
+        total = 0
+        for ticker in list_of_tickers:
+            total += self.update(ticker)
+        return(total)
+
+    def get_series(self, ticker, indicator, start_date = None, end_date = None):
+        '''
+        return the stored values of indicator (e.g. 'SMA_20', 'RSI_14', 'VWAP') as a Series indexed by date
+        '''
+        sql = "select AsOfDate, Value from IndicatorValue where Ticker = ? and Indicator = ?"
+        params = [ticker, indicator]
+        if start_date is not None:
+            sql += " and AsOfDate >= ?"
+            params.append(str(start_date))
+        if end_date is not None:
+            sql += " and AsOfDate <= ?"
+            params.append(str(end_date))
+        df = pd.read_sql(sql + " order by AsOfDate", self.db_connection, params=params)
+        index = pd.Index(pd.to_datetime(df['AsOfDate'], format="%Y-%m-%d").dt.date, name='Date')
+        return(pd.Series(df['Value'].to_numpy(dtype=np.float64), index=index, name=indicator))
+
+
+def _test():
+    # an incremental append and a rewritten bar must both match a full recompute
+    df = _make_test_ohlcv(1000)
+    rows = [('Test', int(d), r.Open, r.High, r.Low, r.Close, r.Volume, 0, 0)
+            for d, r in zip(schema.to_sql_dates(2, df.index), df.itertuples())]
+
+    db_connection = sqlite3.connect(":memory:")
+    schema.create_daily_price_table(db_connection)
+    insert = "INSERT OR REPLACE INTO EquityDailyPrice VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    store = IndicatorStore(db_connection)
+
+    def check(label, ticker = 'Test'):
+        # every stored SMA, EMA and RSI, NaNs included, against the batch classes on the current prices
+        prices = store._read_prices(ticker)
+        frame = df.iloc[:prices.shape[0]].copy()
+        frame['Close'] = prices['Close'].to_numpy()
+        sma = SimpleMovingAverages(frame, store.sma_periods)
+        sma.run()
+        ema = ExponentialMovingAverages(frame, store.ema_periods)
+        ema.run()
+        rsi = RSI(frame, store.rsi_period)
+        rsi.run()
+        expected = {f"SMA_{p}": sma.get_series(p) for p in store.sma_periods}
+        expected.update({f"EMA_{p}": ema.get_series(p) for p in store.ema_periods})
+        expected[f"RSI_{store.rsi_period}"] = rsi.get_series()
+        errors = []
+        for indicator, series in expected.items():
+            stored = store.get_series(ticker, indicator).to_numpy()
+            assert np.array_equal(np.isnan(stored), series.isna().to_numpy()), f"{label}: {indicator} NaNs differ"
+            errors.append(np.nanmax(np.abs(stored - series.to_numpy())))
+        assert max(errors) < 1e-9, f"{label}: max abs error {max(errors)}"
+        print(f"{label}: max abs error vs full recompute {max(errors):.3g}")
+
+    db_connection.executemany(insert, rows[:900])
+    start = time.perf_counter()
+    print(f"Initial load: {store.update('Test')} bars in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    db_connection.executemany(insert, rows[900:])
+    start = time.perf_counter()
+    print(f"Append: {store.update('Test')} bars in {(time.perf_counter() - start) * 1000:.1f} ms")
+    check("After append")
+
+    assert store.update('Test') == 0
+
+    db_connection.execute("UPDATE EquityDailyPrice SET Close = Close * 1.05 WHERE AsOfDate = ?", (rows[950][1],))
+    print(f"Rewrite: {store.update('Test')} bars recomputed")
+    check("After rewrite")
+
+    # a bar without a Close (NULL, read back as NaN) is skipped like the batch classes do, also when it
+    # is the last bar before a checkpoint, and is not a rewrite on every later update
+    gap_rows = [('Gap',) + r[1:5] + (None if i == 500 else r[5],) + r[6:] for i, r in enumerate(rows)]
+    db_connection.executemany(insert, gap_rows[:501])
+    store.update('Gap')
+    db_connection.executemany(insert, gap_rows[501:])
+    store.update('Gap')
+    check("With a NaN bar", 'Gap')
+    assert store._find_rewrite('Gap', store._read_prices('Gap')) is None and store.update('Gap') == 0
+    print("A NaN bar does not trigger a rewrite")
+
+def run():
+    parser = option.get_default_parser()
+    parser.add_argument('--data_dir', dest = 'data_dir', default='./data', help='data dir')
+
+    args = parser.parse_args()
+    opt = option.Option(args = args)
+    opt.sqlite_db = os.path.join(opt.data_dir, "sqlitedb/Equity.db")
+
+    if opt.tickers is not None:
+        list_of_tickers = opt.tickers.split(',')
+    else:
+        fname = os.path.join(opt.data_dir, "S&P500.txt")
+        list_of_tickers = list(pd.read_csv(fname, header=None).iloc[:, 0])
+
+    # the store reads prices and writes indicators, so it runs on the writer under the write lock
+    start = time.perf_counter()
+    with db.get_manager(opt.sqlite_db).writer() as db_connection:
+        store = IndicatorStore(db_connection)
+        num_bars = store.update_all(list_of_tickers)
+    print(f"Computed {num_bars} new bars for {len(list_of_tickers)} tickers in {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,171 @@
+import time
+import datetime
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from stock import Stock
+from financial_option import *
+from blackscholes_model import BlackScholesModel
+
+# price is the Monte Carlo estimate, std_error its standard error, num_paths the number of
+# simulated paths and paths_per_second the wall clock throughput of the run
+MonteCarloResult = collections.namedtuple('MonteCarloResult', ['price', 'std_error', 'num_paths', 'paths_per_second'])
+
+def european_payoff(paths, strike, is_call):
+    '''
+    payoff of a European option on the last column of the simulated paths
+    '''
+    if is_call:
+        return(np.maximum(paths[:, -1] - strike, 0))
+    else:
+        return(np.maximum(strike - paths[:, -1], 0))
+
+def asian_payoff(paths, strike, is_call):
+    '''
+    payoff of an arithmetic average price Asian option over the simulated time steps
+    '''
+    average = paths.mean(axis=1)
+    if is_call:
+        return(np.maximum(average - strike, 0))
+    else:
+        return(np.maximum(strike - average, 0))
+
+def _simulate_chunk(seed_seq, num_paths, S_0, K, T, r, q, sigma, is_call, num_steps, antithetic, payoff):
+    '''
+    simulate one chunk of GBM paths and return the running sums needed for the estimator:
+    (n, sum_y, sum_y2, sum_x, sum_x2, sum_xy) where y is the discounted payoff and x the
+    discounted European payoff used as control variate. With antithetic variates each sample
+    is the average of a path and its mirror, so n counts pairs.
+    Kept at module level so it can be sent to a process pool.
+    '''
+    rng = np.random.default_rng(seed_seq)
+    num_samples = num_paths // 2 if antithetic else num_paths
+
+    dt = T / num_steps
+    drift = (r - q - 0.5 * sigma * sigma) * dt
+    vol = sigma * np.sqrt(dt)
+    disc = np.exp(-r * T)
+
+    z = rng.standard_normal((num_samples, num_steps))
+    draws = (z, -z) if antithetic else (z,)
+
+    y = np.zeros(num_samples)
+    x = np.zeros(num_samples)
+    for w in draws:
+        paths = S_0 * np.exp(np.cumsum(drift + vol * w, axis=1))
+        y += disc * payoff(paths, K, is_call)
+        x += disc * european_payoff(paths, K, is_call)
+    y /= len(draws)
+    x /= len(draws)
+
+    return(np.array([num_samples, y.sum(), (y * y).sum(), x.sum(), (x * x).sum(), (x * y).sum()]))
+
+
+class MonteCarloModel(object):
+    '''
+    Monte Carlo pricer for options on a GBM underlying.
+
+    Paths are generated in chunks of chunk_size so memory stays bounded however many paths are
+    requested, and chunks are spread across a process pool when num_workers > 1. Every chunk has
+    its own child seed spawned from seed, so a run is reproducible for any number of workers.
+    Supports antithetic variates and the Black-Scholes European price as a control variate. The
+    control variate is only applied to other payoffs: on the European payoff itself it would return
+    the closed form with no simulation error, so European prices are always plain estimates.
+    '''
+
+    def __init__(self, pricing_date, risk_free_rate, num_paths = 1000000, chunk_size = 100000, num_steps = 1,
+                 antithetic = True, control_variate = True, num_workers = 1, seed = 12345):
+        self.pricing_date = pricing_date
+        self.risk_free_rate = risk_free_rate
+        self.num_paths = num_paths
+        self.chunk_size = chunk_size
+        self.num_steps = num_steps
+        self.antithetic = antithetic
+        self.control_variate = control_variate
+        self.num_workers = num_workers
+        self.seed = seed
+
+    def calc_model_price(self, option, payoff = european_payoff):
+        '''
+        Estimate the price of the option, returned as a MonteCarloResult.
+        payoff(paths, strike, is_call) maps a (paths x num_steps) array of simulated prices to payoffs;
+        it must be a module level function when num_workers > 1.
+        '''
+        if option.option_style == FinancialOption.Style.AMERICAN:
+            raise Exception("Monte Carlo price for American option not implemented yet")
+
+        S_0 = option.underlying.spot_price
+        K = option.strike
+        T = option.time_to_expiry
+        r = self.risk_free_rate
+        q = option.underlying.dividend_yield
+        sigma = option.underlying.sigma
+        is_call = option.option_type == FinancialOption.Type.CALL
+
+        # split the paths into chunks, keeping chunk sizes even so antithetic pairs are never split
+        chunk_size = self.chunk_size + (self.chunk_size % 2 if self.antithetic else 0)
+        chunks = [chunk_size] * (self.num_paths // chunk_size)
+        if self.num_paths % chunk_size:
+            chunks.append(self.num_paths % chunk_size)
+        seeds = np.random.SeedSequence(self.seed).spawn(len(chunks))
+        args = [(seeds[i], chunks[i], S_0, K, T, r, q, sigma, is_call, self.num_steps, self.antithetic, payoff)
+                for i in range(len(chunks))]
+
+        start = time.perf_counter()
+        if self.num_workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                sums = sum(executor.map(_simulate_chunk, *zip(*args)))
+        else:
+            sums = sum(_simulate_chunk(*a) for a in args)
+        elapsed = time.perf_counter() - start
+
+        n, sum_y, sum_y2, sum_x, sum_x2, sum_xy = sums
+        mean_y = sum_y / n
+        var_y = (sum_y2 - n * mean_y * mean_y) / (n - 1)
+
+        # the European payoff is its own control, which would just reproduce the closed form
+        if self.control_variate and payoff is not european_payoff:
+            bs_model = BlackScholesModel(self.pricing_date, self.risk_free_rate)
+            expected_x = float(bs_model.calc_model_price_batch(S_0, K, T, sigma, is_call, q, r))
+            mean_x = sum_x / n
+            var_x = (sum_x2 - n * mean_x * mean_x) / (n - 1)
+            cov_xy = (sum_xy - n * mean_x * mean_y) / (n - 1)
+            beta = cov_xy / var_x if var_x > 0 else 0.0
+            price = mean_y - beta * (mean_x - expected_x)
+            var = max(var_y - beta * cov_xy, 0.0)
+        else:
+            price = mean_y
+            var = var_y
+
+        num_paths = int(2 * n) if self.antithetic else int(n)
+        return(MonteCarloResult(float(price), float(np.sqrt(var / n)), num_paths, num_paths / elapsed))
+
+
+def _test():
+    pricing_date = datetime.datetime.now()
+    risk_free_rate = 0.1
+    stock = Stock(opt=None, db_connection=None, ticker='Test', spot_price=42, sigma=0.2)
+    call_option = EuropeanCallOption(stock, time_to_expiry=0.5, strike=40)
+
+    bs_price = BlackScholesModel(pricing_date, risk_free_rate).calc_model_price(call_option)
+    print("Black-Scholes Call Price:", bs_price)
+
+    # plain and antithetic estimates of the European call for validation against the closed form;
+    # the default settings must not hide the simulation error behind the control variate
+    for antithetic in [False, True]:
+        model = MonteCarloModel(pricing_date, risk_free_rate, num_paths=2000000, antithetic=antithetic)
+        result = model.calc_model_price(call_option)
+        print(f"Monte Carlo Call (antithetic={antithetic}):", result)
+        assert result.std_error > 1e-4 and abs(result.price - bs_price) < 4 * result.std_error
+
+    # an Asian call with 50 monitoring dates, using the European call as control variate on 4 workers
+    for control_variate in [False, True]:
+        model = MonteCarloModel(pricing_date, risk_free_rate, num_paths=1000000, chunk_size=50000, num_steps=50,
+                                control_variate=control_variate, num_workers=4)
+        print(f"Monte Carlo Asian Call (control_variate={control_variate}):",
+              model.calc_model_price(call_option, payoff=asian_payoff))
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import sqlite3
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import db
+import option
+import schema
+from schema import to_day_number, from_day_number
+
+
+class OHLCVStore(object):
+    '''
+    Columnar binary copy of EquityDailyPrice, memory-mapped from one .npy file per column.
+
+    The rows are sorted by (ticker, date), so every ticker is one contiguous range of rows; index.json
+    maps each ticker to its [start, stop) offsets. Dates are int32 day numbers since 1970-01-01,
+    prices float64 (or float32 with price_dtype='float32'), Volume int64. Slices by ticker and date
+    range are views of the mapped files: nothing is read from disk until the values are used.
+    '''
+    PRICE_COLUMNS = ('Open', 'High', 'Low', 'Close', 'TurnOver', 'Dividend')
+    COLUMNS = ('Day', 'Open', 'High', 'Low', 'Close', 'Volume', 'TurnOver', 'Dividend')
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, OHLCVStore.INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.offsets = {ticker: tuple(bounds) for ticker, bounds in self.index['tickers'].items()}
+        self.columns = {c: np.load(os.path.join(store_dir, f"{c}.npy"), mmap_mode='r') for c in OHLCVStore.COLUMNS}
+
+    @property
+    def tickers(self):
+        return(list(self.offsets.keys()))
+
+    def __contains__(self, ticker):
+        return(ticker in self.offsets)
+
+    @classmethod
+    def build(cls, db_connection, store_dir, tickers = None, price_dtype = 'float64', chunk_size = 500000):
+        '''
+        write the store for tickers (all tickers by default) from EquityDailyPrice, streaming the rows
+        in chunks of chunk_size into preallocated memory-mapped columns, and return it opened
+        '''
+        os.makedirs(store_dir, exist_ok=True)
+        index_file = os.path.join(store_dir, cls.INDEX_FILE)
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
+        where, params = "", []
+        if tickers is not None:
+            tickers = list(tickers)
+            where = f" where Ticker in ({','.join(['?'] * len(tickers))})"
+            params = tickers
+        num_rows = db_connection.execute(f"select count(*) from EquityDailyPrice{where}", params).fetchone()[0]
+        version = schema.get_schema_version(db_connection)
+
+        dtypes = {'Day': np.int32, 'Volume': np.int64}
+        dtypes.update({c: np.dtype(price_dtype) for c in cls.PRICE_COLUMNS})
+        columns = {c: np.lib.format.open_memmap(os.path.join(store_dir, f"{c}.npy"), mode='w+',
+                                                dtype=dtypes[c], shape=(num_rows,))
+                   for c in cls.COLUMNS}
+
+        cursor = db_connection.execute("select Ticker, AsOfDate, Open, High, Low, Close, Volume, TurnOver, Dividend "
+                                       f"from EquityDailyPrice{where} order by Ticker, AsOfDate", params)
+        offsets = {}
+        position = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            df = pd.DataFrame(rows, columns=['Ticker', 'AsOfDate'] + list(cls.COLUMNS[1:]))
+            stop = position + df.shape[0]
+
+            columns['Day'][position:stop] = schema.to_sql_dates(2, df['AsOfDate']) if version < 2 else df['AsOfDate']
+            columns['Volume'][position:stop] = pd.to_numeric(df['Volume']).fillna(0).to_numpy(dtype=np.int64)
+            for c in cls.PRICE_COLUMNS:
+                columns[c][position:stop] = pd.to_numeric(df[c]).to_numpy(dtype=np.float64)
+
+            # a ticker can continue from the previous chunk
+            codes, chunk_tickers = pd.factorize(df['Ticker'])
+            first_rows = np.flatnonzero(np.diff(codes, prepend=-1))
+            for ticker, first, last in zip(chunk_tickers, first_rows, np.append(first_rows[1:], len(codes))):
+                start = offsets[ticker][0] if ticker in offsets else position + int(first)
+                offsets[ticker] = [start, position + int(last)]
+            position = stop
+
+        for c in columns.values():
+            c.flush()
+        columns = None
+
+        with open(index_file, 'w') as f:
+            json.dump({'tickers': offsets, 'num_rows': num_rows, 'price_dtype': str(np.dtype(price_dtype)),
+                       'built': datetime.datetime.now().isoformat()}, f)
+        return(cls(store_dir))
+
+    def _row_range(self, ticker, start_date = None, end_date = None):
+        if ticker not in self.offsets:
+            raise Exception(f"Ticker {ticker} is not in the OHLCV store {self.store_dir}")
+        start, stop = self.offsets[ticker]
+        days = self.columns['Day'][start:stop]
+        first = 0 if start_date is None else int(np.searchsorted(days, to_day_number(start_date), side='left'))
+        last = len(days) if end_date is None else int(np.searchsorted(days, to_day_number(end_date), side='right'))
+        return(start + first, start + last)
+
+    def get_arrays(self, ticker, start_date = None, end_date = None):
+        '''
+        return a dict of column -> zero-copy view of the ticker's rows between start_date and end_date
+        (both inclusive); 'Day' holds the day numbers
+        '''
+        start, stop = self._row_range(ticker, start_date, end_date)
+        return({c: values[start:stop] for c, values in self.columns.items()})
+
+    def get_daily_hist_price(self, ticker, start_date, end_date):
+        '''
+        the ticker's OHLCV rows as the DataFrame Stock.get_daily_hist_price returns
+        '''
+        arrays = self.get_arrays(ticker, start_date, end_date)
+        dates = from_day_number(arrays['Day'])
+        df = pd.DataFrame({'Ticker': ticker, 'AsOfDate': dates}, index=pd.Index(dates, name='Date'))
+        for c in OHLCVStore.COLUMNS[1:]:
+            df[c] = arrays[c]
+        return(df)
+
+
+def _test():
+    import tempfile
+    import tracemalloc
+    from stock import Stock
+    from TA import PricePanel, _make_test_ohlcv
+
+    db_connection = sqlite3.connect(":memory:")
+    schema.create_daily_price_table(db_connection)
+    for i in range(50):
+        df = _make_test_ohlcv(3000, seed=i).iloc[(i % 5) * 100:]
+        db_connection.executemany("INSERT INTO EquityDailyPrice VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  [(f"T{i}", int(d), r.Open, r.High, r.Low, r.Close, r.Volume, 0.0, 0.0)
+                                   for d, r in zip(schema.to_sql_dates(2, df.index), df.itertuples())])
+
+    store_dir = tempfile.mkdtemp()
+    start = time.perf_counter()
+    store = OHLCVStore.build(db_connection, store_dir, chunk_size=20000)
+    print(f"Built store of {len(store.tickers)} tickers, {store.index['num_rows']} rows in "
+          f"{time.perf_counter() - start:.2f} s")
+
+    start_date, end_date = datetime.date(2021, 1, 1), datetime.date(2027, 6, 30)
+    from_db = Stock(opt=None, db_connection=db_connection, ticker='T7')
+    from_store = Stock(opt=None, db_connection=None, ticker='T7', price_store=store)
+    df_db = from_db.get_daily_hist_price(start_date, end_date)
+    df_store = from_store.get_daily_hist_price(start_date, end_date)
+    assert df_db.shape[0] > 0
+    pd.testing.assert_frame_equal(df_db, df_store, check_dtype=False)
+    print("Stock with the store returns the same frame as from the database")
+
+    for label, load in [('database', lambda: PricePanel.from_db(db_connection, store.tickers, start_date, end_date)),
+                        ('store', lambda: PricePanel.from_store(store, store.tickers, start_date, end_date))]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        panel = load()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"Panel from {label}: {elapsed * 1000:.1f} ms, peak memory {peak / 2 ** 20:.1f} MiB")
+        if label == 'database':
+            reference = panel
+    assert all(np.array_equal(reference.fields[f], panel.fields[f], equal_nan=True) for f in PricePanel.FIELDS)
+    assert list(reference.dates) == list(panel.dates)
+    print("Panels from the database and the store are equal")
+
+def run():
+    parser = option.get_default_parser()
+    parser.add_argument('--data_dir', dest = 'data_dir', default='./data', help='data dir')
+    parser.add_argument('--price_dtype', dest = 'price_dtype', default='float64', help='float64 or float32')
+
+    args = parser.parse_args()
+    opt = option.Option(args = args)
+    opt.sqlite_db = os.path.join(opt.data_dir, "sqlitedb/Equity.db")
+    opt.store_dir = os.path.join(opt.data_dir, "ohlcv_store")
+
+    db_connection = db.get_manager(opt.sqlite_db).get_reader()
+    tickers = opt.tickers.split(',') if opt.tickers is not None else None
+
+    start = time.perf_counter()
+    store = OHLCVStore.build(db_connection, opt.store_dir, tickers, price_dtype=opt.price_dtype)
+    print(f"Built {opt.store_dir} with {len(store.tickers)} tickers and {store.index['num_rows']} rows "
+          f"in {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    run()
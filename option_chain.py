@@ -0,0 +1,186 @@
+import numpy as np
+
+from financial_option import *
+
+class OptionChain(object):
+    '''
+    Structure-of-arrays container for many option contracts.
+
+    Every contract is one row of the contiguous arrays strike, time_to_expiry, type_code,
+    style_code and underlying_index, where underlying_index points into the underlyings list
+    of Stock objects. Rows are kept sorted by (time_to_expiry, underlying_index, strike), so
+    slicing by expiry, or by moneyness within one expiry of one underlying, returns a chain
+    whose arrays are views on this one (no copy).
+
+    order is the sorting permutation: row i holds input contract order[i] (None when the input was
+    already in row order, as for slices). to_input_order maps per-row results back to the order the
+    contracts were given in, and to_row_order maps per-contract inputs (e.g. quantities) onto the rows;
+    BlackScholesModel and to_options return their results in input order.
+    '''
+
+    CALL = 1
+    PUT = 0
+    EUROPEAN = 0
+    AMERICAN = 1
+
+    def __init__(self, underlyings, strike, time_to_expiry, type_code, style_code = None, underlying_index = None,
+                 presorted = False):
+        self.underlyings = list(underlyings)
+        self.strike = np.asarray(strike, dtype=np.float64)
+        self.time_to_expiry = np.asarray(time_to_expiry, dtype=np.float64)
+        self.type_code = np.asarray(type_code, dtype=np.int8)
+        n = self.strike.shape[0]
+        self.style_code = np.zeros(n, dtype=np.int8) if style_code is None else np.asarray(style_code, dtype=np.int8)
+        self.underlying_index = np.zeros(n, dtype=np.int32) if underlying_index is None else \
+                                np.asarray(underlying_index, dtype=np.int32)
+
+        self.order = None
+        if not presorted:
+            order = np.lexsort((self.strike, self.underlying_index, self.time_to_expiry))
+            if np.any(order != np.arange(n)):
+                self.order = order
+            self.strike = self.strike[order]
+            self.time_to_expiry = self.time_to_expiry[order]
+            self.type_code = self.type_code[order]
+            self.style_code = self.style_code[order]
+            self.underlying_index = self.underlying_index[order]
+
+    @classmethod
+    def from_options(cls, options):
+        '''
+        build a chain from a list of FinancialOption objects, sharing Stock objects between rows
+        '''
+        underlyings = []
+        positions = {}
+        underlying_index = []
+        for o in options:
+            key = id(o.underlying)
+            if key not in positions:
+                positions[key] = len(underlyings)
+                underlyings.append(o.underlying)
+            underlying_index.append(positions[key])
+
+        return(cls(underlyings,
+                   [o.strike for o in options],
+                   [o.time_to_expiry for o in options],
+                   [cls.CALL if o.option_type == FinancialOption.Type.CALL else cls.PUT for o in options],
+                   [cls.AMERICAN if o.option_style == FinancialOption.Style.AMERICAN else cls.EUROPEAN for o in options],
+                   underlying_index))
+
+    def to_options(self):
+        '''
+        return the chain as a list of FinancialOption objects in input order
+        '''
+        classes = {(self.CALL, self.EUROPEAN): EuropeanCallOption, (self.PUT, self.EUROPEAN): EuropeanPutOption,
+                   (self.CALL, self.AMERICAN): AmericanCallOption, (self.PUT, self.AMERICAN): AmericanPutOption}
+        columns = [self.to_input_order(x) for x in (self.type_code, self.style_code, self.underlying_index,
+                                                    self.time_to_expiry, self.strike)]
+        return([classes[(int(t), int(s))](self.underlyings[u], float(T), float(K)) for t, s, u, T, K in zip(*columns)])
+
+    def to_input_order(self, values):
+        '''
+        reorder an array with one value per row (along the first axis) to the input order of the contracts
+        '''
+        if self.order is None:
+            return(values)
+        values = np.asarray(values)
+        result = np.empty_like(values)
+        result[self.order] = values
+        return(result)
+
+    def to_row_order(self, values):
+        '''
+        reorder an array with one value per input contract (along the first axis) to the row order
+        '''
+        if self.order is None:
+            return(values)
+        return(np.asarray(values)[self.order])
+
+    def __len__(self):
+        return(self.strike.shape[0])
+
+    def __getitem__(self, rows):
+        '''
+        a slice returns a chain of views, any other index (mask, index array) returns a copy
+        '''
+        return(OptionChain(self.underlyings, self.strike[rows], self.time_to_expiry[rows], self.type_code[rows],
+                           self.style_code[rows], self.underlying_index[rows], presorted=True))
+
+    @property
+    def is_call(self):
+        return(self.type_code == self.CALL)
+
+    @property
+    def is_american(self):
+        return(self.style_code == self.AMERICAN)
+
+    def get_market_data(self):
+        '''
+        return per-row arrays (S_0, q, sigma) gathered from the underlyings
+        '''
+        spot = np.array([u.spot_price for u in self.underlyings], dtype=np.float64)
+        dividend_yield = np.array([u.dividend_yield for u in self.underlyings], dtype=np.float64)
+        sigma = np.array([u.sigma for u in self.underlyings], dtype=np.float64)
+        return(spot[self.underlying_index], dividend_yield[self.underlying_index], sigma[self.underlying_index])
+
+    def get_moneyness(self):
+        '''
+        return K / S_0 per row
+        '''
+        spot = np.array([u.spot_price for u in self.underlyings], dtype=np.float64)
+        return(self.strike / spot[self.underlying_index])
+
+    def slice_by_expiry(self, min_expiry, max_expiry):
+        '''
+        return the contracts with min_expiry <= time_to_expiry <= max_expiry as a view
+        '''
+        start = np.searchsorted(self.time_to_expiry, min_expiry, side='left')
+        stop = np.searchsorted(self.time_to_expiry, max_expiry, side='right')
+        return(self[start:stop])
+
+    def slice_by_moneyness(self, min_moneyness, max_moneyness):
+        '''
+        return the contracts with min_moneyness <= K / S_0 <= max_moneyness
+        a view when the chain holds a single expiry of a single underlying (strikes are then sorted),
+        otherwise a copy
+        '''
+        n = len(self)
+        if n > 0 and self.time_to_expiry[0] == self.time_to_expiry[-1] and \
+           self.underlying_index[0] == self.underlying_index[-1]:
+            spot = self.underlyings[self.underlying_index[0]].spot_price
+            start = np.searchsorted(self.strike, min_moneyness * spot, side='left')
+            stop = np.searchsorted(self.strike, max_moneyness * spot, side='right')
+            return(self[start:stop])
+
+        moneyness = self.get_moneyness()
+        return(self[(moneyness >= min_moneyness) & (moneyness <= max_moneyness)])
+
+
+def _test():
+    from stock import Stock
+
+    stock = Stock(opt=None, db_connection=None, ticker='Test', spot_price=100, sigma=0.2)
+    options = [EuropeanCallOption(stock, time_to_expiry=T, strike=K)
+               for T in [0.25, 0.5, 1.0] for K in [80, 90, 100, 110, 120]]
+
+    chain = OptionChain.from_options(options)
+    print(f"Chain of {len(chain)} contracts on {len(chain.underlyings)} underlying(s)")
+
+    six_months = chain.slice_by_expiry(0.5, 0.5)
+    print("6M strikes:", six_months.strike, "shares memory:", np.shares_memory(six_months.strike, chain.strike))
+
+    near_the_money = six_months.slice_by_moneyness(0.9, 1.1)
+    print("6M near the money strikes:", near_the_money.strike)
+
+    print("Round trip:", [(o.strike, o.time_to_expiry) for o in near_the_money.to_options()])
+
+    # to_options returns the contracts in the order they were given in
+    shuffled = [options[i] for i in np.random.default_rng(0).permutation(len(options))]
+    shuffled_chain = OptionChain.from_options(shuffled)
+    assert shuffled_chain.order is not None
+    assert [(o.strike, o.time_to_expiry) for o in shuffled_chain.to_options()] == \
+           [(o.strike, o.time_to_expiry) for o in shuffled]
+    print("Round trip of an unsorted list keeps its order")
+
+if __name__ == "__main__":
+    _test()
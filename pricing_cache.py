@@ -0,0 +1,142 @@
+import time
+import datetime
+import collections
+
+import numpy as np
+
+from blackscholes_model import Greeks
+
+class PricingCache(object):
+    '''
+    Bounded LRU cache of option prices and greeks keyed on (type, style, S, K, T, r, q, sigma).
+
+    Every numeric input is quantized to a multiple of its tolerance before it goes into the key,
+    so requests that differ by less than the tolerance (spots moving in the fourth decimal for
+    instance) share one entry; the cached Greeks are those of the first request that created it.
+    Values are full Greeks records, so price and greek requests share entries.
+    The scalar path pays off for the closed form; for large chains the hashing in the bulk path
+    costs about as much as the vectorized closed form itself, so it is mostly useful in front of
+    slower models.
+    '''
+
+    DEFAULT_TOLERANCES = {'S': 1e-3, 'K': 1e-4, 'T': 1e-6, 'r': 1e-6, 'q': 1e-6, 'sigma': 1e-5}
+
+    def __init__(self, max_size = 100000, tolerances = None):
+        self.max_size = max_size
+        self.tolerances = dict(PricingCache.DEFAULT_TOLERANCES)
+        if tolerances is not None:
+            self.tolerances.update(tolerances)
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def get_stats(self):
+        return({'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions})
+
+    def make_key(self, is_call, is_american, S_0, K, T, r, q, sigma):
+        tol = self.tolerances
+        return((bool(is_call), bool(is_american),
+                round(S_0 / tol['S']), round(K / tol['K']), round(T / tol['T']),
+                round(r / tol['r']), round(q / tol['q']), round(sigma / tol['sigma'])))
+
+    def get(self, key):
+        '''
+        return the cached Greeks for key or None, counting the hit or miss
+        '''
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return(None)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return(value)
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_greeks_batch(self, S_0, K, T, sigma, is_call, q, r, calc_greeks_batch, is_american = False):
+        '''
+        Bulk lookup: return a Greeks record of arrays for every row, calling
+        calc_greeks_batch(S_0, K, T, sigma, is_call, q, r) on the cache misses only
+        '''
+        S_0, K, T, sigma, is_call, q, r, is_american = [x.ravel() for x in np.broadcast_arrays(
+            np.asarray(S_0, dtype=np.float64), np.asarray(K, dtype=np.float64),
+            np.asarray(T, dtype=np.float64), np.asarray(sigma, dtype=np.float64),
+            np.asarray(is_call, dtype=bool), np.asarray(q, dtype=np.float64),
+            np.asarray(r, dtype=np.float64), np.asarray(is_american, dtype=bool))]
+
+        tol = self.tolerances
+        quantized = [np.round(x / tol[name]).astype(np.int64).tolist()
+                     for x, name in ((S_0, 'S'), (K, 'K'), (T, 'T'), (r, 'r'), (q, 'q'), (sigma, 'sigma'))]
+        keys = list(zip(is_call.tolist(), is_american.tolist(), *quantized))
+
+        result = np.empty((S_0.shape[0], len(Greeks._fields)))
+        missing = []
+        entries = self._entries
+        for i, key in enumerate(keys):
+            value = entries.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                entries.move_to_end(key)
+                result[i] = value
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            rows = np.array(missing)
+            computed = np.column_stack(calc_greeks_batch(S_0[rows], K[rows], T[rows], sigma[rows], is_call[rows],
+                                                         q[rows], r[rows]))
+            result[rows] = computed
+            for i, values in zip(missing, computed.tolist()):
+                self.put(keys[i], Greeks(*values))
+
+        return(Greeks(*result.T))
+
+
+def _test():
+    from stock import Stock
+    from financial_option import EuropeanCallOption
+    from option_chain import OptionChain
+    from blackscholes_model import BlackScholesModel
+
+    cache = PricingCache(max_size=10000)
+    model = BlackScholesModel(datetime.datetime.now(), 0.05, cache=cache)
+    plain_model = BlackScholesModel(datetime.datetime.now(), 0.05)
+
+    # a request stream of the same 500 contracts at spots that differ in the fourth decimal
+    stocks = [Stock(opt=None, db_connection=None, ticker='Test', spot_price=100 + 1e-4 * i, sigma=0.2) for i in range(5)]
+    strikes = np.linspace(80, 120, 100)
+    expiries = [0.1, 0.25, 0.5, 1.0, 2.0]
+
+    for m, label in [(plain_model, 'no cache'), (model, 'with cache')]:
+        start = time.perf_counter()
+        for stock in stocks:
+            for K in strikes:
+                for T in expiries:
+                    m.calc_delta(EuropeanCallOption(stock, time_to_expiry=T, strike=K))
+        print(f"Scalar stream {label}: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    # the bulk path computes only the misses of a chain
+    chain = OptionChain([stocks[0]], strikes.repeat(10), np.tile(expiries + [3.0, 4.0, 5.0, 6.0, 7.0], 100),
+                        np.ones(1000))
+    model.calc_greeks(chain)
+    print("Cache stats:", cache.get_stats())
+
+    option = EuropeanCallOption(stocks[0], time_to_expiry=0.5, strike=100)
+    print("Cached price:", model.calc_model_price(option), "exact price:", plain_model.calc_model_price(option))
+
+if __name__ == "__main__":
+    _test()
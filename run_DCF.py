@@ -1,8 +1,11 @@
 import os
 import sqlite3
 import option
+import db
 import datetime
 
+import fundamentals_cache
+
 from DCF_model import DiscountedCashFlowModel
 from stock import Stock
 
@@ -21,15 +24,17 @@ def run():
     #
     parser = option.get_default_parser()
     parser.add_argument('--data_dir', dest = 'data_dir', default='./data', help='data dir')    
+    parser.add_argument('--offline', action='store_true', dest='offline', default=False,
+                        help='read financial statements and beta from the cache only')
     
     args = parser.parse_args()
     opt = option.Option(args = args)
 
     opt.output_dir = os.path.join(opt.data_dir, "daily")
     opt.sqlite_db = os.path.join(opt.data_dir, "sqlitedb/Equity.db")
+    opt.fundamentals_db = os.path.join(opt.data_dir, "sqlitedb/Fundamentals.db")
 
-    db_file = opt.sqlite_db
-    db_connection = sqlite3.connect(db_file)
+    db_connection = db.get_manager(opt.sqlite_db).get_reader()
     
     if opt.tickers is not None:
         list_of_tickers = opt.tickers.split(',')
@@ -37,13 +42,17 @@ def run():
     else:
         list_of_tickers = ['AAPL', 'BABA', 'GOOGL', 'TSLA', 'NVDA']
 
+    # one bulk download of the stale statements up front, so the loop below is served from the cache
+    cache = fundamentals_cache.FundamentalsCache(opt.fundamentals_db, offline = opt.offline)
+    cache.prefetch(list_of_tickers)
+
     as_of_date = datetime.date(2023, 10, 1)
 
     for ticker in list_of_tickers:
         eps5y = get_eps_next_5Y(ticker)
         print(eps5y)
 
-        stock = Stock(opt, db_connection, ticker)
+        stock = Stock(opt, db_connection, ticker, fundamentals_cache = cache)
         stock.load_financial_data()
         
         model = DiscountedCashFlowModel(stock, as_of_date)
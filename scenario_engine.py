@@ -0,0 +1,232 @@
+import time
+import datetime
+import collections
+
+import numpy as np
+
+from stock import Stock
+from financial_option import *
+from option_chain import OptionChain
+from blackscholes_model import BlackScholesModel
+
+# pnl is the (spot x vol x time) P&L cube of the whole portfolio, pnl_by_underlying maps each
+# underlying ticker to its own cube and base_value is the portfolio value before any shock
+ScenarioResult = collections.namedtuple('ScenarioResult', ['pnl', 'pnl_by_underlying', 'base_value', 'spec'])
+
+class ScenarioSpec(object):
+    '''
+    Shock grid for a scenario run:
+    spot_shocks are relative moves of the underlying spot (0.05 = +5%),
+    vol_shocks are absolute shifts of sigma (0.01 = +1 vol point),
+    time_shocks are time decay in years (1/365 = one calendar day)
+    '''
+
+    def __init__(self, spot_shocks, vol_shocks, time_shocks):
+        self.spot_shocks = np.asarray(spot_shocks, dtype=np.float64)
+        self.vol_shocks = np.asarray(vol_shocks, dtype=np.float64)
+        self.time_shocks = np.asarray(time_shocks, dtype=np.float64)
+
+    @classmethod
+    def grid(cls, spot_range = 0.2, num_spot = 41, vol_range = 0.1, num_vol = 21, max_days = 9, num_time = 10):
+        '''
+        the standard symmetric grid: +/- spot_range, +/- vol_range and 0 to max_days of decay
+        '''
+        return(cls(np.linspace(-spot_range, spot_range, num_spot),
+                   np.linspace(-vol_range, vol_range, num_vol),
+                   np.linspace(0, max_days, num_time) / 365))
+
+    @property
+    def shape(self):
+        return((self.spot_shocks.shape[0], self.vol_shocks.shape[0], self.time_shocks.shape[0]))
+
+
+class ScenarioEngine(object):
+    '''
+    Reprices a portfolio of options over a spot x vol x time decay shock grid with NumPy broadcasting.
+
+    Positions are processed chunk_size at a time along the position axis, so peak memory is about
+    chunk_size x grid size floats however large the portfolio is.
+
+    When the model has a vol_surface, sigma is read from it at each position's strike and (decayed)
+    time to expiry, as the model prices the positions, and the vol shocks shift that sigma.
+    '''
+
+    def __init__(self, model, chunk_size = 256):
+        self.model = model
+        self.chunk_size = chunk_size
+
+    def _get_position_data(self, positions, quantities):
+        '''
+        return per-position arrays (S_0, K, T, q, sigma, is_call, underlying_index), the underlyings
+        list and the quantities, for an OptionChain or a list of FinancialOption objects
+        '''
+        if isinstance(positions, OptionChain):
+            if positions.is_american.any():
+                raise Exception("Scenario engine only supports European options")
+            S_0, q, sigma = positions.get_market_data()
+            # quantities follow the input order of the contracts, the arrays the chain's row order
+            return(S_0, positions.strike, positions.time_to_expiry, q, sigma, positions.is_call,
+                   positions.underlying_index, positions.underlyings,
+                   positions.to_row_order(np.asarray(quantities, dtype=np.float64)))
+
+        underlyings = []
+        index = {}
+        underlying_index = []
+        for o in positions:
+            if o.option_style == FinancialOption.Style.AMERICAN:
+                raise Exception("Scenario engine only supports European options")
+            if id(o.underlying) not in index:
+                index[id(o.underlying)] = len(underlyings)
+                underlyings.append(o.underlying)
+            underlying_index.append(index[id(o.underlying)])
+
+        return(np.array([o.underlying.spot_price for o in positions], dtype=np.float64),
+               np.array([o.strike for o in positions], dtype=np.float64),
+               np.array([o.time_to_expiry for o in positions], dtype=np.float64),
+               np.array([o.underlying.dividend_yield for o in positions], dtype=np.float64),
+               np.array([o.underlying.sigma for o in positions], dtype=np.float64),
+               np.array([o.option_type == FinancialOption.Type.CALL for o in positions]),
+               np.array(underlying_index, dtype=np.int32), underlyings,
+               np.asarray(quantities, dtype=np.float64))
+
+    def _surface_sigma(self, K, T, underlying_index, underlyings):
+        # sigma from the model's vol surface; K and T broadcast, with positions along the first axis
+        K, T = np.broadcast_arrays(np.asarray(K, dtype=np.float64), np.asarray(T, dtype=np.float64))
+        sigma = np.empty(K.shape)
+        for i in np.unique(underlying_index):
+            rows = underlying_index == i
+            sigma[rows] = self.model.vol_surface.get_sigma(K[rows], T[rows], underlyings[i].ticker)
+        return(sigma)
+
+    def run(self, positions, quantities, spec):
+        '''
+        Calculate the P&L cube of the portfolio for every shock in spec.
+        positions is an OptionChain or a list of FinancialOption, quantities the signed position sizes
+        in the same order. Returns a ScenarioResult.
+        '''
+        S_0, K, T, q, sigma, is_call, underlying_index, underlyings, quantities = \
+            self._get_position_data(positions, quantities)
+        vol_surface = getattr(self.model, 'vol_surface', None)
+        if vol_surface is not None:
+            sigma = self._surface_sigma(K, T, underlying_index, underlyings)
+
+        # sort positions by underlying so every chunk aggregates contiguous groups with reduceat
+        order = np.argsort(underlying_index, kind='stable')
+        S_0, K, T, q, sigma, is_call, underlying_index, quantities = [
+            x[order] for x in (S_0, K, T, q, sigma, is_call, underlying_index, quantities)]
+
+        base_price = self.model.calc_model_price_batch(S_0, K, T, sigma, is_call, q)
+        base_value = float((quantities * base_price).sum())
+
+        spot_factor = (1 + spec.spot_shocks)[None, :, None, None]
+        vol_shift = spec.vol_shocks[None, None, :, None]
+        time_shift = spec.time_shocks[None, None, None, :]
+
+        pnl_by_index = np.zeros((len(underlyings),) + spec.shape)
+        for start in range(0, S_0.shape[0], self.chunk_size):
+            rows = slice(start, start + self.chunk_size)
+            col = lambda x: x[rows][:, None, None, None]
+
+            shocked_S = col(S_0) * spot_factor
+            shocked_T = np.maximum(col(T) - time_shift, 1e-8)
+            if vol_surface is not None:
+                # the decayed positions roll down the surface
+                base_sigma = self._surface_sigma(col(K), shocked_T, underlying_index[rows], underlyings)
+            else:
+                base_sigma = col(sigma)
+            shocked_sigma = np.maximum(base_sigma + vol_shift, 1e-4)
+            price = self.model.calc_model_price_batch(shocked_S, col(K), shocked_T, shocked_sigma, col(is_call), col(q))
+
+            pnl = col(quantities) * (price - col(base_price))
+            chunk_index = underlying_index[rows]
+            group_starts = np.flatnonzero(np.r_[True, chunk_index[1:] != chunk_index[:-1]])
+            pnl_by_index[chunk_index[group_starts]] += np.add.reduceat(pnl, group_starts, axis=0)
+
+        pnl_by_underlying = {}
+        for i, u in enumerate(underlyings):
+            pnl_by_underlying[u.ticker] = pnl_by_underlying.get(u.ticker, 0) + pnl_by_index[i]
+
+        return(ScenarioResult(pnl_by_index.sum(axis=0), pnl_by_underlying, base_value, spec))
+
+
+def _test():
+    pricing_date = datetime.datetime.now()
+    risk_free_rate = 0.05
+    model = BlackScholesModel(pricing_date, risk_free_rate)
+    engine = ScenarioEngine(model)
+
+    rng = np.random.default_rng(0)
+    stocks = [Stock(opt=None, db_connection=None, ticker=t, spot_price=p, sigma=v)
+              for t, p, v in [('AAPL', 180, 0.25), ('MSFT', 330, 0.22), ('NVDA', 450, 0.45)]]
+
+    num_positions = 5000
+    chain = OptionChain(stocks,
+                        strike=rng.uniform(0.8, 1.2, num_positions) * 300,
+                        time_to_expiry=rng.uniform(0.05, 1.0, num_positions),
+                        type_code=rng.integers(0, 2, num_positions),
+                        underlying_index=rng.integers(0, len(stocks), num_positions))
+    quantities = rng.integers(-10, 11, num_positions)
+
+    spec = ScenarioSpec.grid()
+    start = time.perf_counter()
+    result = engine.run(chain, quantities, spec)
+    elapsed = time.perf_counter() - start
+
+    print(f"{num_positions} positions x {np.prod(spec.shape)} scenarios in {elapsed:.2f} s")
+    print(f"Base portfolio value: {result.base_value:.2f}")
+    print(f"Worst P&L: {result.pnl.min():.2f}, best P&L: {result.pnl.max():.2f}")
+    for ticker, cube in result.pnl_by_underlying.items():
+        print(f"{ticker}: P&L at -20% spot, unchanged vol, no decay = {cube[0, 10, 0]:.2f}")
+
+    # the cube matches scalar repricing of a single shocked position
+    options = chain.to_options()
+    o = options[0]
+    shocked = Stock(opt=None, db_connection=None, ticker=o.underlying.ticker,
+                    spot_price=o.underlying.spot_price * 1.1, sigma=o.underlying.sigma + 0.05)
+    scalar_pnl = quantities[0] * (model.calc_model_price(type(o)(shocked, o.time_to_expiry - 3 / 365, o.strike)) -
+                                  model.calc_model_price(o))
+    cube = engine.run([o], [quantities[0]], ScenarioSpec([0.1], [0.05], [3 / 365])).pnl
+    print(f"Single position check: scalar {scalar_pnl:.6f} vs cube {cube[0, 0, 0]:.6f}")
+
+def _test_vol_surface():
+    # with a vol surface on the model the unshocked portfolio is priced as the model prices it
+    from vol_surface import VolatilitySurfaceCache
+
+    rng = np.random.default_rng(1)
+    stocks = [Stock(opt=None, db_connection=None, ticker=t, spot_price=p, sigma=v)
+              for t, p, v in [('AAPL', 180, 0.25), ('MSFT', 330, 0.22)]]
+    surfaces = VolatilitySurfaceCache()
+    expiries = np.repeat([0.25, 0.5, 1.0], 9)
+    for s in stocks:
+        strikes = np.tile(np.linspace(0.7, 1.3, 9) * s.spot_price, 3)
+        surfaces.update_quotes(s.ticker, strikes, expiries,
+                               s.sigma + 0.4 * np.log(strikes / s.spot_price) ** 2 + 0.02 * expiries)
+    model = BlackScholesModel(datetime.datetime.now(), 0.05, vol_surface=surfaces)
+    engine = ScenarioEngine(model, chunk_size=64)
+
+    num_positions = 500
+    underlying_index = rng.integers(0, len(stocks), num_positions)
+    spot = np.array([s.spot_price for s in stocks])[underlying_index]
+    chain = OptionChain(stocks, strike=rng.uniform(0.8, 1.2, num_positions) * spot,
+                        time_to_expiry=rng.uniform(0.1, 1.0, num_positions),
+                        type_code=rng.integers(0, 2, num_positions), underlying_index=underlying_index)
+    quantities = rng.integers(-10, 11, num_positions)
+
+    result = engine.run(chain, quantities, ScenarioSpec([0.0, 0.1], [0.0], [0.0, 3 / 365]))
+    model_value = float((quantities * model.calc_model_price(chain)).sum())
+    assert abs(result.base_value - model_value) < 1e-8 * max(1.0, abs(model_value)), (result.base_value, model_value)
+    assert np.all(result.pnl[0, 0, 0] == 0)
+
+    # a shocked and decayed position matches the model on the shocked option, surface vol included
+    o = chain.to_options()[0]
+    shocked = Stock(opt=None, db_connection=None, ticker=o.underlying.ticker,
+                    spot_price=o.underlying.spot_price * 1.1, sigma=o.underlying.sigma)
+    scalar_pnl = quantities[0] * (model.calc_model_price(type(o)(shocked, o.time_to_expiry - 3 / 365, o.strike)) -
+                                  model.calc_model_price(o))
+    cube = engine.run([o], [quantities[0]], ScenarioSpec([0.1], [0.0], [3 / 365])).pnl
+    assert abs(cube[0, 0, 0] - scalar_pnl) < 1e-8, (cube[0, 0, 0], scalar_pnl)
+    print(f"With a vol surface: base value {result.base_value:.4f} matches the model's {model_value:.4f}")
+
+if __name__ == "__main__":
+    _test()
+    _test_vol_surface()
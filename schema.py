@@ -0,0 +1,226 @@
+import os
+import time
+import shutil
+import sqlite3
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import db
+import option
+
+# PRAGMA user_version of the EquityDailyPrice layouts:
+#   0 or 1  AsOfDate is the text yfinance writes through CSV ('2020-01-02 00:00:00-05:00')
+#   2       AsOfDate is an INTEGER day number since 1970-01-01, prices REAL, Volume INTEGER, and the
+#           table is clustered on its (Ticker, AsOfDate) primary key (WITHOUT ROWID)
+SCHEMA_VERSION = 2
+
+CREATE_DAILY_PRICE_V2 = """CREATE TABLE {table} (
+    Ticker TEXT NOT NULL,
+    AsOfDate INTEGER NOT NULL,
+    Open REAL, High REAL, Low REAL, Close REAL,
+    Volume INTEGER, TurnOver REAL, Dividend REAL,
+    PRIMARY KEY (Ticker, AsOfDate)) WITHOUT ROWID"""
+
+# columns of EquityDailyPrice returned next to Ticker and AsOfDate by Stock.get_daily_hist_price
+DAILY_PRICE_COLUMNS = ('Open', 'High', 'Low', 'Close', 'Volume', 'TurnOver', 'Dividend')
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+def to_day_number(value):
+    '''
+    days since 1970-01-01 of a date, a 'YYYY-MM-DD...' string or an array of them
+    '''
+    if isinstance(value, str):
+        value = value[:10]
+    return((np.asarray(value, dtype='datetime64[D]') - EPOCH).astype(np.int32))
+
+def from_day_number(days):
+    '''
+    datetime.date objects of an array of day numbers
+    '''
+    # day numbers are datetime64[D] values already, so one cast converts the whole array
+    return(np.asarray(days, dtype=np.int64).astype('datetime64[D]').astype(object))
+
+def get_schema_version(db_connection):
+    return(db_connection.execute("PRAGMA user_version").fetchone()[0])
+
+def create_price_index(db_connection):
+    '''
+    create the index on EquityDailyPrice (Ticker, AsOfDate) if it is missing; it also holds the
+    price columns, so a ticker's date range is read from the index alone. Schema version 2 tables
+    are clustered on that key already and need no index
+    '''
+    if get_schema_version(db_connection) >= 2:
+        return
+    exists = db_connection.execute("select name from sqlite_master where name in "
+                                   "('EquityDailyPrice', 'EquityDailyPrice_Ticker_AsOfDate')").fetchall()
+    if len(exists) != 1:
+        # no price table yet, or the index is there already
+        return
+    try:
+        db_connection.execute("CREATE INDEX IF NOT EXISTS EquityDailyPrice_Ticker_AsOfDate ON EquityDailyPrice "
+                              f"(Ticker, AsOfDate, {', '.join(DAILY_PRICE_COLUMNS)})")
+        db_connection.commit()
+    except sqlite3.OperationalError as e:
+        # a read only database keeps working without the index
+        print(f"Could not create the EquityDailyPrice index: {e}")
+
+def date_bounds(version, start_date, end_date):
+    '''
+    (lower, upper) parameters for "AsOfDate >= ? and AsOfDate < ?" selecting start_date to end_date
+    inclusive; None bounds select everything on that side
+    '''
+    lower = None if start_date is None else str(start_date)[:10]
+    upper = None if end_date is None else str(pd.Timestamp(str(end_date)[:10]).date() + datetime.timedelta(days=1))
+    if version >= 2:
+        lower = None if lower is None else int(to_day_number(lower))
+        upper = None if upper is None else int(to_day_number(upper))
+    return(lower, upper)
+
+def date_key_sql(version):
+    # SQL expression of the calendar date of AsOfDate, comparable across rows
+    return("AsOfDate" if version >= 2 else "substr(AsOfDate, 1, 10)")
+
+def from_sql_dates(version, as_of_dates):
+    '''
+    datetime.date objects of an AsOfDate column as read from the database
+    '''
+    if version >= 2:
+        return(pd.Series(from_day_number(np.asarray(as_of_dates, dtype=np.int64)), index=as_of_dates.index))
+    return(pd.to_datetime(as_of_dates.str[:10], format="%Y-%m-%d").dt.date)
+
+def to_sql_dates(version, as_of_dates):
+    '''
+    AsOfDate values to write: the text as given for version 1, day numbers for version 2
+    '''
+    if version >= 2:
+        return(to_day_number(pd.Series(as_of_dates).astype(str).str[:10].to_numpy(dtype=str)).astype(np.int64))
+    return(np.asarray(as_of_dates))
+
+def create_daily_price_table(db_connection):
+    '''
+    create EquityDailyPrice with the current schema and set user_version if the database has no such
+    table yet, so a new database starts at SCHEMA_VERSION; return True if it was created.
+    The loaders call it before their first insert and commit with their own transaction
+    '''
+    exists = db_connection.execute("select 1 from sqlite_master where type = 'table' and "
+                                   "name = 'EquityDailyPrice'").fetchone()
+    if exists is not None:
+        return(False)
+    db_connection.execute(CREATE_DAILY_PRICE_V2.format(table='EquityDailyPrice'))
+    db_connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return(True)
+
+def migrate(db_connection, vacuum = True):
+    '''
+    convert EquityDailyPrice to schema version 2 in place, in one transaction. Rows whose AsOfDate
+    texts fall on the same calendar day collapse to the latest of them
+    '''
+    version = get_schema_version(db_connection)
+    if version >= SCHEMA_VERSION:
+        print(f"EquityDailyPrice is already at schema version {version}")
+        return(False)
+
+    db_connection.commit()
+    cursor = db_connection.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(CREATE_DAILY_PRICE_V2.format(table='EquityDailyPrice_v2'))
+        # julianday('1970-01-01') is 2440587.5
+        cursor.execute("INSERT OR REPLACE INTO EquityDailyPrice_v2 "
+                       "SELECT Ticker, CAST(julianday(substr(AsOfDate, 1, 10)) - 2440587.5 AS INTEGER), "
+                       "CAST(Open AS REAL), CAST(High AS REAL), CAST(Low AS REAL), CAST(Close AS REAL), "
+                       "CAST(Volume AS INTEGER), CAST(TurnOver AS REAL), CAST(Dividend AS REAL) "
+                       "FROM EquityDailyPrice WHERE AsOfDate IS NOT NULL ORDER BY Ticker, AsOfDate")
+        cursor.execute("DROP TABLE EquityDailyPrice")
+        cursor.execute("ALTER TABLE EquityDailyPrice_v2 RENAME TO EquityDailyPrice")
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.close()
+
+    if vacuum:
+        db_connection.execute("VACUUM")
+    return(True)
+
+
+def _benchmark(db_file, num_queries = 500, seed = 0):
+    '''
+    latency of one year range queries for a random ticker on two copies of db_file, one of them
+    migrated: the bare SQL fetch and the Stock.get_daily_hist_price DataFrame. Every query runs on
+    both copies back to back, so drift of the machine affects both layouts alike
+    '''
+    from stock import Stock
+
+    files = [db_file + ".v1.benchmark", db_file + ".v2.benchmark"]
+    for f in files:
+        shutil.copyfile(db_file, f)
+    connections = [sqlite3.connect(f) for f in files]
+    try:
+        create_price_index(connections[0])
+        start = time.perf_counter()
+        migrate(connections[1])
+        print(f"Migrated in {time.perf_counter() - start:.2f} s")
+        versions = [get_schema_version(c) for c in connections]
+
+        tickers = [row[0] for row in connections[1].execute("select distinct Ticker from EquityDailyPrice")]
+        bounds = connections[1].execute("select min(AsOfDate), max(AsOfDate) from EquityDailyPrice").fetchone()
+        first, last = from_sql_dates(versions[1], pd.Series(bounds)).tolist()
+        rng = np.random.default_rng(seed)
+        span = max((last - first).days - 365, 1)
+        queries = [(tickers[i], first + datetime.timedelta(days=int(d))) for i, d in
+                   zip(rng.integers(0, len(tickers), num_queries), rng.integers(0, span, num_queries))]
+
+        sql = f"select Ticker, AsOfDate, {', '.join(DAILY_PRICE_COLUMNS)} from EquityDailyPrice " \
+              "where Ticker = ? and AsOfDate >= ? and AsOfDate < ? order by AsOfDate asc"
+        stocks = [{t: Stock(opt=None, db_connection=c, ticker=t) for t in tickers} for c in connections]
+        fetch, frame = np.zeros((2, num_queries)), np.zeros((2, num_queries))
+        for k, (ticker, start) in enumerate(queries):
+            end = start + datetime.timedelta(days=365)
+            for i, c in enumerate(connections):
+                begin = time.perf_counter()
+                c.execute(sql, (ticker,) + date_bounds(versions[i], start, end)).fetchall()
+                fetch[i, k] = time.perf_counter() - begin
+                begin = time.perf_counter()
+                stocks[i][ticker].get_daily_hist_price(start, end)
+                frame[i, k] = time.perf_counter() - begin
+
+        # the first queries warm the page caches
+        fetch, frame = fetch[:, 20:] * 1000, frame[:, 20:] * 1000
+        for i, f in enumerate(files):
+            print(f"Schema version {versions[i]}: SQL fetch median {np.median(fetch[i]):.3f} ms, "
+                  f"p95 {np.percentile(fetch[i], 95):.3f} ms; Stock frame median {np.median(frame[i]):.2f} ms, "
+                  f"p95 {np.percentile(frame[i], 95):.2f} ms; file size {os.path.getsize(f) / 2 ** 20:.1f} MiB")
+    finally:
+        for c in connections:
+            c.close()
+        for f in files:
+            os.remove(f)
+
+def run():
+    parser = option.get_default_parser()
+    parser.add_argument('--data_dir', dest = 'data_dir', default='./data', help='data dir')
+    parser.add_argument('--migrate', action='store_true', dest='migrate', default=False,
+                        help='convert EquityDailyPrice to the current schema in place')
+    parser.add_argument('--benchmark', action='store_true', dest='benchmark', default=False,
+                        help='compare range query latency before and after the migration on a copy')
+
+    args = parser.parse_args()
+    opt = option.Option(args = args)
+    opt.sqlite_db = os.path.join(opt.data_dir, "sqlitedb/Equity.db")
+
+    if opt.benchmark:
+        _benchmark(opt.sqlite_db)
+    if opt.migrate:
+        with db.get_manager(opt.sqlite_db).writer() as db_connection:
+            print(f"Schema version {get_schema_version(db_connection)}")
+            migrate(db_connection)
+            print(f"Schema version {get_schema_version(db_connection)}")
+
+if __name__ == "__main__":
+    run()
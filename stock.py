@@ -8,35 +8,95 @@ import yfinance as yf
 
 from utils import MyYahooFinancials 
 import option
+import db
+import schema
+from schema import DAILY_PRICE_COLUMNS
 
 from bs4 import BeautifulSoup       # needed for the FinViz data scraper
 import requests
 
+def load_daily_hist_panel(db_connection, tickers, start_date, end_date, fields = ('Open', 'High', 'Low', 'Close', 'Volume'),
+                          tickers_per_query = 500, rows_per_fetch = 20000):
+    '''
+    bulk version of Stock.get_daily_hist_price for many tickers: return (dates, tickers, {field: dates x tickers
+    array}) with NaN where a ticker has no bar. The dates are collected first with a distinct query on
+    the index, the arrays are allocated once, and the rows are then streamed rows_per_fetch at a time
+    straight into them, so memory stays at the size of the result plus one fetch
+    '''
+    tickers = list(tickers)
+    version = schema.get_schema_version(db_connection)
+    where = "where Ticker in ({}) and AsOfDate >= ? and AsOfDate < ?"
+    bounds = list(schema.date_bounds(version, start_date, end_date))
+    chunks = [tickers[i:i + tickers_per_query] for i in range(0, len(tickers), tickers_per_query)]
+
+    date_keys = set()
+    for chunk in chunks:
+        sql = f"select distinct {schema.date_key_sql(version)} from EquityDailyPrice " \
+              f"{where.format(','.join(['?'] * len(chunk)))}"
+        date_keys.update(row[0] for row in db_connection.execute(sql, chunk + bounds))
+    # 'YYYY-MM-DD' texts for version 1, day numbers for version 2
+    date_keys = np.array(sorted(date_keys), dtype='<U10' if version < 2 else np.int64)
+
+    values = {f: np.full((len(date_keys), len(tickers)), np.nan) for f in fields}
+    ticker_index = pd.Index(tickers)
+    for chunk in chunks:
+        sql = f"select Ticker, AsOfDate, {', '.join(fields)} from EquityDailyPrice " \
+              f"{where.format(','.join(['?'] * len(chunk)))}"
+        cursor = db_connection.execute(sql, chunk + bounds)
+        while True:
+            rows = cursor.fetchmany(rows_per_fetch)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            # a '<U10' array keeps only the 'YYYY-MM-DD' part of AsOfDate text
+            date_codes = np.searchsorted(date_keys, np.array(columns[1], dtype=date_keys.dtype))
+            ticker_codes = ticker_index.get_indexer(columns[0])
+            for i, f in enumerate(fields):
+                values[f][date_codes, ticker_codes] = np.array(columns[i + 2], dtype=np.float64)
+        cursor.close()
+
+    dates = pd.Index(schema.from_sql_dates(version, pd.Series(date_keys)).to_numpy(), name='Date')
+    return(dates, tickers, values)
+
 class Stock(object):
     '''
     Stock class for getting financial statements
     default freq is annual
     '''
-    def __init__(self, opt, db_connection, ticker, spot_price = None, sigma = None, dividend_yield = 0, freq = 'annual'):
+    def __init__(self, opt, db_connection, ticker, spot_price = None, sigma = None, dividend_yield = 0, freq = 'annual', price_store = None,
+                 fundamentals_cache = None):
         self.opt = opt
         self.db_connection = db_connection
+        self.price_store = price_store      # optional OHLCVStore used instead of the database for daily prices
         self.ticker = ticker
         self.spot_price = spot_price
         self.sigma = sigma
         self.dividend_yield = dividend_yield
         
-        self.yfin = MyYahooFinancials(ticker, freq)
+        # optional FundamentalsCache the financial statements are read through
+        self.yfin = MyYahooFinancials(ticker, freq, cache = fundamentals_cache)
 
-    def get_daily_hist_price(self, start_date, end_date):
+    def get_daily_hist_price(self, start_date, end_date, columns = DAILY_PRICE_COLUMNS):
         # get daily historical OHLCV from database
         try:
-            sql = f"select * from EquityDailyPrice where ticker = '{self.ticker}' order by AsOfDate asc"
-            df = pd.read_sql(sql, self.db_connection)
-            df['AsOfDate'] = df['AsOfDate'].apply(lambda x: datetime.datetime.strptime(x[:10], "%Y-%m-%d").date())
-
-            # filter data between start and end date
-            df = df[ df.AsOfDate >= start_date ]
-            df = df[ df.AsOfDate <= end_date ]
+            if self.price_store is not None:
+                self.ohlcv_df = self.price_store.get_daily_hist_price(self.ticker, start_date, end_date)
+                return(self.ohlcv_df)
+
+            # AsOfDate is text ('YYYY-MM-DD HH:MM:SS+TZ') before schema version 2 and a day number from
+            # it on; the bounds are of the same kind
+            version = schema.get_schema_version(self.db_connection)
+            lower, upper = schema.date_bounds(version, start_date, end_date)
+            sql = f"select Ticker, AsOfDate, {', '.join(columns)} from EquityDailyPrice where Ticker = ?"
+            params = [self.ticker]
+            if lower is not None:
+                sql += " and AsOfDate >= ?"
+                params.append(lower)
+            if upper is not None:
+                sql += " and AsOfDate < ?"
+                params.append(upper)
+            df = pd.read_sql(sql + " order by AsOfDate asc", self.db_connection, params=params)
+            df['AsOfDate'] = schema.from_sql_dates(version, df['AsOfDate'])
 
             # create an index based on the AsOfDate column
             df['Date'] = df.AsOfDate
@@ -123,22 +183,26 @@ class Stock(object):
     # version number 1 to do get_beta (from FinViz)
     # found from https://medium.datadriveninvestor.com/scraping-live-stock-fundamental-ratios-news-and-more-with-python-a716329e0493
     def get_beta(self):
-        # web scraper using beautifulsoup module
+        # read through the FundamentalsCache when there is one, so an offline run needs no network
         try:
-            url = f"http://finviz.com/quote.ashx?t={self.ticker.lower()}"           # FinViz link to scrape for any designated ticker
-            response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})     # user-agent header required to scrape data from FinViz
-            soup = BeautifulSoup(response.content, 'html.parser')                   # store the html content from the url in a variable "soup"
-            
-            beta = None                                     # default beta value is none
-            beta_tag = soup.find('td', text='Beta')         # locate beta tag on FinViz
-            if beta_tag:
-                beta = beta_tag.find_next('td').text
-
-            return beta                                     # return beta value
+            if self.yfin.cache is not None:
+                return(self.yfin.cache.get_quote_value(self.ticker, 'beta', self._fetch_beta))
+            return(self._fetch_beta())
         except Exception as e:
             print(f"Failed to get beta for {self.ticker}: {e}")     # if beta value for the ticker isn't available, print error
             return None                                             # return nothing if no beta value is found
 
+    def _fetch_beta(self):
+        # web scraper using beautifulsoup module
+        url = f"http://finviz.com/quote.ashx?t={self.ticker.lower()}"           # FinViz link to scrape for any designated ticker
+        response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})     # user-agent header required to scrape data from FinViz
+        soup = BeautifulSoup(response.content, 'html.parser')                   # store the html content from the url in a variable "soup"
+
+        beta_tag = soup.find('td', text='Beta')         # locate beta tag on FinViz
+        if beta_tag is None:
+            raise Exception("no beta on FinViz")
+        return(float(beta_tag.find_next('td').text))    # raises for a missing value ('-'), which is then not cached
+
     # takes the beta value found on FinViz and converts it to a discount rate value (implemented from the table on the blog)
     def lookup_wacc_by_beta(self, beta):
         if beta is None:
@@ -181,8 +245,7 @@ def _test():
     opt.output_dir = os.path.join(opt.data_dir, "daily")
     opt.sqlite_db = os.path.join(opt.data_dir, "sqlitedb/Equity.db")
 
-    db_file = opt.sqlite_db
-    db_connection = sqlite3.connect(db_file)
+    db_connection = db.get_manager(opt.sqlite_db).get_reader()
 
     print(vars(opt))
     
@@ -0,0 +1,237 @@
+'''
+NumPy kernels shared by the technical analysis indicators.
+
+Every kernel works along axis 0 (time) of a 1-D or 2-D float array, so the same code serves a
+single price series, all the OHLC columns of one ticker, or a dates x tickers panel.
+Missing values are NaN.
+'''
+import numpy as np
+
+def _as_2d(values):
+    values = np.asarray(values, dtype=np.float64)
+    return(values.reshape(values.shape[0], -1), values.shape)
+
+def cumulative_sum(values, compensated = False):
+    '''
+    return the prefix sums of values along axis 0 with a leading row of zeros, so that
+    result[t + 1] - result[t + 1 - p] is the sum of the p rows ending at t.
+    NaNs count as zero. With compensated=True the running sums use Neumaier compensation,
+    which keeps the window sums of very long histories accurate to a few ulps.
+    '''
+    values, shape = _as_2d(values)
+    values = np.where(np.isnan(values), 0.0, values)
+    result = np.zeros((values.shape[0] + 1, values.shape[1]))
+
+    if not compensated:
+        np.cumsum(values, axis=0, out=result[1:])
+    else:
+        total = np.zeros(values.shape[1])
+        compensation = np.zeros(values.shape[1])
+        for i in range(values.shape[0]):
+            x = values[i]
+            t = total + x
+            compensation += np.where(np.abs(total) >= np.abs(x), (total - t) + x, (x - t) + total)
+            total = t
+            result[i + 1] = total + compensation
+
+    return(result.reshape((values.shape[0] + 1,) + shape[1:]))
+
+def rolling_mean_multi(values, periods, compensated = False):
+    '''
+    return the simple moving averages of values for every period in one pass, shaped
+    (len(periods),) + values.shape. All windows are differences of one prefix sum per column.
+    Like pandas rolling(window=period).mean(), a window with fewer than period valid rows is NaN.
+    Columns are centered on their mean before summing, which keeps the prefix sums small.
+    '''
+    values, shape = _as_2d(values)
+    num_rows = values.shape[0]
+    valid = ~np.isnan(values)
+
+    with np.errstate(invalid='ignore'):
+        center = np.nanmean(values, axis=0) if num_rows > 0 else np.zeros(values.shape[1])
+    center = np.where(np.isnan(center), 0.0, center)
+    prefix = cumulative_sum(values - center, compensated)
+    counts = np.concatenate([np.zeros((1, values.shape[1]), dtype=np.int64), np.cumsum(valid, axis=0)])
+
+    result = np.full((len(periods), num_rows, values.shape[1]), np.nan)
+    for i, period in enumerate(periods):
+        if period > num_rows:
+            continue
+        window_sum = prefix[period:] - prefix[:-period]
+        window_count = counts[period:] - counts[:-period]
+        result[i, period - 1:] = np.where(window_count == period, window_sum / period + center, np.nan)
+
+    return(result.reshape((len(periods),) + shape))
+
+def ewm_mean(values, span):
+    '''
+    return the exponential moving average along axis 0 with alpha = 2 / (span + 1), the recursion
+    of pandas ewm(span=span, adjust=False).mean() started at the first row.
+    Runs as one IIR filter pass over all columns; NaNs propagate forward, so call it on packed
+    columns (see pack_valid) when rows can be missing.
+    '''
+    from scipy.signal import lfilter
+
+    values, shape = _as_2d(values)
+    if values.shape[0] == 0:
+        return(values.reshape(shape))
+    alpha = 2 / (span + 1)
+    # y[t] = alpha * x[t] + (1 - alpha) * y[t - 1], started so that y[0] = x[0]
+    initial = ((1 - alpha) * values[0])[None, :]
+    result, final = lfilter([alpha], [1, -(1 - alpha)], values, axis=0, zi=initial)
+    return(result.reshape(shape))
+
+def pack_valid(values, mask):
+    '''
+    move the valid rows of every column of a 2-D array to the top, keeping their order, and fill the
+    rest with NaN. Indicators computed on the packed array see each column as its own gapless series
+    (missing bars and rows before a listing date disappear); unpack_valid puts the results back.
+    Returns (packed, order)
+    '''
+    order = np.argsort(~mask, axis=0, kind='stable')
+    packed = np.take_along_axis(values, order, axis=0)
+    packed[np.take_along_axis(~mask, order, axis=0)] = np.nan
+    return(packed, order)
+
+def unpack_valid(packed, order, mask):
+    '''
+    inverse of pack_valid: scatter the packed rows back to their dates, NaN where mask is False
+    '''
+    result = np.empty_like(packed)
+    np.put_along_axis(result, order, packed, axis=0)
+    result[~mask] = np.nan
+    return(result)
+
+def segmented_cumsum(values, starts):
+    '''
+    return cumulative sums along axis 0 that restart at every row where starts is True (row 0 always
+    starts a segment). starts is either one flag per row, shared by all columns, or an array of the
+    shape of values with flags per column. NaNs count as zero.
+    All segments of all columns are summed in one cumsum: the columns are laid end to end and the
+    np.add.reduceat total of every segment is inserted negated after it, so the running sum falls
+    back to a rounding residual at each start instead of growing with the whole history; the residual
+    is then subtracted from its segment.
+    '''
+    values, shape = _as_2d(values)
+    num_rows, num_columns = values.shape
+    if num_rows == 0:
+        return(values.reshape(shape))
+
+    starts = np.asarray(starts, dtype=bool)
+    starts = np.broadcast_to(starts.reshape(num_rows, -1), values.shape).copy()
+    starts[0] = True
+
+    flat_values = np.where(np.isnan(values), 0.0, values).T.ravel()
+    segment_starts = np.flatnonzero(starts.T.ravel())
+    totals = np.add.reduceat(flat_values, segment_starts)
+
+    extended = np.insert(flat_values, segment_starts[1:], -totals[:-1])
+    running = np.cumsum(extended)
+    separators = segment_starts[1:] + np.arange(len(segment_starts) - 1)
+    residuals = np.concatenate([[0.0], running[separators]])
+
+    keep = np.ones(len(extended), dtype=bool)
+    keep[separators] = False
+    result = running[keep] - np.repeat(residuals, np.diff(np.append(segment_starts, len(flat_values))))
+    return(np.ascontiguousarray(result.reshape(num_columns, num_rows).T).reshape(shape))
+
+def rolling_mean_var(values, period, ddof = 1):
+    '''
+    return (mean, var) of windows of period rows along axis 0. Like pandas rolling(period), a
+    window with a NaN or fewer than period rows is NaN.
+    The rows are cut into blocks of period rows, and the deviations of every row from the mean of its
+    block are summed with prefix sums restarting at each block. A window overlaps at most two
+    blocks, so its sums of deviations come from two block-local prefix sums and are shifted to the
+    window mean exactly; the sums of squares never hold more than about two windows of spread, which
+    avoids the cancellation of sum(x^2) - n * mean^2 on long or high priced histories.
+    '''
+    values, shape = _as_2d(values)
+    num_rows, num_columns = values.shape
+    mean = np.full(values.shape, np.nan)
+    var = np.full(values.shape, np.nan)
+    if period > num_rows:
+        return(mean.reshape(shape), var.reshape(shape))
+
+    num_blocks = -(-num_rows // period)
+    blocks = np.full((num_blocks * period, num_columns), np.nan)
+    blocks[:num_rows] = values
+    blocks = blocks.reshape(num_blocks, period, num_columns)
+    valid = ~np.isnan(blocks)
+    block_counts = valid.sum(axis=1)
+    center = np.where(block_counts > 0, np.where(valid, blocks, 0.0).sum(axis=1) / np.maximum(block_counts, 1), 0.0)
+
+    deviation = np.where(valid, blocks - center[:, None, :], 0.0)
+    zero_row = np.zeros((1, num_columns))
+    # block-local prefix sums, with a leading zero row so that prefix row i + 1 holds row i
+    counts, sums, squares = [np.vstack([zero_row, np.cumsum(x, axis=1).reshape(-1, num_columns)[:num_rows]])
+                             for x in (valid, deviation, deviation * deviation)]
+    current_center = np.repeat(center, period, axis=0)[:num_rows]
+    previous_center = np.repeat(np.vstack([center[:1], center[:-1]]), period, axis=0)[:num_rows]
+
+    # window ending at t = part of the previous block (rows t - period + 1 .. block start - 1)
+    # plus part of the current block (block start .. t)
+    t = np.arange(period - 1, num_rows)
+    block_start = t - t % period
+    current, window_start = slice(period, num_rows + 1), slice(0, num_rows - period + 1)
+    n_current, s_current, q_current = counts[current], sums[current], squares[current]
+    n_previous = counts[block_start] - counts[window_start]
+    s_previous = sums[block_start] - sums[window_start]
+    q_previous = squares[block_start] - squares[window_start]
+
+    n = n_previous + n_current
+    # window mean relative to the current block's center, then the previous block's
+    center_step = current_center[period - 1:] - previous_center[period - 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = (s_previous - n_previous * center_step + s_current) / n
+        previous_shift = shift + center_step
+        sum_squares = (q_current - 2 * shift * s_current + n_current * shift ** 2) + \
+                      (q_previous - 2 * previous_shift * s_previous + n_previous * previous_shift ** 2)
+
+    full = n == period
+    mean[period - 1:] = np.where(full, current_center[period - 1:] + shift, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var[period - 1:] = np.where(full, np.maximum(sum_squares, 0.0) / (period - ddof), np.nan)
+    return(mean.reshape(shape), var.reshape(shape))
+
+def _rolling_extreme(values, period, func):
+    # van Herk / Gil-Werman: a window of period rows spans at most two blocks of period rows, so its
+    # extreme is func of a suffix accumulation of one block and a prefix accumulation of the next
+    values, shape = _as_2d(values)
+    num_rows, num_columns = values.shape
+    result = np.full(values.shape, np.nan)
+    if period > num_rows:
+        return(result.reshape(shape))
+
+    num_blocks = -(-num_rows // period)
+    blocks = np.full((num_blocks * period, num_columns), np.nan)
+    blocks[:num_rows] = values
+    blocks = blocks.reshape(num_blocks, period, num_columns)
+    prefix = func.accumulate(blocks, axis=1).reshape(-1, num_columns)
+    suffix = func.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1, num_columns)
+
+    valid = np.concatenate([np.zeros((1, num_columns), dtype=np.int64), np.cumsum(~np.isnan(values), axis=0)])
+    full = valid[period:] - valid[:-period] == period
+    result[period - 1:] = np.where(full, func(suffix[:num_rows - period + 1], prefix[period - 1:num_rows]), np.nan)
+    return(result.reshape(shape))
+
+def rolling_max(values, period):
+    '''
+    return the maximum of windows of period rows along axis 0 in O(n), NaN where a window has a NaN
+    '''
+    return(_rolling_extreme(values, period, np.fmax))
+
+def rolling_min(values, period):
+    '''
+    return the minimum of windows of period rows along axis 0 in O(n), NaN where a window has a NaN
+    '''
+    return(_rolling_extreme(values, period, np.fmin))
+
+def true_range(high, low, close):
+    '''
+    return max(high - low, |high - previous close|, |low - previous close|) along axis 0; the first
+    row, which has no previous close, is high - low
+    '''
+    high, low, close = [np.asarray(x, dtype=np.float64) for x in (high, low, close)]
+    previous_close = np.full_like(close, np.nan)
+    previous_close[1:] = close[:-1]
+    return(np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close))))
@@ -0,0 +1,159 @@
+import os
+import time
+import datetime
+import concurrent.futures
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import db
+import option
+from TA import PricePanel, PanelIndicators, _make_test_ohlcv
+
+# indicators the driver knows how to compute, as (name, parameter) specs
+DEFAULT_INDICATORS = [('sma', 9), ('sma', 20), ('sma', 50), ('sma', 100), ('sma', 200),
+                      ('ema', 12), ('ema', 26), ('rsi', 14), ('vwap', None)]
+
+def _compute_slice(price_block, price_shape, result_block, result_shape, fields, indicators, start, stop):
+    '''
+    worker task: attach to the shared price and result blocks, compute every indicator for the
+    tickers start:stop and write them into the result block. Only block names, shapes and the
+    ticker bounds cross the process boundary.
+    '''
+    prices_shm = shared_memory.SharedMemory(name=price_block)
+    results_shm = shared_memory.SharedMemory(name=result_block)
+    try:
+        prices = np.ndarray(price_shape, dtype=np.float64, buffer=prices_shm.buf)
+        results = np.ndarray(result_shape, dtype=np.float64, buffer=results_shm.buf)
+
+        panel = PricePanel(None, range(start, stop), {f: prices[i, :, start:stop] for i, f in enumerate(fields)})
+        panel_indicators = PanelIndicators(panel)
+        for i, (name, parameter) in enumerate(indicators):
+            if name == 'sma':
+                values = panel_indicators.sma([parameter])[parameter]
+            elif name == 'ema':
+                values = panel_indicators.ema([parameter])[parameter]
+            elif name == 'rsi':
+                values = panel_indicators.rsi(parameter)
+            elif name == 'vwap':
+                values = panel_indicators.vwap()
+            else:
+                raise ValueError(f"Unknown indicator '{name}'")
+            results[i, :, start:stop] = values
+    finally:
+        # release the views before closing the mappings
+        prices = results = panel = panel_indicators = None
+        prices_shm.close()
+        results_shm.close()
+    return(stop - start)
+
+
+class ParallelIndicatorDriver(object):
+    '''
+    Computes indicators for a whole PricePanel on a process pool.
+
+    The OHLCV fields are copied once into a shared memory block of shape (fields x dates x tickers)
+    and the outputs go to a shared (indicators x dates x tickers) block; each task is a slice of
+    chunk_size tickers, so workers never receive pickled DataFrames or arrays.
+    '''
+
+    def __init__(self, num_workers = None, chunk_size = 50, indicators = None):
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count()
+        self.chunk_size = chunk_size
+        self.indicators = indicators if indicators is not None else DEFAULT_INDICATORS
+
+    def run(self, panel):
+        '''
+        return a dict of (name, parameter) -> dates x tickers array for every indicator
+        '''
+        fields = ['Close', 'Volume']
+        num_dates, num_tickers = panel.fields['Close'].shape
+        price_shape = (len(fields), num_dates, num_tickers)
+        result_shape = (len(self.indicators), num_dates, num_tickers)
+
+        prices_shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(price_shape)) * 8, 1))
+        results_shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(result_shape)) * 8, 1))
+        try:
+            prices = np.ndarray(price_shape, dtype=np.float64, buffer=prices_shm.buf)
+            for i, f in enumerate(fields):
+                prices[i] = panel.fields[f]
+            results = np.ndarray(result_shape, dtype=np.float64, buffer=results_shm.buf)
+
+            tasks = [(prices_shm.name, price_shape, results_shm.name, result_shape, fields, self.indicators,
+                      start, min(start + self.chunk_size, num_tickers))
+                     for start in range(0, num_tickers, self.chunk_size)]
+
+            if self.num_workers > 1:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                    list(executor.map(_compute_slice, *zip(*tasks)))
+            else:
+                for task in tasks:
+                    _compute_slice(*task)
+
+            output = {spec: results[i].copy() for i, spec in enumerate(self.indicators)}
+        finally:
+            prices = results = None
+            prices_shm.close()
+            prices_shm.unlink()
+            results_shm.close()
+            results_shm.unlink()
+
+        return(output)
+
+
+def _benchmark(num_tickers = 500, num_dates = 5000, chunk_size = 25):
+    '''
+    scaling of the driver from 1 to cpu_count workers on a synthetic panel
+    '''
+    frames = {f"T{i}": _make_test_ohlcv(num_dates, seed=i) for i in range(num_tickers)}
+    panel = PricePanel.from_frames(frames)
+    print(f"Panel of {num_tickers} tickers x {num_dates} dates, {len(DEFAULT_INDICATORS)} indicators")
+
+    reference = None
+    base_time = None
+    num_workers = 1
+    while True:
+        driver = ParallelIndicatorDriver(num_workers=num_workers, chunk_size=chunk_size)
+        start = time.perf_counter()
+        output = driver.run(panel)
+        elapsed = time.perf_counter() - start
+
+        if reference is None:
+            reference, base_time = output, elapsed
+        else:
+            assert all(np.array_equal(reference[k], output[k], equal_nan=True) for k in reference)
+        print(f"{num_workers:>3} workers: {elapsed:.2f} s, speed-up {base_time / elapsed:.2f}x")
+
+        if num_workers >= os.cpu_count():
+            break
+        num_workers = min(num_workers * 2, os.cpu_count())
+
+def run():
+    parser = option.get_default_parser()
+    parser.add_argument('--data_dir', dest = 'data_dir', default='./data', help='data dir')
+    parser.add_argument('--workers', dest = 'workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--chunk_size', dest = 'chunk_size', type=int, default=50, help='tickers per task')
+
+    args = parser.parse_args()
+    opt = option.Option(args = args)
+    opt.sqlite_db = os.path.join(opt.data_dir, "sqlitedb/Equity.db")
+
+    if opt.tickers is not None:
+        list_of_tickers = opt.tickers.split(',')
+    else:
+        fname = os.path.join(opt.data_dir, "S&P500.txt")
+        list_of_tickers = list(pd.read_csv(fname, header=None).iloc[:, 0])
+
+    db_connection = db.get_manager(opt.sqlite_db).get_reader()
+    start_date = datetime.datetime.strptime(opt.start_date, "%Y-%m-%d").date()
+    end_date = datetime.datetime.strptime(opt.end_date, "%Y-%m-%d").date()
+    panel = PricePanel.from_db(db_connection, list_of_tickers, start_date, end_date)
+
+    driver = ParallelIndicatorDriver(num_workers=opt.workers, chunk_size=opt.chunk_size)
+    output = driver.run(panel)
+    for spec, values in output.items():
+        print(spec, panel.to_frame(values).iloc[-1].head())
+
+if __name__ == "__main__":
+    _benchmark()
@@ -3,12 +3,14 @@ from yahoofinancials import YahooFinancials
 class MyYahooFinancials(YahooFinancials):
     '''
     Extended class based on YahooFinancial libary
+    With a FundamentalsCache, statements are read from the cache and only fetched when stale
 
     '''
-    def __init__(self, ticker, freq = 'annual'):
+    def __init__(self, ticker, freq = 'annual', cache = None):
         YahooFinancials.__init__(self, ticker)
         self.ticker = ticker
         self.freq = freq
+        self.cache = cache
         self._income_statement_data = {}
         self._balance_sheet_data = {}
         self._cashflow_data = {}
@@ -53,6 +55,13 @@ class MyYahooFinancials(YahooFinancials):
         # show all data available
         for k, v in self._cashflow_data.items():
             print(f"{k}: {v}")
+
+    def _get_statement_history(self, statement, key):
+        # the statement history of the ticker, oldest first, from the cache when there is one
+        fetch = lambda: self.get_financial_stmts(self.freq, statement)[key][self.ticker]
+        if self.cache is None:
+            return(fetch())
+        return(self.cache.get_statement_history(self.ticker, self.freq, statement, fetch))
             
     def _get_income_statement_history(self):
         if self.freq == 'annual':
@@ -61,7 +70,7 @@ class MyYahooFinancials(YahooFinancials):
             key = 'incomeStatementHistoryQuarterly'
 
         # save the latest history
-        hist = self.get_financial_stmts(self.freq, 'income')[key][self.ticker][-1]
+        hist = self._get_statement_history('income', key)[-1]
         dt = list(hist.keys())[0]
         self._income_statement_asof_date = dt
         # cashflow data is a dict
@@ -74,7 +83,7 @@ class MyYahooFinancials(YahooFinancials):
             key = 'balanceSheetHistoryQuarterly'
 
         # save the latest history
-        hist = self.get_financial_stmts(self.freq, 'balance')[key][self.ticker][-1]
+        hist = self._get_statement_history('balance', key)[-1]
         dt = list(hist.keys())[0]
         self._balance_sheet_asof_date = dt
         # cashflow data is a dict
@@ -88,7 +97,7 @@ class MyYahooFinancials(YahooFinancials):
             key = 'cashflowStatementHistoryQuarterly'
 
         # save the latest history
-        hist = self.get_financial_stmts(self.freq, 'cash')[key][self.ticker][-1]
+        hist = self._get_statement_history('cash', key)[-1]
         dt = list(hist.keys())[0]
         self._cashflow_asof_date = dt
         # cashflow data is a dict
@@ -0,0 +1,165 @@
+import time
+import datetime
+
+import numpy as np
+
+from stock import Stock
+from financial_option import *
+from blackscholes_model import BlackScholesModel
+
+class VolatilitySurface(object):
+    '''
+    Implied volatility surface over strike and expiry built from quoted implied vols.
+
+    Quotes of every expiry are resampled onto the union of quoted strikes (flat extrapolation in vol)
+    and stored as total variance sigma^2 * T. The grid and the per-cell strike slopes are computed
+    once, so a vectorized (strike, expiry) query is two searchsorted calls and a few array operations:
+    linear in strike within an expiry, linear in total variance between expiries, and flat vol
+    outside the quoted expiries.
+    New quotes only mark their expiries dirty; the next query rebuilds just those rows unless the
+    quotes brought new strikes, in which case the whole grid is resampled.
+    '''
+
+    def __init__(self, strikes, expiries, vols):
+        self._quotes = {}
+        self._strike_grid = None
+        self._expiry_grid = None
+        self._total_variance = None
+        self._slope = None
+        self._dirty = set()
+        self.add_quotes(strikes, expiries, vols)
+
+    def add_quotes(self, strikes, expiries, vols):
+        '''
+        add or replace quotes; the surface is updated lazily on the next get_sigma
+        '''
+        strikes, expiries, vols = [np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in (strikes, expiries, vols)]
+        for T in np.unique(expiries):
+            rows = expiries == T
+            quotes = self._quotes.setdefault(float(T), {})
+            quotes.update(zip(strikes[rows].tolist(), vols[rows].tolist()))
+            self._dirty.add(float(T))
+
+    def _build_row(self, T):
+        quotes = self._quotes[T]
+        K = np.fromiter(quotes.keys(), dtype=np.float64)
+        vol = np.fromiter(quotes.values(), dtype=np.float64)
+        order = np.argsort(K)
+        sigma = np.interp(self._strike_grid, K[order], vol[order])
+        return(sigma * sigma * T)
+
+    def _rebuild(self):
+        if not self._dirty:
+            return
+
+        expiry_grid = np.array(sorted(self._quotes.keys()))
+        strike_grid = np.unique(np.concatenate([np.fromiter(q.keys(), dtype=np.float64)
+                                                for q in self._quotes.values()]))
+        full_rebuild = self._strike_grid is None or not np.array_equal(strike_grid, self._strike_grid) or \
+                       not np.array_equal(expiry_grid, self._expiry_grid)
+
+        self._strike_grid = strike_grid
+        self._expiry_grid = expiry_grid
+        if full_rebuild:
+            self._total_variance = np.array([self._build_row(T) for T in expiry_grid])
+            rows = np.arange(expiry_grid.shape[0])
+        else:
+            rows = np.searchsorted(expiry_grid, sorted(self._dirty))
+            for i in rows:
+                self._total_variance[i] = self._build_row(expiry_grid[i])
+
+        # strike slopes of total variance per cell, with a zero slope column to keep one cell per grid point
+        if full_rebuild:
+            self._slope = np.zeros_like(self._total_variance)
+        if strike_grid.shape[0] > 1:
+            self._slope[rows, :-1] = np.diff(self._total_variance[rows], axis=1) / np.diff(strike_grid)
+        self._dirty = set()
+
+    def _total_variance_at(self, row, K, cell):
+        return(self._total_variance[row, cell] + self._slope[row, cell] * (K - self._strike_grid[cell]))
+
+    def get_sigma(self, K, T, ticker = None):
+        '''
+        return the implied vols for arrays of strikes and expiries (broadcast against each other);
+        ticker is accepted for interface compatibility with VolatilitySurfaceCache and ignored
+        '''
+        self._rebuild()
+        K, T = np.broadcast_arrays(np.asarray(K, dtype=np.float64), np.asarray(T, dtype=np.float64))
+
+        K_clipped = np.clip(K, self._strike_grid[0], self._strike_grid[-1])
+        cell = np.clip(np.searchsorted(self._strike_grid, K_clipped, side='right') - 1, 0, self._strike_grid.shape[0] - 1)
+
+        num_expiries = self._expiry_grid.shape[0]
+        T_clipped = np.clip(T, self._expiry_grid[0], self._expiry_grid[-1])
+        upper = np.clip(np.searchsorted(self._expiry_grid, T_clipped, side='left'), 1, max(num_expiries - 1, 1))
+        lower = upper - 1
+        if num_expiries == 1:
+            upper = lower = np.zeros_like(upper)
+
+        w_lower = self._total_variance_at(lower, K_clipped, cell)
+        w_upper = self._total_variance_at(upper, K_clipped, cell)
+        T_lower = self._expiry_grid[lower]
+        T_upper = self._expiry_grid[upper]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(T_upper > T_lower, (T_clipped - T_lower) / (T_upper - T_lower), 0.0)
+        w = w_lower + weight * (w_upper - w_lower)
+
+        # w is the total variance at T_clipped, so dividing by T_clipped keeps the vol flat beyond the grid
+        return(np.sqrt(w / T_clipped))
+
+
+class VolatilitySurfaceCache(object):
+    '''
+    One VolatilitySurface per underlying ticker, created on the first quotes for a ticker and
+    updated incrementally afterwards
+    '''
+
+    def __init__(self):
+        self._surfaces = {}
+
+    def update_quotes(self, ticker, strikes, expiries, vols):
+        if ticker in self._surfaces:
+            self._surfaces[ticker].add_quotes(strikes, expiries, vols)
+        else:
+            self._surfaces[ticker] = VolatilitySurface(strikes, expiries, vols)
+
+    def get_surface(self, ticker):
+        return(self._surfaces[ticker])
+
+    def get_sigma(self, K, T, ticker):
+        if ticker not in self._surfaces:
+            raise Exception(f"No volatility surface for {ticker}")
+        return(self._surfaces[ticker].get_sigma(K, T))
+
+
+def _test():
+    # quotes with a smile on 4 expiries
+    S_0 = 100.0
+    expiries = np.repeat([0.25, 0.5, 1.0, 2.0], 9)
+    strikes = np.tile(np.linspace(60, 140, 9), 4)
+    vols = 0.2 + 0.4 * np.log(strikes / S_0) ** 2 + 0.02 * expiries
+
+    cache = VolatilitySurfaceCache()
+    cache.update_quotes('Test', strikes, expiries, vols)
+    surface = cache.get_surface('Test')
+
+    print("Quoted points reproduced:", np.allclose(surface.get_sigma(strikes, expiries), vols))
+
+    K = np.random.default_rng(0).uniform(50, 150, 1000000)
+    T = np.random.default_rng(1).uniform(0.05, 3.0, 1000000)
+    start = time.perf_counter()
+    surface.get_sigma(K, T)
+    print(f"1,000,000 lookups in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # a new quote only rebuilds its own expiry
+    cache.update_quotes('Test', [100.0], [0.5], [0.3])
+    print("Updated ATM 6M vol:", surface.get_sigma(100.0, 0.5))
+
+    # price with the surface in place of the flat Stock.sigma
+    model = BlackScholesModel(datetime.datetime.now(), 0.05, vol_surface=cache)
+    stock = Stock(opt=None, db_connection=None, ticker='Test', spot_price=S_0, sigma=0.2)
+    for K in [80, 100, 120]:
+        print(f"6M call K={K}:", model.calc_model_price(EuropeanCallOption(stock, time_to_expiry=0.5, strike=K)))
+
+if __name__ == "__main__":
+    _test()
@@ -8,6 +8,8 @@ import pandas_datareader as pdr
 import yfinance as yf
 
 import option
+import db
+import schema
 
 def get_daily_from_yahoo(ticker, start_date, end_date):                        #acquires daily stock data from Yahoo finance
     stock = yf.Ticker(ticker)                                                  #object representing stock/financial instrument to be called
@@ -37,7 +39,7 @@ def download_data_to_csv(opt, list_of_tickers):                                #
 
     pass
 
-def csv_to_table(csv_file_name, fields_map, db_connection, db_table):
+def csv_to_table(csv_file_name, fields_map, db_manager, db_table):
     
         # insert data from a csv file to a table
         df = pd.read_csv(csv_file_name)
@@ -59,15 +61,6 @@ def csv_to_table(csv_file_name, fields_map, db_connection, db_table):
 
         ticker = os.path.basename(csv_file_name).replace('.csv','').replace("_daily", "")
         print(ticker)
-        cursor = db_connection.cursor()
-
-        # Delete old data for the ticker
-        sql_delete = f"DELETE FROM {db_table} WHERE Ticker = '{ticker}'"
-        #print(sql_delete)
-        cursor.execute(sql_delete)
-        
-        #print(new_df)
-        data = new_df.values.tolist()
 
         # Insert new data with IGNORE clause to handle duplicates
         sql_insert = f"INSERT OR REPLACE INTO {db_table} (Ticker, AsOfDate, Open, High, Low, Close, Volume, TurnOver, Dividend) "
@@ -75,19 +68,29 @@ def csv_to_table(csv_file_name, fields_map, db_connection, db_table):
         #print(sql_insert)
 
         try:
-            cursor.executemany(sql_insert, data)
-            db_connection.commit()
-            # Close the cursor and database connection
-            cursor.close()
+            # the delete and the inserts are one transaction, rolled back together if either fails
+            with db_manager.writer() as db_connection:
+                # a new database gets the current typed layout
+                schema.create_daily_price_table(db_connection)
+                version = schema.get_schema_version(db_connection)
+                if version >= 2:
+                    new_df['AsOfDate'] = schema.to_sql_dates(version, new_df['AsOfDate'])
+                #print(new_df)
+                data = new_df.values.tolist()
+
+                cursor = db_connection.cursor()
+                # Delete old data for the ticker
+                cursor.execute(f"DELETE FROM {db_table} WHERE Ticker = ?", (ticker,))
+                cursor.executemany(sql_insert, data)
+                cursor.close()
             # Print that data successfully inserted
             print("Data inserted successfully!")
         except Exception as e:
-            print(f"Failed in uploading {ticker} because {e}")       
+            print(f"Failed in uploading {ticker} because {e}")
 
 def save_daily_data_to_sqlite(opt, daily_file_dir, list_of_tickers):
     # read all daily.csv files from a dir and load them into sqlite table
-    db_file = os.path.join(opt.sqlite_db)
-    db_conn = sqlite3.connect(db_file)
+    db_manager = db.get_manager(opt.sqlite_db)
     db_table = 'EquityDailyPrice'
     
     fields_map = {'Date': 'AsOfDate', 'Dividends': 'Dividend', 'Stock Splits': 'StockSplits'}
@@ -97,10 +100,11 @@ def save_daily_data_to_sqlite(opt, daily_file_dir, list_of_tickers):
     for ticker in list_of_tickers:
         file_name = os.path.join(daily_file_dir, f"{ticker}_daily.csv")
         #print(file_name)
-        csv_to_table(file_name, fields_map, db_conn, db_table)
+        # one write transaction per ticker on the shared writer connection
+        csv_to_table(file_name, fields_map, db_manager, db_table)
 
-    #close the db connection
-    db_conn.close()
+    with db_manager.writer() as db_conn:
+        schema.create_price_index(db_conn)
     
 def _test():
     ticker = 'MSFT'